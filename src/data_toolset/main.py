@@ -1,14 +1,23 @@
 import logging
+import os
+import sys
+import typing as T
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
-import polars
 
+from data_toolset.utils import cache, server
 from data_toolset.utils.avro import AvroUtils
+from data_toolset.utils.base import BaseUtils
 from data_toolset.utils.parquet import ParquetUtils
 
 DEFAULT_RECORDS = 20
-polars.Config.set_tbl_cols(5000)
-polars.Config.set_fmt_str_lengths(5000)
+# Options of the data-toolset command itself, not passed to the subcommands
+GLOBAL_ARGS = ("command", "cache_dir", "cache_size", "socket")
+# Subcommands always run in the calling process
+LOCAL_COMMANDS = ("serve", "shell")
+# Same as polars.Config.set_tbl_cols(5000) and set_fmt_str_lengths(5000), without importing polars
+os.environ["POLARS_FMT_MAX_COLS"] = "5000"
+os.environ["POLARS_FMT_STR_LEN"] = "5000"
 
 
 def get_file_format(file_path: Path) -> str:
@@ -38,20 +47,32 @@ def get_file_format(file_path: Path) -> str:
         raise ValueError("Unsupported file format.")
 
 
-def init_args() -> Namespace:
+def init_args(argv: T.Optional[T.List[str]] = None) -> Namespace:
     """
     Initialize and parse command-line arguments using argparse.
 
+    :param argv: Arguments to parse (default is sys.argv[1:]).
+    :type argv: List[str], optional
     :return: A namespace containing the parsed command-line arguments.
     :rtype: Namespace
     """
     parser = ArgumentParser()
+    # No defaults here, so that requests sent to the server can tell the cache options they set
+    parser.add_argument("--cache_dir", "--cache-dir", type=Path, action="store",
+                        help="Cache the results of query, stats and count in this directory until the files "
+                             f"change (default is ${cache.CACHE_DIR_ENV}, no caching if unset)")
+    parser.add_argument("--cache_size", "--cache-size", type=int, action="store",
+                        help="Maximum size of the cache in bytes, least recently used results are evicted "
+                             "(default is 1 GiB)")
+    parser.add_argument("--socket", type=Path, action="store", default=os.environ.get(server.SOCKET_ENV),
+                        help="Send commands to the server listening on this socket, or listen on it with serve "
+                             f"(default is ${server.SOCKET_ENV})")
 
     subparsers = parser.add_subparsers(help="commands", dest="command", required=True)
 
     # data-toolset head
     head_parser = subparsers.add_parser("head", help="Print the first N records from a file")
-    head_parser.add_argument("file_path", action="store", help="Path to a file")
+    head_parser.add_argument("file_path", type=Path, action="store", help="Path to a file")
     head_parser.add_argument("-n", type=int, action="store", default=DEFAULT_RECORDS,
                              help=f"Print count lines of each of the specified files (default is {DEFAULT_RECORDS})")
 
@@ -61,6 +82,14 @@ def init_args() -> Namespace:
     tail_parser.add_argument("-n", type=int, action="store", default=DEFAULT_RECORDS,
                              help=f"Print count lines of each of the specified files (default is {DEFAULT_RECORDS})")
 
+    # data-toolset slice
+    slice_parser = subparsers.add_parser("slice", help="Print N records starting at an offset")
+    slice_parser.add_argument("file_path", type=Path, action="store", help="Path to a file")
+    slice_parser.add_argument("--offset", type=int, action="store", default=0,
+                              help="Index of the first record to print (default is 0)")
+    slice_parser.add_argument("--limit", type=int, action="store", default=DEFAULT_RECORDS,
+                              help=f"Number of records to print (default is {DEFAULT_RECORDS})")
+
     # data-toolset meta
     meta_parser = subparsers.add_parser("meta", help="Print a file's metadata")
     meta_parser.add_argument("file_path", type=Path, action="store", help="Path to a file")
@@ -72,25 +101,81 @@ def init_args() -> Namespace:
     # data-toolset stats
     stats_parser = subparsers.add_parser("stats", help="Print statistics about a file")
     stats_parser.add_argument("file_path", type=Path, action="store", help="Path to a file")
+    stats_parser.add_argument("--workers", type=int, action="store", default=1,
+                              help="Number of processes used to decode Avro files (default is 1)")
+    stats_parser.add_argument("--metadata_only", "--metadata-only", default=None, action="store_true",
+                              help="Answer from Parquet footer statistics only, without reading any data")
+    stats_parser.add_argument("--profile", default=False, action="store_true",
+                              help="Add approximate distinct counts, quantiles and most frequent values")
+    stats_parser.add_argument("--profile_path", type=Path, action="store",
+                              help="Save the mergeable column profiles to a JSON file")
 
     # data-toolset query
     query_parser = subparsers.add_parser("query", help="Query a file")
-    query_parser.add_argument("file_path", type=Path, action="store", help="Path to a file")
+    query_parser.add_argument("file_path", nargs="+", type=Path, action="store",
+                              help="Paths to files, directories or glob patterns, each queried as one table "
+                                   "named after it or after an `alias=` prefix")
     query_parser.add_argument("query_expression", type=str, action="store", help="Query expression to apply")
+    query_parser.add_argument("--workers", type=int, action="store", default=1,
+                              help="Number of processes used to decode Avro files (default is 1)")
+    query_parser.add_argument("--output", type=Path, action="store",
+                              help="Stream the result to a .parquet, .csv, .json, .jsonl or .avro file")
+    query_parser.add_argument("--filename", action="store_true",
+                              help="Add a filename column with the file each row comes from")
+    query_parser.add_argument("--threads", type=int, action="store",
+                              help="Number of DuckDB worker threads (default is the number of CPU cores)")
+    query_parser.add_argument("--memory_limit", "--memory-limit", type=str, action="store",
+                              help="Maximum memory used by DuckDB, e.g. 4GB (default is 80%% of the RAM)")
+    query_parser.add_argument("--temp_directory", "--temp-directory", type=Path, action="store",
+                              help="Directory where DuckDB spills data that does not fit in memory")
+    query_parser.add_argument("--no_preserve_insertion_order", "--no-preserve-insertion-order",
+                              dest="preserve_insertion_order", action="store_false",
+                              help="Do not keep the file order in results without ORDER BY, to save memory")
+    query_parser.add_argument("--profile", action="store_true",
+                              help="Print the query plan with operator timings and the time of each stage")
+
+    # data-toolset shell
+    shell_parser = subparsers.add_parser("shell", help="Query files interactively, loading them once")
+    shell_parser.add_argument("file_path", nargs="+", type=Path, action="store",
+                              help="Paths to files, directories or glob patterns, each loaded as one table "
+                                   "named after it or after an `alias=` prefix")
+    shell_parser.add_argument("--workers", type=int, action="store", default=1,
+                              help="Number of processes used to decode Avro files (default is 1)")
+    shell_parser.add_argument("--filename", action="store_true",
+                              help="Add a filename column with the file each row comes from")
+    shell_parser.add_argument("--threads", type=int, action="store",
+                              help="Number of DuckDB worker threads (default is the number of CPU cores)")
+    shell_parser.add_argument("--memory_limit", "--memory-limit", type=str, action="store",
+                              help="Maximum memory used by DuckDB, e.g. 4GB (default is 80%% of the RAM)")
+    shell_parser.add_argument("--temp_directory", "--temp-directory", type=Path, action="store",
+                              help="Directory where DuckDB spills data that does not fit in memory")
+
+    # data-toolset serve
+    serve_parser = subparsers.add_parser("serve", help="Run commands sent by other data-toolset calls")
+    serve_parser.add_argument("--workers", type=int, action="store", default=server.DEFAULT_WORKERS,
+                              help="Number of commands run concurrently (default is 4)")
 
     # data-toolset validate
     validate_parser = subparsers.add_parser("validate", help="Validate a file")
     validate_parser.add_argument("file_path", type=Path, action="store", help="Path to a file")
     validate_parser.add_argument("--schema_path", type=Path, action="store", help="Path to the schema file")
+    validate_parser.add_argument("--workers", type=int, action="store", default=1,
+                                 help="Number of processes used to validate Avro files (default is 1)")
+    validate_parser.add_argument("--max_errors", "--max-errors", type=int, action="store", default=100,
+                                 help="Stop after reporting this many invalid values (default is 100)")
 
     # data-toolset merge
     merge_parser = subparsers.add_parser("merge", help="Merge multiple files into one")
     merge_parser.add_argument("file_path", nargs='+', type=Path, action="store", help="Paths to a files to be merged")
     merge_parser.add_argument("output_path", type=Path, action="store", help="Path to the merged output file")
+    merge_parser.add_argument("--target_row_group_size", "--target-row-group-size", type=int, action="store",
+                              help="Coalesce Parquet row groups into row groups of this many rows")
 
     # data-toolset count
     count_parser = subparsers.add_parser("count", help="Count the number of records in a file")
     count_parser.add_argument("file_path", type=Path, action="store", help="Path to a file")
+    count_parser.add_argument("--workers", type=int, action="store", default=1,
+                              help="Number of processes used to decode Avro files (default is 1)")
 
     # data-toolset to_json
     to_json_parser = subparsers.add_parser("to_json", help="Convert a file to JSON format")
@@ -98,6 +183,10 @@ def init_args() -> Namespace:
     to_json_parser.add_argument("output_path", type=Path, action="store", help="Path to the output JSON file")
     to_json_parser.add_argument("--pretty", default=False, type=bool, action="store",
                                 help="Pretty-print the JSON output (default is False)")
+    to_json_parser.add_argument("--ndjson", default=False, action="store_true",
+                                help="Write one JSON record per line instead of a JSON array")
+    to_json_parser.add_argument("--compression", default=None, choices=["gzip", "zstd"], action="store",
+                                help="Compress the output (default is uncompressed)")
 
     # data-toolset to_csv
     to_csv_parser = subparsers.add_parser("to_csv", help="Convert a file to CSV format")
@@ -128,6 +217,8 @@ def init_args() -> Namespace:
                                    choices=["lz4", "uncompressed", "snappy", "gzip", "lzo", "brotli", "zstd"],
                                    default="uncompressed", action="store",
                                    help="Specify the compression method for the output file (default is 'uncompressed')")
+    to_parquet_parser.add_argument("--workers", type=int, action="store", default=1,
+                                   help="Number of processes used to decode Avro files (default is 1)")
 
     # data-toolset random_sample
     random_sample_parser = subparsers.add_parser("random_sample", help="Randomly sample records from a file")
@@ -137,16 +228,63 @@ def init_args() -> Namespace:
     random_sample_parser.add_argument("--n", type=int, default=None, action="store", help="Number of records to sample")
     random_sample_parser.add_argument("--fraction", type=float, default=None, action="store",
                                       help="Fraction of records to sample (0.0 to 1.0)")
+    random_sample_parser.add_argument("--seed", type=int, default=None, action="store",
+                                      help="Seed of the random number generator, for reproducible samples")
+    random_sample_parser.add_argument("--block", action="store_true",
+                                      help="Approximate Parquet sample read from random row groups only")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return args
 
 
-def main() -> None:
-    args = init_args()
+def absolute_path(file_path: Path, cwd: Path) -> Path:
+    """
+    Make a path argument absolute, keeping its `alias=` prefix if any.
+    """
+    alias, path = BaseUtils.split_alias(file_path, cwd)
+    if alias is not None:
+        return Path(f"{alias}={cwd / path}")
+    return cwd / file_path
+
+
+def run_request(argv: T.List[str], cwd: Path) -> None:
+    """
+    Run a command line sent to the server, resolving its relative paths against the client's directory.
+
+    The cache options of the command line apply to this request only, the server's apply otherwise.
+
+    :param argv: Arguments of the command line.
+    :type argv: List[str]
+    :param cwd: Working directory of the client.
+    :type cwd: Path
+    """
+    args = init_args(argv)
+    for arg_name, value in vars(args).items():
+        if isinstance(value, Path):
+            setattr(args, arg_name, absolute_path(value, cwd))
+        elif isinstance(value, list):
+            setattr(args, arg_name, [absolute_path(v, cwd) if isinstance(v, Path) else v for v in value])
+    with cache.configured(args.cache_dir, args.cache_size):
+        run(args)
+
+
+def run(args: Namespace) -> None:
+    """
+    Run the subcommand of parsed command-line arguments.
+
+    :param args: Parsed command-line arguments.
+    :type args: Namespace
+    :raises ValueError: If the file format or the command is not supported.
+    """
+    if args.command == "serve":
+        socket_path = args.socket or server.default_socket_path()
+        server.serve(Path(socket_path), args.workers, run_request)
+        return
+
     # @TODO: need to find a better way for the merge case
     if isinstance(args.file_path, list):
-        file_path = Path(args.file_path[0])
+        # The format of globs, directories and aliased paths is the one of the first file they hold
+        file_path = BaseUtils.resolve_inputs(args.file_path[:1])[0][1][0]
     else:
         file_path = Path(args.file_path)
     file_format = get_file_format(file_path)
@@ -161,13 +299,31 @@ def main() -> None:
         function = getattr(utils_cls, args.command)
         function_args = []
         for arg_name in vars(args):
-            if arg_name != "command":
+            if arg_name not in GLOBAL_ARGS:
                 function_args.append(getattr(args, arg_name))
         function(*function_args)
     else:
         raise ValueError("Invalid command.")
 
 
+def main() -> None:
+    args = init_args()
+    cache_dir = getattr(args, "cache_dir", None) or os.environ.get(cache.CACHE_DIR_ENV)
+    cache.configure(Path(cache_dir) if cache_dir else None, getattr(args, "cache_size", None) or cache.DEFAULT_MAX_SIZE)
+    socket_path = getattr(args, "socket", None)
+    if socket_path and args.command not in LOCAL_COMMANDS:
+        argv = sys.argv[1:]
+        if getattr(args, "cache_dir", None) is None and cache_dir:
+            # The server doesn't see the client's environment
+            argv = ["--cache_dir", cache_dir] + argv
+        exit_code = server.forward(Path(socket_path), argv, Path.cwd())
+        if exit_code is not None:
+            if exit_code:
+                sys.exit(exit_code)
+            return
+    run(args)
+
+
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s %(message)s")
     main()
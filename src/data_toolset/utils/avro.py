@@ -1,31 +1,452 @@
-import os
+from __future__ import annotations
+
+import bisect
+import collections
+import itertools
 import json
 import logging
+import math
+import os
+import random
 import typing as T
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 
-import fastavro
-import polars
-import pyarrow as pa
+from data_toolset.utils import avro_blocks, cache
+from data_toolset.utils.base import BaseUtils, DEFAULT_BATCH_SIZE, QUERY_BATCH_SIZE
+from data_toolset.utils.lazy import lazy_import
 
-from data_toolset.utils.base import BaseUtils
+duckdb = lazy_import("duckdb")
+fastavro = lazy_import("fastavro")
+np = lazy_import("numpy")
+polars = lazy_import("polars")
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+pq = lazy_import("pyarrow.parquet")
 
 
 class AvroUtils(BaseUtils):
+    EXTENSIONS = (".avro",)
+    # Factories rather than types, so that pyarrow is only imported by the commands converting to Arrow
+    PRIMITIVE_TYPES = {
+        "null": lambda: pa.null(),
+        "boolean": lambda: pa.bool_(),
+        "int": lambda: pa.int32(),
+        "long": lambda: pa.int64(),
+        "float": lambda: pa.float32(),
+        "double": lambda: pa.float64(),
+        "bytes": lambda: pa.binary(),
+        "string": lambda: pa.string(),
+    }
+    LOGICAL_TYPES = {
+        "date": lambda: pa.date32(),
+        "time-millis": lambda: pa.time32("ms"),
+        "time-micros": lambda: pa.time64("us"),
+        "timestamp-millis": lambda: pa.timestamp("ms", tz="UTC"),
+        "timestamp-micros": lambda: pa.timestamp("us", tz="UTC"),
+        "local-timestamp-millis": lambda: pa.timestamp("ms"),
+        "local-timestamp-micros": lambda: pa.timestamp("us"),
+    }
+    # Splitting the file in more ranges than workers keeps them busy when blocks differ in size
+    RANGES_PER_WORKER = 4
+
+    @classmethod
+    def _to_arrow_type(cls, avro_type: T.Any, named_types: T.Dict[str, pa.DataType]) -> T.Tuple[pa.DataType, bool]:
+        """
+        Convert an Avro type into an Arrow type.
+
+        :return: A tuple of the Arrow type and whether the type is nullable.
+        :raises ValueError: If the Avro type has no Arrow equivalent (e.g. unions of several non-null types).
+        """
+        if isinstance(avro_type, list):
+            non_null = [t for t in avro_type if t != "null"]
+            if len(non_null) != 1:
+                raise ValueError(f"Unsupported Avro union: {avro_type}")
+            arrow_type, _ = cls._to_arrow_type(non_null[0], named_types)
+            return arrow_type, len(non_null) < len(avro_type)
+
+        if isinstance(avro_type, str):
+            if avro_type in cls.PRIMITIVE_TYPES:
+                return cls.PRIMITIVE_TYPES[avro_type](), avro_type == "null"
+            if avro_type in named_types:
+                return named_types[avro_type], False
+            raise ValueError(f"Unknown Avro type: {avro_type}")
+
+        type_name = avro_type["type"]
+        logical_type = avro_type.get("logicalType")
+        if logical_type in cls.LOGICAL_TYPES:
+            return cls.LOGICAL_TYPES[logical_type](), False
+        if logical_type == "decimal":
+            precision = avro_type["precision"]
+            decimal_type = pa.decimal128 if precision <= 38 else pa.decimal256
+            return decimal_type(precision, avro_type.get("scale", 0)), False
+
+        if type_name == "record":
+            fields = []
+            for field in avro_type["fields"]:
+                field_type, nullable = cls._to_arrow_type(field["type"], named_types)
+                fields.append(pa.field(field["name"], field_type, nullable=nullable))
+            arrow_type = pa.struct(fields)
+        elif type_name == "enum":
+            arrow_type = pa.string()
+        elif type_name == "fixed":
+            arrow_type = pa.binary(avro_type["size"])
+        elif type_name == "array":
+            arrow_type = pa.list_(cls._to_arrow_type(avro_type["items"], named_types)[0])
+        elif type_name == "map":
+            arrow_type = pa.map_(pa.string(), cls._to_arrow_type(avro_type["values"], named_types)[0])
+        else:
+            return cls._to_arrow_type(type_name, named_types)
+
+        if type_name in ("record", "enum", "fixed"):
+            name = avro_type["name"]
+            named_types[name] = arrow_type
+            named_types[name.rsplit(".", 1)[-1]] = arrow_type
+            if avro_type.get("namespace"):
+                named_types[f"{avro_type['namespace']}.{name}"] = arrow_type
+        return arrow_type, False
+
+    @classmethod
+    def to_arrow_schema(cls, avro_schema: T.Dict) -> pa.Schema:
+        """
+        Convert an Avro record schema into an Arrow schema.
+
+        :param avro_schema: Avro writer schema of the file.
+        :type avro_schema: Dict
+        :return: Arrow schema with one field per Avro record field.
+        :rtype: pa.Schema
+        :raises ValueError: If the schema contains types without an Arrow equivalent.
+        """
+        arrow_type, _ = cls._to_arrow_type(avro_schema, {})
+        if not pa.types.is_struct(arrow_type):
+            raise ValueError("Only Avro files of records can be converted to Arrow.")
+        return pa.schema(list(arrow_type))
+
+    @classmethod
+    def _to_batches(cls, records: T.Iterator[T.Dict], writer_schema: T.Dict,
+                    batch_size: int) -> T.Tuple[pa.Schema, T.Iterator[pa.RecordBatch]]:
+        """
+        Group decoded Avro records into Arrow record batches.
+
+        :return: A tuple of the Arrow schema and a lazy iterator over the batches.
+        """
+        try:
+            schema = cls.to_arrow_schema(writer_schema)
+            first_batch = None
+        except ValueError:
+            # Fall back to inferring the schema from the first batch of records
+            first_batch = pa.RecordBatch.from_pylist(list(itertools.islice(records, batch_size)))
+            schema = first_batch.schema
+
+        def batches() -> T.Iterator[pa.RecordBatch]:
+            if first_batch is not None and first_batch.num_rows:
+                yield first_batch
+            yield from cls._iter_batches(records, schema, batch_size)
+
+        return schema, batches()
+
+    @staticmethod
+    def _iter_batches(records: T.Iterator[T.Dict], schema: pa.Schema, batch_size: int) -> T.Iterator[pa.RecordBatch]:
+        while True:
+            chunk = list(itertools.islice(records, batch_size))
+            if not chunk:
+                break
+            yield pa.RecordBatch.from_pylist(chunk, schema=schema)
+
+    @classmethod
+    def project_schema(cls, writer_schema: T.Dict, columns: T.Optional[T.List[str]]) -> T.Dict:
+        """
+        Build a reader schema keeping only some fields of a record schema.
+
+        Reading with it makes fastavro skip the other fields instead of decoding them.
+
+        :param writer_schema: Avro writer schema of the file.
+        :type writer_schema: Dict
+        :param columns: Names of the fields to keep, or None to keep all of them.
+        :type columns: List[str], optional
+        :return: Reader schema, or the writer schema if it can't be projected.
+        :rtype: Dict
+        """
+        if columns is None or writer_schema.get("type") != "record":
+            return writer_schema
+        reader_schema = {**writer_schema, "fields": [field for field in writer_schema["fields"]
+                                                     if field["name"] in columns]}
+        try:
+            fastavro.parse_schema(reader_schema)
+        except (fastavro.schema.SchemaParseException, fastavro.schema.UnknownType):
+            # A kept field refers to a named type defined in a dropped one
+            return writer_schema
+        return reader_schema
+
+    @staticmethod
+    def block_index(file_path: Path) -> T.Tuple[avro_blocks.AvroHeader, T.List[avro_blocks.AvroBlock]]:
+        """
+        Build the block index of an Avro file, only once per version of the file in this process.
+
+        :param file_path: Path to the Avro file.
+        :type file_path: Path
+        :return: A tuple of the file header and the list of its blocks.
+        :rtype: Tuple[AvroHeader, List[AvroBlock]]
+        """
+        def build_index() -> T.Tuple[avro_blocks.AvroHeader, T.List[avro_blocks.AvroBlock]]:
+            with open(file_path, "rb") as f:
+                return avro_blocks.build_index(f)
+
+        return cache.memoize("avro_index", file_path, build_index)
+
+    @classmethod
+    def to_record_batch_reader(cls, file_path: Path, batch_size: int = DEFAULT_BATCH_SIZE,
+                               workers: int = 1, columns: T.Optional[T.List[str]] = None) -> pa.RecordBatchReader:
+        """
+        Stream an Avro file as Arrow record batches.
+
+        Records are decoded lazily, so at most `batch_size` records are held as Python objects at a time.
+        With several workers the file is split on block boundaries and the ranges are decoded in a
+        process pool; batches are still returned in file order.
+
+        :param file_path: Path to the Avro file to read.
+        :type file_path: Path
+        :param batch_size: Maximum number of records per batch.
+        :type batch_size: int
+        :param workers: Number of processes used to decode the file (default is 1).
+        :type workers: int
+        :param columns: Names of the fields to decode, or None to decode all of them.
+        :type columns: List[str], optional
+        :return: Record batch reader over the file.
+        :rtype: pa.RecordBatchReader
+        """
+        if workers > 1:
+            header, blocks = cls.block_index(file_path)
+            reader_schema = cls.project_schema(header.schema, columns)
+            try:
+                schema = cls.to_arrow_schema(reader_schema)
+            except ValueError:
+                # The schema has to be known upfront for the workers, read sequentially instead
+                schema = None
+            if schema is not None:
+                tasks = [(file_path, start, end, schema, reader_schema)
+                         for start, end in avro_blocks.split_blocks(blocks, workers * cls.RANGES_PER_WORKER)]
+                batches = (batch for _, task_batches in cls._read_parallel(tasks, batch_size, workers)
+                           for batch in task_batches)
+                return pa.RecordBatchReader.from_batches(schema, batches)
+
+        f = open(file_path, "rb")
+        reader_schema = None
+        if columns is not None:
+            reader_schema = cls.project_schema(avro_blocks.read_header(f).schema, columns)
+            f.seek(0)
+        avro_reader = fastavro.reader(f, reader_schema=reader_schema)
+        schema, batches = cls._to_batches(avro_reader, reader_schema or avro_reader.writer_schema, batch_size)
+
+        def read() -> T.Iterator[pa.RecordBatch]:
+            with f:
+                yield from batches
+
+        return pa.RecordBatchReader.from_batches(schema, read())
+
+    @classmethod
+    def _read_parallel(cls, tasks: T.List[T.Tuple[Path, int, int, pa.Schema, T.Optional[T.Dict]]], batch_size: int,
+                       workers: int) -> T.Iterator[T.Tuple[int, T.List[pa.RecordBatch]]]:
+        """
+        Decode block ranges in a process pool, keeping at most two ranges per worker in flight.
+
+        :param tasks: (file path, start, end, Arrow schema, reader schema) of each block range.
+        :return: Iterator over (task index, record batches of the range), in task order.
+        """
+        pending: T.Deque[T.Tuple[int, Future]] = collections.deque()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            try:
+                for i, task in enumerate(tasks):
+                    pending.append((i, executor.submit(_decode_block_range, *task[:4], batch_size, task[4])))
+                    if len(pending) >= workers * 2:
+                        i, future = pending.popleft()
+                        yield i, future.result()
+                while pending:
+                    i, future = pending.popleft()
+                    yield i, future.result()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    @classmethod
+    def _arrow_schema(cls, file_path: Path, reader_schema: T.Dict) -> pa.Schema:
+        """
+        Arrow schema of the records of a file read with a reader schema, inferred from the first record
+        if the Avro schema has no Arrow equivalent.
+        """
+        try:
+            return cls.to_arrow_schema(reader_schema)
+        except ValueError:
+            with open(file_path, "rb") as f:
+                records = list(itertools.islice(fastavro.reader(f, reader_schema=reader_schema), 1))
+            return pa.RecordBatch.from_pylist(records).schema
+
+    @classmethod
+    def register_source(cls, con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                        query_expression: str, workers: int = 1, filename: bool = False) -> None:
+        """
+        Expose Avro files to DuckDB as a single lazily decoded stream of record batches.
+
+        Only the fields referenced by the query are decoded, and only as far as DuckDB pulls batches, so
+        aggregations run in constant memory and LIMIT queries stop decoding early. The schemas of the files
+        are merged by field name. With several workers the block ranges of all files are decoded in a
+        single process pool.
+
+        :param con: DuckDB connection to register the files in.
+        :type con: duckdb.DuckDBPyConnection
+        :param table_name: Name of the table in queries.
+        :type table_name: str
+        :param file_paths: Paths to the Avro files.
+        :type file_paths: List[Path]
+        :param query_expression: Query that will be run on the files.
+        :type query_expression: str
+        :param workers: Number of processes used to decode the files (default is 1).
+        :type workers: int
+        :param filename: Whether to add a `filename` column with the path of each row's file.
+        :type filename: bool
+        """
+        referenced = cls.referenced_columns(query_expression)
+        headers = []
+        blocks = []
+        for file_path in file_paths:
+            if workers > 1:
+                header, file_blocks = cls.block_index(file_path)
+                blocks.append(file_blocks)
+            else:
+                with open(file_path, "rb") as f:
+                    header = avro_blocks.read_header(f)
+            headers.append(header)
+
+        file_columns = []
+        for header in headers:
+            columns = None
+            if referenced is not None:
+                fields = [field["name"] for field in header.schema.get("fields", [])]
+                # A query reading no field (e.g. count(*)) still needs one to count the records
+                columns = [name for name in fields if name.lower() in referenced] or fields[:1]
+            file_columns.append(columns)
+
+        if len(file_paths) == 1 and not filename:
+            reader = cls.to_record_batch_reader(file_paths[0], batch_size=QUERY_BATCH_SIZE, workers=workers,
+                                                columns=file_columns[0])
+            cls.register_reader(con, table_name, reader, query_expression)
+            return
+
+        reader_schemas = [cls.project_schema(header.schema, columns) for header, columns in zip(headers, file_columns)]
+        schemas = [cls._arrow_schema(file_path, reader_schema)
+                   for file_path, reader_schema in zip(file_paths, reader_schemas)]
+        schema = cls.unify_schemas(schemas)
+        if filename:
+            schema = schema.append(pa.field("filename", pa.string()))
+
+        def read_sequential() -> T.Iterator[pa.RecordBatch]:
+            for file_path, reader_schema in zip(file_paths, reader_schemas):
+                with open(file_path, "rb") as f:
+                    records = fastavro.reader(f, reader_schema=reader_schema)
+                    _, batches = cls._to_batches(records, reader_schema, QUERY_BATCH_SIZE)
+                    for batch in batches:
+                        yield cls.conform_batch(batch, schema, file_path if filename else None)
+
+        def read_parallel() -> T.Iterator[pa.RecordBatch]:
+            total_size = sum(file_path.stat().st_size for file_path in file_paths) or 1
+            tasks = []
+            for file_path, file_blocks, file_schema, reader_schema in zip(file_paths, blocks, schemas,
+                                                                          reader_schemas):
+                # Split each file in proportion to its size, small files are decoded in one go
+                num_ranges = round(file_path.stat().st_size / total_size * workers * cls.RANGES_PER_WORKER)
+                tasks.extend((file_path, start, end, file_schema, reader_schema)
+                             for start, end in avro_blocks.split_blocks(file_blocks, max(num_ranges, 1)))
+            for i, batches in cls._read_parallel(tasks, QUERY_BATCH_SIZE, workers):
+                for batch in batches:
+                    yield cls.conform_batch(batch, schema, tasks[i][0] if filename else None)
+
+        batches = read_parallel() if workers > 1 else read_sequential()
+        cls.register_reader(con, table_name, pa.RecordBatchReader.from_batches(schema, batches), query_expression)
+
     @classmethod
-    def to_arrow_table(cls, file_path: Path) -> pa.Table:
+    def _read_indexed_slice(cls, f: T.BinaryIO, header: avro_blocks.AvroHeader, blocks: T.List[avro_blocks.AvroBlock],
+                            offset: int, limit: int) -> pa.Table:
         """
-        Read a Avro file and convert it into an Arrow Table.
+        Decode `limit` records starting at record `offset`, reading only the blocks that hold them.
+        """
+        blocks = [block for block in blocks
+                  if block.start_record < offset + limit and block.start_record + block.num_records > offset]
+        if limit > 0 and blocks:
+            skip = offset - blocks[0].start_record
+            records = avro_blocks.read_block_range(f, header, blocks[0].offset, blocks[-1].end)
+            records = itertools.islice(records, skip, skip + limit)
+        else:
+            records = iter(())
+        schema, batches = cls._to_batches(records, header.schema, DEFAULT_BATCH_SIZE)
+        return pa.Table.from_batches(list(batches), schema=schema)
+
+    @classmethod
+    def read_slice(cls, file_path: Path, offset: int, limit: int) -> pa.Table:
+        """
+        Read a range of records from an Avro file, decoding only the blocks that contain them.
 
-        :param file_path: Path to the Parquet file to read.
+        :param file_path: Path to the Avro file to read.
         :type file_path: Path
-        :return: Arrow Table containing the data from the Parquet file.
+        :param offset: Index of the first record to read.
+        :type offset: int
+        :param limit: Maximum number of records to read.
+        :type limit: int
+        :return: Arrow Table containing the requested records.
         :rtype: pa.Table
         """
+        header, blocks = cls.block_index(file_path)
         with open(file_path, "rb") as f:
-            avro_reader = fastavro.reader(f)
-            table = pa.Table.from_pylist(list(avro_reader))
-            return table
+            return cls._read_indexed_slice(f, header, blocks, max(offset, 0), limit)
+
+    @classmethod
+    def tail(cls, file_path: Path, n: int = 20) -> polars.DataFrame:
+        """
+        Print the last N records of an Avro file.
+
+        The block index is used to seek straight to the last blocks of the file.
+
+        :param file_path: Path to the Avro file to read.
+        :type file_path: Path
+        :param n: Number of records to print from the end of the file.
+        :type n: int
+        :return: Polars Dataframe containing the last N records.
+        :rtype: polars.DataFrame
+        """
+        header, blocks = cls.block_index(file_path)
+        num_records = blocks[-1].start_record + blocks[-1].num_records if blocks else 0
+        with open(file_path, "rb") as f:
+            table = cls._read_indexed_slice(f, header, blocks, max(num_records - n, 0), n)
+        df = polars.from_arrow(table)
+        print(df)
+        return df
+
+    @classmethod
+    def count(cls, file_path: Path, workers: int = 1) -> int:
+        """
+        Count the number of records in an Avro file.
+
+        Record counts are read from the block headers while the block payloads are skipped,
+        so nothing is decompressed or decoded. The count is cached when a cache directory is configured.
+
+        :param file_path: Path to the Avro file to count records in.
+        :type file_path: Path
+        :param workers: Unused, counting is bound by I/O.
+        :type workers: int
+        :return: The total number of records in the file.
+        :rtype: int
+        """
+        key = cache.make_key("count", [file_path])
+        cached = cache.get(key)
+        if cached is not None:
+            num_rows = cached["count"][0].as_py()
+        else:
+            _, blocks = cls.block_index(file_path)
+            num_rows = sum(block.num_records for block in blocks)
+            if key is not None:
+                cache.put(key, pa.table({"count": [num_rows]}))
+        print(num_rows)
+        return num_rows
 
     @classmethod
     def validate_format(cls, file_path: Path) -> None:
@@ -71,95 +492,143 @@ class AvroUtils(BaseUtils):
             print(schema)
 
     @classmethod
-    def stats(cls, file_path: Path) -> T.Tuple[int, T.Dict]:
-        """
-        Calculate statistics for an Avro file.
-
-        :param file_path: Path to the Avro file to calculate statistics for.
-        :type file_path: Path
-        :return: A tuple containing the number of rows and column statistics.
-        :rtype: Tuple[int, dict]
-        """
-        with open(file_path, "rb") as f:
-            avro_reader = fastavro.reader(f)
-            num_rows = 0
-            column_stats = {}
-            for row in avro_reader:
-                num_rows += 1
-                for k, v in row.items():
-                    column_stat = column_stats.get(k, {
-                        "count": 0,
-                        "null_count": 0,
-                        "min": None,
-                        "max": None
-                    })
-                    column_stat["count"] += 1
-                    if v is None:
-                        column_stat["null_count"] += 1
-                    elif column_stat["min"] is None or cls.has_comparison_methods(v) and v < column_stat["min"]:
-                        column_stat["min"] = v
-                    elif column_stat["max"] is None or cls.has_comparison_methods(v) and v > column_stat["max"]:
-                        column_stat["max"] = v
-                    column_stats[k] = column_stat
-            print(json.dumps(column_stats, indent=4))
-            return num_rows, column_stats
-
-    @classmethod
-    def merge(cls, file_paths: T.List[Path], output_path: Path) -> None:
+    def merge(cls, file_paths: T.List[Path], output_path: Path,
+              target_row_group_size: T.Optional[int] = None) -> None:
         """
         Merge multiple Avro files into a single file.
 
+        When all files share the same writer schema and codec their blocks are copied byte for byte,
+        only rewriting the sync markers. Otherwise records are re-encoded with the schema and codec of
+        the first file, resolving the other files' records against that schema.
+
         :param file_paths: List of file paths to merge.
         :type file_paths: List[Path]
         :param output_path: Path to the output merged file.
         :type output_path: Path
+        :param target_row_group_size: Unused, Avro files have no row groups.
+        :type target_row_group_size: int, optional
         """
-        with open(output_path, mode="wb") as out:
-            with open(file_paths[0], "rb") as f:
-                avro_reader = fastavro.reader(f)
-                schema = avro_reader.writer_schema
-                fastavro.writer(out, schema, avro_reader, codec=avro_reader.codec, metadata=avro_reader.metadata)
+        headers = []
+        for file_path in file_paths:
+            with open(file_path, "rb") as f:
+                headers.append(avro_blocks.read_header(f))
+        first_header = headers[0]
 
-        with open(output_path, mode="a+b") as out:
-            for file_path in file_paths[1:]:
-                with open(file_path, mode="rb") as f:
-                    avro_reader = fastavro.reader(f)
-                    fastavro.writer(out, None, avro_reader, codec=avro_reader.codec, metadata=avro_reader.metadata)
+        # Write to a temporary file first, so that a merge failing halfway (e.g. on schemas that don't
+        # resolve) leaves no partial file behind
+        temp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, mode="wb") as out:
+                if all(header.schema == first_header.schema and header.codec == first_header.codec
+                       for header in headers):
+                    with open(file_paths[0], "rb") as f:
+                        out.write(f.read(first_header.size))
+                    for file_path, header in zip(file_paths, headers):
+                        with open(file_path, "rb") as f:
+                            avro_blocks.copy_blocks(f, header, out, first_header.sync_marker)
+                else:
+                    logging.info("Schemas or codecs differ, re-encoding records.")
+                    metadata = {key: value.decode("utf-8") for key, value in first_header.metadata.items()
+                                if not key.startswith("avro.")}
+                    fastavro.writer(out, first_header.schema, cls._iter_records(file_paths, first_header.schema),
+                                    codec=first_header.codec, metadata=metadata)
+            os.replace(temp_path, output_path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _iter_records(file_paths: T.List[Path], reader_schema: T.Dict) -> T.Iterator[T.Dict]:
+        for file_path in file_paths:
+            with open(file_path, "rb") as f:
+                yield from fastavro.reader(f, reader_schema=reader_schema)
 
     @classmethod
-    def validate(cls, file_path: Path, schema_path: T.Optional[Path] = None) -> None:
+    def validate(cls, file_path: Path, schema_path: T.Optional[Path] = None, workers: int = 1,
+                 max_errors: int = 100) -> None:
         """
         Validate an Avro file against a given schema.
 
+        Block boundaries and sync markers are always checked. With a schema every record is checked against
+        it, parsing the schema once and splitting the blocks between `workers` processes. Validation goes
+        on past invalid records and reports up to `max_errors` errors, each located by block index, record
+        offset and field path.
+
         :param file_path: Path to the Avro file to validate.
         :type file_path: Path
         :param schema_path: Path to the JSON schema file for validation.
         :type schema_path: Path
+        :param workers: Number of processes used to validate the file (default is 1).
+        :type workers: int
+        :param max_errors: Maximum number of errors to report before stopping (default is 100).
+        :type max_errors: int
+        :raises ValueError: If the file has invalid blocks or records that don't match the schema.
         """
         cls.validate_format(file_path)
+        _, blocks = cls.block_index(file_path)
 
         if schema_path:
             with open(schema_path, "r") as f:
                 schema = json.load(f)
+            try:
+                schema = fastavro.parse_schema(schema)
+            except fastavro.schema.SchemaParseException as e:
+                print(f"File validation failed: {str(e)}")
+                logging.error(f"File validation failed: {str(e)}")
+                return
 
-            with open(file_path, "rb") as f:
-                avro_reader = fastavro.reader(f)
-                try:
-                    fastavro.validation.validate_many(avro_reader, schema=schema)
-                    print("File validation successful.")
-                    logging.info("File validation successful.")
-                except fastavro.schema.SchemaParseException as e:
-                    print(f"File validation failed: {str(e)}")
-                    logging.error(f"File validation failed: {str(e)}")
+            errors = list(itertools.islice(cls._find_invalid_records(file_path, blocks, schema, workers, max_errors),
+                                           max_errors))
+            if errors:
+                block_starts = [block.start_record for block in blocks]
+                for record_offset, field, message in errors:
+                    block_index = bisect.bisect_right(block_starts, record_offset) - 1
+                    print(f"Block {block_index}, record {record_offset}, field {field}: {message}")
+                logging.error(f"File validation failed: {len(errors)} errors found.")
+                raise ValueError(f"File validation failed: {len(errors)} errors found"
+                                 f"{' (stopped at the limit)' if len(errors) >= max_errors else ''}.")
+            print("File validation successful.")
+            logging.info("File validation successful.")
 
         else:
             print("File is a valid Avro file.")
             logging.info("File is a valid Avro file.")
 
+    @classmethod
+    def _find_invalid_records(cls, file_path: Path, blocks: T.List[avro_blocks.AvroBlock], schema: T.Dict,
+                              workers: int, max_errors: int) -> T.Iterator[T.Tuple[int, str, str]]:
+        """
+        Yield (record offset, field path, message) for every schema violation, in file order.
+        """
+        if not blocks:
+            return
+        if workers <= 1:
+            with open(file_path, "rb") as f:
+                header = avro_blocks.read_header(f)
+                records = avro_blocks.read_block_range(f, header, blocks[0].offset, blocks[-1].end)
+                yield from _iter_invalid_records(records, 0, schema)
+            return
+
+        start_records = {block.offset: block.start_record for block in blocks}
+        ranges = avro_blocks.split_blocks(blocks, workers * cls.RANGES_PER_WORKER)
+        pending: T.Deque[Future] = collections.deque()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            try:
+                for start, end in ranges:
+                    pending.append(executor.submit(_validate_block_range, file_path, start, end,
+                                                   start_records[start], schema, max_errors))
+                    if len(pending) >= workers * 2:
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
     @classmethod
     def to_parquet(cls, file_path: Path, output_path: Path,
                    compression: T.Literal[
-                       "lz4", "uncompressed", "snappy", "gzip", "lzo", "brotli", "zstd"] = "uncompressed") -> None:
+                       "lz4", "uncompressed", "snappy", "gzip", "lzo", "brotli", "zstd"] = "uncompressed",
+                   workers: int = 1) -> None:
         """
         Convert an Avro file to a Parquet file.
 
@@ -169,17 +638,27 @@ class AvroUtils(BaseUtils):
         :type output_path: Path
         :param compression: The compression method to use for the Parquet file (default is 'uncompressed').
         :type compression: str
+        :param workers: Number of processes used to decode the file (default is 1).
+        :type workers: int
         """
-        table = cls.to_arrow_table(file_path)
-        df = polars.from_arrow(table)
-        df.write_parquet(file=output_path)
+        reader = cls.to_record_batch_reader(file_path, workers=workers)
+        with pq.ParquetWriter(output_path, reader.schema, compression=cls.parquet_compression(compression)) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
 
     @classmethod
-    def random_sample(cls, file_path: Path, output_path: Path, n: T.Optional[int] = None, fraction: T.Optional[float] = None,
+    def random_sample(cls, file_path: Path, output_path: Path, n: T.Optional[int] = None,
+                      fraction: T.Optional[float] = None, seed: T.Optional[int] = None, block: bool = False,
                       with_replacement: bool = False, shuffle: bool = False) -> None:
         """
         Create a random sample from an Avro file and save it as an Avro file.
 
+        Sampling is done in a single pass over the file: `n` records are sampled with reservoir sampling
+        (Algorithm L) and `fraction` with Bernoulli sampling. Both draw the gap to the next sampled record
+        instead of a number per record, so blocks holding no sampled record are skipped without being
+        decoded. The sample is written with the schema and codec of the input file, fraction samples as
+        they are drawn. Sampling with replacement still loads the whole file.
+
         :param file_path: Path to the Avro file to sample from.
         :type file_path: Path
         :param output_path: Path to the output Avro file for the random sample.
@@ -188,12 +667,155 @@ class AvroUtils(BaseUtils):
         :type n: int
         :param fraction: The fraction of records to include in the random sample (alternative to 'n').
         :type fraction: float
+        :param seed: Seed of the random number generator, for reproducible samples.
+        :type seed: int
+        :param block: Unused, Avro samples already skip the blocks that hold no sampled record.
+        :type block: bool
         :param with_replacement: Whether to sample with replacement (default is False).
         :type with_replacement: bool
         :param shuffle: Whether to shuffle the input data before sampling (default is False).
         :type shuffle: bool
+        :raises ValueError: If neither `n` nor `fraction` is given.
         """
-        table = cls.to_arrow_table(file_path)
-        df = polars.from_arrow(table)
-        sample_df = df.sample(n=n, fraction=fraction, with_replacement=with_replacement, shuffle=shuffle)
-        sample_df.write_avro(output_path)
+        if n is None and fraction is None:
+            raise ValueError("Either n or fraction must be given.")
+        if with_replacement:
+            df = polars.from_arrow(cls.to_arrow_table(file_path))
+            sample_df = df.sample(n=n, fraction=fraction, with_replacement=with_replacement, shuffle=shuffle,
+                                  seed=seed)
+            sample_df.write_avro(output_path)
+            return
+
+        rng = random.Random(seed)
+        header, blocks = cls.block_index(file_path)
+        with open(file_path, "rb") as f:
+            if n is not None:
+                records = cls._reservoir_sample(f, header, blocks, n, rng)
+            else:
+                records = cls._bernoulli_sample(f, header, blocks, fraction, rng)
+            if shuffle:
+                records = list(records)
+                rng.shuffle(records)
+
+            metadata = {key: value.decode("utf-8") for key, value in header.metadata.items()
+                        if not key.startswith("avro.")}
+            with open(output_path, "wb") as out:
+                fastavro.writer(out, header.schema, records, codec=header.codec, metadata=metadata)
+
+    @staticmethod
+    def _iter_records_at(f: T.BinaryIO, header: avro_blocks.AvroHeader, blocks: T.List[avro_blocks.AvroBlock],
+                         first: int, advance: T.Callable[[int], int]) -> T.Iterator[T.Tuple[int, T.Dict]]:
+        """
+        Yield the records at the requested indices, decoding only the blocks that hold them.
+
+        :param first: Index of the first record to yield.
+        :param advance: Called with the index of each yielded record, once it has been consumed, to get the
+            index of the next record to yield.
+        """
+        target = first
+        i = 0
+        while i < len(blocks):
+            # Seek to the block holding the target and decode from there while the targets stay close
+            while i < len(blocks) and target >= blocks[i].start_record + blocks[i].num_records:
+                i += 1
+            if i == len(blocks):
+                return
+            index = blocks[i].start_record
+            for record in avro_blocks.read_block_range(f, header, blocks[i].offset, blocks[-1].end):
+                if index == target:
+                    yield index, record
+                    target = advance(index)
+                index += 1
+                if index == blocks[i].start_record + blocks[i].num_records:
+                    i += 1
+                    if i == len(blocks) or target >= blocks[i].start_record + blocks[i].num_records:
+                        break
+
+    @staticmethod
+    def _random_open(rng: random.Random) -> float:
+        """
+        Draw a uniform number from the open interval (0, 1).
+        """
+        u = rng.random()
+        while u == 0.0:
+            u = rng.random()
+        return u
+
+    @classmethod
+    def _reservoir_sample(cls, f: T.BinaryIO, header: avro_blocks.AvroHeader, blocks: T.List[avro_blocks.AvroBlock],
+                          n: int, rng: random.Random) -> T.List[T.Dict]:
+        """
+        Sample `n` records uniformly without replacement with Algorithm L.
+        """
+        if n <= 0:
+            return []
+        reservoir = []
+        # log(W) is kept instead of W, so 1 - W stays accurate for large reservoirs
+        log_w = math.log(cls._random_open(rng)) / n
+
+        def advance(index: int) -> int:
+            if index + 1 < n:
+                return index + 1
+            return index + 1 + math.floor(math.log(cls._random_open(rng)) / math.log(-math.expm1(log_w)))
+
+        for _, record in cls._iter_records_at(f, header, blocks, 0, advance):
+            if len(reservoir) < n:
+                reservoir.append(record)
+            else:
+                reservoir[rng.randrange(n)] = record
+                log_w += math.log(cls._random_open(rng)) / n
+        return reservoir
+
+    @classmethod
+    def _bernoulli_sample(cls, f: T.BinaryIO, header: avro_blocks.AvroHeader, blocks: T.List[avro_blocks.AvroBlock],
+                          fraction: float, rng: random.Random) -> T.Iterator[T.Dict]:
+        """
+        Keep each record independently with probability `fraction`, drawing geometric gaps between them.
+        """
+        if fraction <= 0:
+            return
+
+        def gap() -> int:
+            if fraction >= 1:
+                return 0
+            return math.floor(math.log(cls._random_open(rng)) / math.log1p(-fraction))
+
+        for _, record in cls._iter_records_at(f, header, blocks, gap(), lambda index: index + 1 + gap()):
+            yield record
+
+
+def _decode_block_range(file_path: Path, start: int, end: int, schema: pa.Schema,
+                        batch_size: int, reader_schema: T.Optional[T.Dict] = None) -> T.List[pa.RecordBatch]:
+    """
+    Decode a range of Avro blocks into record batches, run in a worker process.
+    """
+    with open(file_path, "rb") as f:
+        header = avro_blocks.read_header(f)
+        records = avro_blocks.read_block_range(f, header, start, end, reader_schema)
+        return list(AvroUtils._iter_batches(records, schema, batch_size))
+
+
+def _iter_invalid_records(records: T.Iterable[T.Dict], start_record: int,
+                          schema: T.Dict) -> T.Iterator[T.Tuple[int, str, str]]:
+    for record_offset, record in enumerate(records, start_record):
+        try:
+            fastavro.validation.validate(record, schema, raise_errors=True)
+        except fastavro.validation.ValidationError as e:
+            # A value matching no branch of a union fails once per branch, report it once with the whole union
+            field_errors = {}
+            for error in e.errors:
+                field_errors.setdefault(error.field, (error.datum, []))[1].append(error.schema)
+            for field, (datum, schemas) in field_errors.items():
+                expected = schemas[0] if len(schemas) == 1 else schemas
+                yield record_offset, field, f"expected {json.dumps(expected)}, got {datum!r}"
+
+
+def _validate_block_range(file_path: Path, start: int, end: int, start_record: int, schema: T.Dict,
+                          max_errors: int) -> T.List[T.Tuple[int, str, str]]:
+    """
+    Check the records of a range of Avro blocks against a parsed schema, run in a worker process.
+    """
+    with open(file_path, "rb") as f:
+        header = avro_blocks.read_header(f)
+        records = avro_blocks.read_block_range(f, header, start, end)
+        return list(itertools.islice(_iter_invalid_records(records, start_record, schema), max_errors))
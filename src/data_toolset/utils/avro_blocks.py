@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import io
+import json
+import typing as T
+
+from data_toolset.utils.lazy import lazy_import
+
+fastavro = lazy_import("fastavro")
+
+MAGIC = b"Obj\x01"
+SYNC_SIZE = 16
+
+
+class AvroHeader(T.NamedTuple):
+    schema: T.Dict
+    codec: str
+    metadata: T.Dict[str, bytes]
+    sync_marker: bytes
+    size: int
+
+
+class AvroBlock(T.NamedTuple):
+    offset: int
+    data_offset: int
+    size: int
+    num_records: int
+    start_record: int
+
+    @property
+    def end(self) -> int:
+        """File offset right after the block's sync marker."""
+        return self.data_offset + self.size + SYNC_SIZE
+
+
+def read_long(fo: T.BinaryIO) -> int:
+    """
+    Read a zig-zag encoded variable-length Avro long.
+
+    :raises EOFError: If the stream is exhausted before the first byte.
+    """
+    byte = fo.read(1)
+    if not byte:
+        raise EOFError()
+    b = byte[0]
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        byte = fo.read(1)
+        if not byte:
+            raise ValueError("Truncated Avro long.")
+        b = byte[0]
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1)
+
+
+def read_header(fo: T.BinaryIO) -> AvroHeader:
+    """
+    Parse the header of an Avro container file.
+
+    :param fo: Binary file object positioned at the start of the file.
+    :type fo: BinaryIO
+    :return: Parsed header, its size in bytes included.
+    :rtype: AvroHeader
+    :raises ValueError: If the file is not an Avro container file.
+    """
+    if fo.read(4) != MAGIC:
+        raise ValueError("Not an Avro container file.")
+    metadata = {}
+    while True:
+        count = read_long(fo)
+        if count == 0:
+            break
+        if count < 0:
+            count = -count
+            read_long(fo)  # byte size of the map block
+        for _ in range(count):
+            key = fo.read(read_long(fo)).decode("utf-8")
+            metadata[key] = fo.read(read_long(fo))
+    sync_marker = fo.read(SYNC_SIZE)
+    schema = json.loads(metadata["avro.schema"])
+    codec = metadata.get("avro.codec", b"null").decode("utf-8")
+    return AvroHeader(schema, codec, metadata, sync_marker, fo.tell())
+
+
+def iter_blocks(fo: T.BinaryIO, header: AvroHeader) -> T.Iterator[AvroBlock]:
+    """
+    Walk the block headers of an Avro container file, seeking over the payloads.
+
+    Every block starts with its record count and payload size and ends with the file's sync marker,
+    so block boundaries are found without decompressing or decoding any records.
+
+    :param fo: Seekable binary file object of the file.
+    :type fo: BinaryIO
+    :param header: Header of the file as returned by `read_header`.
+    :type header: AvroHeader
+    :return: Iterator over the blocks of the file, in file order.
+    :rtype: Iterator[AvroBlock]
+    :raises ValueError: If a block is not followed by the file's sync marker.
+    """
+    offset = header.size
+    start_record = 0
+    while True:
+        fo.seek(offset)
+        try:
+            num_records = read_long(fo)
+        except EOFError:
+            return
+        size = read_long(fo)
+        data_offset = fo.tell()
+        fo.seek(size, io.SEEK_CUR)
+        if fo.read(SYNC_SIZE) != header.sync_marker:
+            raise ValueError(f"Invalid sync marker after the block at offset {offset}.")
+        block = AvroBlock(offset, data_offset, size, num_records, start_record)
+        yield block
+        offset = block.end
+        start_record += num_records
+
+
+def build_index(fo: T.BinaryIO) -> T.Tuple[AvroHeader, T.List[AvroBlock]]:
+    """
+    Build the block index of an Avro container file.
+
+    :param fo: Seekable binary file object of the file.
+    :type fo: BinaryIO
+    :return: A tuple of the file header and the list of its blocks.
+    :rtype: Tuple[AvroHeader, List[AvroBlock]]
+    """
+    fo.seek(0)
+    header = read_header(fo)
+    return header, list(iter_blocks(fo, header))
+
+
+class BlockRangeIO(io.RawIOBase):
+    """
+    Read-only view of an Avro file made of its header followed by a contiguous range of its blocks.
+
+    The view is itself a valid Avro container file, so it can be decoded with `fastavro.reader`.
+    """
+
+    def __init__(self, fo: T.BinaryIO, header_bytes: bytes, start: int, end: int) -> None:
+        self._fo = fo
+        self._prefix = header_bytes
+        self._position = start
+        self._end = end
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: T.Any) -> int:
+        if self._prefix:
+            n = min(len(buffer), len(self._prefix))
+            buffer[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        size = min(len(buffer), self._end - self._position)
+        if size <= 0:
+            return 0
+        self._fo.seek(self._position)
+        data = self._fo.read(size)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def read_block_range(fo: T.BinaryIO, header: AvroHeader, start: int, end: int,
+                     reader_schema: T.Optional[T.Dict] = None) -> T.Iterator[T.Dict]:
+    """
+    Decode the records of the blocks located between two file offsets.
+
+    :param fo: Seekable binary file object of the file.
+    :type fo: BinaryIO
+    :param header: Header of the file as returned by `read_header`.
+    :type header: AvroHeader
+    :param start: Offset of the first block to decode.
+    :type start: int
+    :param end: Offset right after the sync marker of the last block to decode.
+    :type end: int
+    :param reader_schema: Schema to resolve the records to, e.g. to decode only some fields.
+    :type reader_schema: Dict, optional
+    :return: Iterator over the decoded records.
+    :rtype: Iterator[Dict]
+    """
+    fo.seek(0)
+    header_bytes = fo.read(header.size)
+    return fastavro.reader(io.BufferedReader(BlockRangeIO(fo, header_bytes, start, end)), reader_schema=reader_schema)
+
+
+def split_blocks(blocks: T.List[AvroBlock], num_ranges: int) -> T.List[T.Tuple[int, int]]:
+    """
+    Group consecutive blocks into byte ranges of roughly equal size.
+
+    :param blocks: Blocks of the file as returned by `iter_blocks`.
+    :type blocks: List[AvroBlock]
+    :param num_ranges: Desired number of ranges.
+    :type num_ranges: int
+    :return: List of (start, end) file offsets, each covering whole blocks, in file order.
+    :rtype: List[Tuple[int, int]]
+    """
+    if not blocks:
+        return []
+    target_size = (blocks[-1].end - blocks[0].offset) / max(num_ranges, 1)
+    ranges = []
+    start = blocks[0].offset
+    for block in blocks:
+        if block.end - start >= target_size:
+            ranges.append((start, block.end))
+            start = block.end
+    if start < blocks[-1].end:
+        ranges.append((start, blocks[-1].end))
+    return ranges
+
+
+def copy_blocks(fo: T.BinaryIO, header: AvroHeader, out: T.BinaryIO, sync_marker: bytes) -> int:
+    """
+    Copy the blocks of an Avro container file byte for byte, replacing their sync marker.
+
+    The record counts, sizes and compressed payloads are copied as they are, so nothing is decompressed
+    or decoded. The destination must have been written with the same schema and codec.
+
+    :param fo: Seekable binary file object of the source file.
+    :type fo: BinaryIO
+    :param header: Header of the source file as returned by `read_header`.
+    :type header: AvroHeader
+    :param out: Binary file object to append the blocks to.
+    :type out: BinaryIO
+    :param sync_marker: Sync marker of the destination file.
+    :type sync_marker: bytes
+    :return: Number of records copied.
+    :rtype: int
+    """
+    num_records = 0
+    for block in iter_blocks(fo, header):
+        fo.seek(block.offset)
+        out.write(fo.read(block.data_offset + block.size - block.offset))
+        out.write(sync_marker)
+        num_records += block.num_records
+    return num_records
@@ -1,20 +1,87 @@
+from __future__ import annotations
+
+import contextlib
+import glob
+import json
+import logging
+import tempfile
+import threading
+import time
 import typing as T
+import weakref
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import duckdb
-import polars
-import pyarrow as pa
+from data_toolset.utils import cache, writers
+from data_toolset.utils.lazy import lazy_import
+from data_toolset.utils.shell import QueryShell
+from data_toolset.utils.sketches import ColumnProfile, save_profiles
+from data_toolset.utils.utils import DataEncoder
+
+duckdb = lazy_import("duckdb")
+polars = lazy_import("polars")
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+
+DEFAULT_BATCH_SIZE = 65536
+# Smaller batches for queries, so LIMIT queries stop decoding soon after they are satisfied
+QUERY_BATCH_SIZE = 8192
+# Rows printed when a query result is written to a file
+PREVIEW_ROWS = 20
+# Functions whose result changes from one run to the next, so queries calling them are never cached
+VOLATILE_FUNCTIONS = {"random", "setseed", "uuid", "gen_random_uuid", "now", "today", "current_date",
+                      "current_time", "current_timestamp", "get_current_time", "get_current_timestamp",
+                      "current_setting", "nextval", "currval"}
+
+
+class ClosableBatches:
+    """
+    Record batches of a reader registered in DuckDB, which can be closed before the reader is exhausted.
+
+    DuckDB scans a registered reader from Arrow's threads, which read batches ahead of a query stopped
+    early (e.g. LIMIT) and would still be running Python code when the interpreter exits, crashing it.
+    Closing releases the reader, with its generator and open file, on the calling thread, and makes the
+    next read from Arrow's threads end the stream.
+    """
+
+    def __init__(self, reader: pa.RecordBatchReader) -> None:
+        self._reader = reader
+        self._lock = threading.Lock()
+        self._closed = False
+        # Set once Arrow no longer holds the batches
+        self.released = threading.Event()
+
+    def __iter__(self) -> "ClosableBatches":
+        return self
+
+    def __next__(self) -> pa.RecordBatch:
+        with self._lock:
+            if self._closed:
+                raise StopIteration
+            return self._reader.read_next_batch()
+
+    def __del__(self) -> None:
+        self.released.set()
+
+    def close(self) -> None:
+        # Waits for the batch being read by another thread, if any
+        with self._lock:
+            self._closed = True
+            self._reader.close()
+            self._reader = None
+
+
+# Readers registered in each connection, to be closed by `BaseUtils.connect`
+_registered_readers: "weakref.WeakKeyDictionary[T.Any, T.List[T.Tuple[str, ClosableBatches]]]" = \
+    weakref.WeakKeyDictionary()
+# How long closing a connection waits for Arrow's threads to release its readers
+RELEASE_TIMEOUT = 5
 
 
 class BaseUtils(ABC):
-    @classmethod
-    def has_comparison_methods(cls, obj: T.Dict) -> bool:
-        try:
-            # @TODO: better solution is needed here
-            return obj < obj < obj == obj
-        except TypeError:
-            return False
+    # File extensions handled by the subclass, used to pick the class for each queried file
+    EXTENSIONS: T.Tuple[str, ...] = ()
 
     @staticmethod
     def print_metadata(schema: T.Any, metadata: T.Any, codec: T.Any, serialized_size: T.Any) -> None:
@@ -23,11 +90,42 @@ class BaseUtils(ABC):
         print(f"Codec: {codec}")
         print(f"Serialized size: {serialized_size}")
 
+    @staticmethod
+    def parquet_compression(compression: str) -> str:
+        """
+        Translate a CLI compression name into one understood by the pyarrow Parquet writer.
+
+        :param compression: Compression name as accepted by the `--compression` option.
+        :type compression: str
+        :return: Compression name for `pyarrow.parquet.ParquetWriter`.
+        :rtype: str
+        """
+        if compression == "uncompressed":
+            return "none"
+        if compression == "lzo":
+            # pyarrow can read LZO but has no LZO writer
+            logging.info("LZO compression is not supported by the Parquet writer, writing uncompressed.")
+            return "none"
+        return compression
+
     @classmethod
     @abstractmethod
-    def to_arrow_table(cls, file_path: Path) -> pa.Table:
+    def to_record_batch_reader(cls, file_path: Path, batch_size: int = DEFAULT_BATCH_SIZE,
+                               workers: int = 1, columns: T.Optional[T.List[str]] = None) -> pa.RecordBatchReader:
         ...
 
+    @classmethod
+    def to_arrow_table(cls, file_path: Path) -> pa.Table:
+        """
+        Read a file and convert it into an Arrow Table.
+
+        :param file_path: Path to the file to read.
+        :type file_path: Path
+        :return: Arrow Table containing the data from the file.
+        :rtype: pa.Table
+        """
+        return cls.to_record_batch_reader(file_path).read_all()
+
     @classmethod
     @abstractmethod
     def validate_format(cls, file_path: Path) -> None:
@@ -43,10 +141,191 @@ class BaseUtils(ABC):
     def schema(cls, file_path: Path) -> None:
         ...
 
+    @staticmethod
+    def column_stats(column: pa.Array) -> T.Dict:
+        """
+        Calculate count, null count, min and max of an Arrow array.
+
+        Min and max are left empty for nested types and types without an ordering.
+
+        :param column: Array to calculate statistics for.
+        :type column: pa.Array
+        :return: Column statistics.
+        :rtype: Dict
+        """
+        column_stat = {
+            "count": len(column),
+            "null_count": column.null_count,
+            "min": None,
+            "max": None
+        }
+        if column.null_count < len(column) and not pa.types.is_nested(column.type):
+            try:
+                min_max = pc.min_max(column)
+            except (pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                return column_stat
+            column_stat["min"] = min_max["min"].as_py()
+            column_stat["max"] = min_max["max"].as_py()
+        return column_stat
+
+    @staticmethod
+    def merge_column_stats(left: T.Dict, right: T.Dict) -> T.Dict:
+        """
+        Merge the statistics of two parts of the same column.
+
+        :param left: Statistics of the first part.
+        :type left: Dict
+        :param right: Statistics of the second part.
+        :type right: Dict
+        :return: Statistics of both parts.
+        :rtype: Dict
+        """
+        mins = [value for value in (left["min"], right["min"]) if value is not None]
+        maxs = [value for value in (left["max"], right["max"]) if value is not None]
+        return {
+            "count": left["count"] + right["count"],
+            "null_count": left["null_count"] + right["null_count"],
+            "min": min(mins) if mins else None,
+            "max": max(maxs) if maxs else None
+        }
+
     @classmethod
-    @abstractmethod
-    def stats(cls, file_path: Path) -> T.Tuple[int, dict]:
-        ...
+    def compute_stats(cls, reader: pa.RecordBatchReader,
+                      profiles: T.Optional[T.Dict[str, ColumnProfile]] = None) -> T.Tuple[int, T.Dict[str, T.Dict]]:
+        """
+        Calculate per-column statistics over a stream of record batches.
+
+        Each batch is reduced column by column with Arrow compute kernels on a thread pool,
+        and the partial results are merged, so memory is bounded by one batch.
+
+        :param reader: Record batches to calculate statistics for.
+        :type reader: pa.RecordBatchReader
+        :param profiles: Column profiles to update in the same pass; their estimates are added to the statistics.
+        :type profiles: Optional[Dict[str, ColumnProfile]]
+        :return: A tuple containing the number of rows and column statistics.
+        :rtype: Tuple[int, dict]
+        """
+        if profiles is not None:
+            for field in reader.schema:
+                profiles.setdefault(field.name, ColumnProfile.for_type(field.type))
+
+        def reduce_column(column_name: str, column: pa.Array) -> T.Dict:
+            if profiles is not None:
+                profiles[column_name].update(column)
+            return cls.column_stats(column)
+
+        num_rows = 0
+        column_stats = {}
+        with ThreadPoolExecutor(max_workers=pa.cpu_count()) as executor:
+            for batch in reader:
+                num_rows += batch.num_rows
+                partial_stats = executor.map(reduce_column, batch.schema.names, batch.columns)
+                for column_name, partial_stat in zip(batch.schema.names, partial_stats):
+                    if column_name in column_stats:
+                        partial_stat = cls.merge_column_stats(column_stats[column_name], partial_stat)
+                    column_stats[column_name] = partial_stat
+        if num_rows == 0:
+            column_stats = {column_name: cls.column_stats(pa.array([], type=field.type))
+                            for column_name, field in zip(reader.schema.names, reader.schema)}
+        if profiles is not None:
+            for column_name, column_stat in column_stats.items():
+                column_stat.update(profiles[column_name].summary())
+        return num_rows, column_stats
+
+    @classmethod
+    def stats(cls, file_path: Path, workers: int = 1, metadata_only: T.Optional[bool] = None,
+              profile: bool = False, profile_path: T.Optional[Path] = None) -> T.Tuple[int, dict]:
+        """
+        Calculate statistics for a file.
+
+        :param file_path: Path to the file to calculate statistics for.
+        :type file_path: Path
+        :param workers: Number of processes used to decode the file (default is 1).
+        :type workers: int
+        :param metadata_only: Only use statistics stored in the file's metadata, if the format has any.
+        :type metadata_only: Optional[bool]
+        :param profile: Add approximate distinct counts, quantiles and most frequent values (default is False).
+        :type profile: bool
+        :param profile_path: Path to save the mergeable column profiles to, implies `profile`.
+        :type profile_path: Optional[Path]
+        :return: A tuple containing the number of rows and column statistics.
+        :rtype: Tuple[int, dict]
+        """
+        profiles = {} if profile or profile_path else None
+        # Sketches are not cached, only the plain statistics
+        key = cache.make_key("stats", [file_path], metadata_only) if profiles is None else None
+        cached = cache.get(key)
+        if cached is not None:
+            num_rows, column_stats = cls.table_to_stats(cached)
+            cls.print_stats(column_stats)
+            return num_rows, column_stats
+
+        reader = cls.to_record_batch_reader(file_path, workers=workers)
+        num_rows, column_stats = cls.compute_stats(reader, profiles)
+        if key is not None:
+            cls.cache_stats(key, num_rows, column_stats, reader.schema)
+        cls.print_stats(column_stats, profiles, profile_path)
+        return num_rows, column_stats
+
+    @classmethod
+    def cache_stats(cls, key: str, num_rows: int, column_stats: T.Dict[str, T.Dict], schema: pa.Schema) -> None:
+        """
+        Cache statistics, logging rather than raising if they can't be, since they are computed already.
+        """
+        try:
+            cache.put(key, cls.stats_to_table(num_rows, column_stats, schema))
+        except (pa.ArrowException, OverflowError, OSError) as e:
+            logging.warning(f"Statistics could not be cached: {str(e)}")
+
+    @staticmethod
+    def stats_to_table(num_rows: int, column_stats: T.Dict[str, T.Dict], schema: pa.Schema) -> pa.Table:
+        """
+        Store statistics in a one-row table, with a struct column per column of the file.
+
+        The min and max fields of each struct have the type of their column in `schema`, so they are read
+        back unchanged.
+
+        :param num_rows: Number of rows of the file.
+        :type num_rows: int
+        :param column_stats: Statistics of each column, as returned by `compute_stats`.
+        :type column_stats: Dict[str, Dict]
+        :param schema: Schema of the file.
+        :type schema: pa.Schema
+        :rtype: pa.Table
+        """
+        arrays = []
+        for column_name, column_stat in column_stats.items():
+            value_type = schema.field(column_name).type
+            if pa.types.is_dictionary(value_type):
+                value_type = value_type.value_type
+            # Nested columns have no min or max
+            if pa.types.is_nested(value_type):
+                value_type = pa.null()
+            struct_type = pa.struct([("count", pa.int64()), ("null_count", pa.int64()), ("min", value_type),
+                                     ("max", value_type)])
+            arrays.append(pa.array([column_stat], struct_type))
+        table = pa.Table.from_arrays(arrays, names=list(column_stats))
+        return table.replace_schema_metadata({"num_rows": str(num_rows)})
+
+    @staticmethod
+    def table_to_stats(table: pa.Table) -> T.Tuple[int, T.Dict[str, T.Dict]]:
+        """
+        Read back statistics stored by `stats_to_table`.
+
+        :param table: Table returned by `stats_to_table`.
+        :type table: pa.Table
+        :return: A tuple containing the number of rows and column statistics.
+        :rtype: Tuple[int, Dict[str, Dict]]
+        """
+        num_rows = int(table.schema.metadata[b"num_rows"])
+        return num_rows, table.to_pylist()[0] if table.num_columns else {}
+
+    @staticmethod
+    def print_stats(column_stats: T.Dict[str, T.Dict], profiles: T.Optional[T.Dict[str, ColumnProfile]] = None,
+                    profile_path: T.Optional[Path] = None) -> None:
+        if profiles is not None and profile_path:
+            save_profiles(profiles, profile_path)
+        print(json.dumps(column_stats, indent=4, cls=DataEncoder))
 
     @classmethod
     def tail(cls, file_path: Path, n: int = 20) -> polars.DataFrame:
@@ -69,60 +348,149 @@ class BaseUtils(ABC):
     @classmethod
     def head(cls, file_path: Path, n: int = 20) -> polars.DataFrame:
         """
-        Print the first N records of a Parquet file.
+        Print the first N records of a file.
+
+        Decoding stops as soon as N records have been read.
 
-        :param file_path: Path to the Parquet file to read.
+        :param file_path: Path to the file to read.
         :type file_path: Path
         :param n: Number of records to print from the beginning of the file.
         :type n: int
         :return: Polars Dataframe containing the first N records.
         :rtype: polars.DataFrame
         """
-        table = cls.to_arrow_table(file_path)
-        df = polars.from_arrow(table.slice(length=n))
+        reader = cls.to_record_batch_reader(file_path, batch_size=cls.head_batch_size(n))
+        df = polars.from_arrow(cls.take(reader, n))
+        print(df)
+        return df
+
+    @staticmethod
+    def head_batch_size(n: int) -> int:
+        """
+        Batch size that lets a reader stop right after the first N records.
+        """
+        return max(min(n, DEFAULT_BATCH_SIZE), 1)
+
+    @staticmethod
+    def take(reader: pa.RecordBatchReader, n: int) -> pa.Table:
+        """
+        Read the first N rows of a record batch reader, pulling no more batches than needed.
+
+        :param reader: Reader to take the rows from.
+        :type reader: pa.RecordBatchReader
+        :param n: Number of rows to take.
+        :type n: int
+        :return: Arrow Table containing at most N rows.
+        :rtype: pa.Table
+        """
+        batches = []
+        num_rows = 0
+        while num_rows < n:
+            try:
+                batch = reader.read_next_batch()
+            except StopIteration:
+                break
+            batches.append(batch)
+            num_rows += batch.num_rows
+        return pa.Table.from_batches(batches, schema=reader.schema).slice(length=n)
+
+    @classmethod
+    def read_slice(cls, file_path: Path, offset: int, limit: int) -> pa.Table:
+        """
+        Read a range of records from a file.
+
+        :param file_path: Path to the file to read.
+        :type file_path: Path
+        :param offset: Index of the first record to read.
+        :type offset: int
+        :param limit: Maximum number of records to read.
+        :type limit: int
+        :return: Arrow Table containing the requested records.
+        :rtype: pa.Table
+        """
+        reader = cls.to_record_batch_reader(file_path)
+        offset = max(offset, 0)
+        batches = []
+        position = 0
+        for batch in reader:
+            if position >= offset + limit:
+                break
+            if position + batch.num_rows > offset:
+                start = max(offset - position, 0)
+                batches.append(batch.slice(start, offset + limit - position - start))
+            position += batch.num_rows
+        return pa.Table.from_batches(batches, schema=reader.schema)
+
+    @classmethod
+    def slice(cls, file_path: Path, offset: int = 0, limit: int = 20) -> polars.DataFrame:
+        """
+        Print `limit` records of a file starting at record `offset`.
+
+        :param file_path: Path to the file to read.
+        :type file_path: Path
+        :param offset: Index of the first record to print.
+        :type offset: int
+        :param limit: Maximum number of records to print.
+        :type limit: int
+        :return: Polars Dataframe containing the requested records.
+        :rtype: polars.DataFrame
+        """
+        df = polars.from_arrow(cls.read_slice(file_path, offset, limit))
         print(df)
         return df
 
     @classmethod
-    def count(cls, file_path: Path) -> int:
+    def count(cls, file_path: Path, workers: int = 1) -> int:
         """
         Count the number of records in an Avro file.
 
         :param file_path: Path to the Avro file to count records in.
         :type file_path: Path
+        :param workers: Number of processes used to decode the file (default is 1).
+        :type workers: int
         :return: The total number of records in the file.
         :rtype: int
         """
-        table = cls.to_arrow_table(file_path)
-        num_rows = table.num_rows
+        num_rows = sum(batch.num_rows for batch in cls.to_record_batch_reader(file_path, workers=workers))
         print(num_rows)
         return num_rows
 
     @classmethod
     @abstractmethod
-    def merge(cls, file_paths: T.List[Path], output_path: Path) -> None:
+    def merge(cls, file_paths: T.List[Path], output_path: Path,
+              target_row_group_size: T.Optional[int] = None) -> None:
         ...
 
     @classmethod
     @abstractmethod
-    def validate(cls, file_path: Path, schema_path: T.Optional[Path] = None) -> None:
+    def validate(cls, file_path: Path, schema_path: T.Optional[Path] = None, workers: int = 1,
+                 max_errors: int = 100) -> None:
         ...
 
     @classmethod
-    def to_json(cls, file_path: Path, output_path: Path, pretty: bool = False) -> None:
+    def to_json(cls, file_path: Path, output_path: Path, pretty: bool = False, ndjson: bool = False,
+                compression: T.Optional[T.Literal["gzip", "zstd"]] = None) -> None:
         """
         Convert an Avro file to a JSON file.
 
+        The file is streamed one record batch at a time, so files larger than memory can be converted.
+
         :param file_path: Path to the Avro file to convert.
         :type file_path: Path
         :param output_path: Path to the output JSON file.
         :type output_path: Path
-        :param pretty: Whether to format the JSON file with indentation (default is False).
+        :param pretty: Whether to format the JSON file with indentation (default is False), ignored with `ndjson`.
         :type pretty: bool
+        :param ndjson: Whether to write one record per line instead of a JSON array (default is False).
+        :type ndjson: bool
+        :param compression: Compression codec of the output, 'gzip' or 'zstd' (default is None, uncompressed).
+        :type compression: str, optional
         """
-        table = cls.to_arrow_table(file_path)
-        df = polars.from_arrow(table)
-        df.write_json(file=output_path, pretty=pretty, row_oriented=True)
+        reader = cls.to_record_batch_reader(file_path)
+        if ndjson:
+            writers.write_ndjson(reader, output_path, compression)
+        else:
+            writers.write_json(reader, output_path, pretty, compression)
 
     @classmethod
     def to_csv(cls, file_path: Path, output_path: Path, has_header: bool = True, delimiter: str = ",",
@@ -143,10 +511,8 @@ class BaseUtils(ABC):
         :param quote: The character used to enclose fields in quotes (default is '\"').
         :type quote: str
         """
-        table = cls.to_arrow_table(file_path)
-        df = polars.from_arrow(table)
-        df.write_csv(file=output_path, has_header=has_header, separator=delimiter, line_terminator=line_terminator,
-                     quote_char=quote)
+        reader = cls.to_record_batch_reader(file_path)
+        writers.write_csv(reader, reader.schema, output_path, has_header, delimiter, line_terminator, quote)
 
     @classmethod
     def to_avro(cls, file_path: Path, output_path: Path,
@@ -156,21 +522,447 @@ class BaseUtils(ABC):
     @classmethod
     def to_parquet(cls, file_path: Path, output_path: Path,
                    compression: T.Literal[
-                       "lz4", "uncompressed", "snappy", "gzip", "lzo", "brotli", "zstd"] = "uncompressed") -> None:
+                       "lz4", "uncompressed", "snappy", "gzip", "lzo", "brotli", "zstd"] = "uncompressed",
+                   workers: int = 1) -> None:
         pass
 
+    @staticmethod
+    def parse_query(query_expression: str) -> T.Optional[T.Dict]:
+        """
+        Parse a SELECT query into DuckDB's JSON syntax tree.
+
+        :param query_expression: SQL query.
+        :type query_expression: str
+        :return: Syntax tree, or None if DuckDB can't serialize the query.
+        :rtype: Dict, optional
+        """
+        con = duckdb.connect()
+        try:
+            tree = json.loads(con.execute("SELECT json_serialize_sql(?::VARCHAR)", [query_expression]).fetchone()[0])
+        except duckdb.Error:
+            return None
+        return None if tree.get("error") else tree
+
+    @staticmethod
+    def _iter_nodes(tree: T.Dict) -> T.Iterator[T.Dict]:
+        nodes = [tree]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, list):
+                nodes.extend(node)
+            elif isinstance(node, dict):
+                yield node
+                nodes.extend(node.values())
+
+    @classmethod
+    def referenced_columns(cls, query_expression: str) -> T.Optional[T.Set[str]]:
+        """
+        Find the column names a query may read, using DuckDB's parser.
+
+        Every identifier of a column reference is included, so struct fields and table aliases may be
+        returned as well. Names are lowercased, as DuckDB resolves them case-insensitively. Queries reading
+        columns without naming them, with `*`, NATURAL joins or whole rows (`SELECT t FROM 't.avro' t`),
+        may read all columns.
+
+        :param query_expression: SQL query.
+        :type query_expression: str
+        :return: Referenced column names, or None if the query may read all columns.
+        :rtype: Set[str], optional
+        """
+        tree = cls.parse_query(query_expression)
+        if tree is None:
+            return None
+        columns = set()
+        row_references = set()
+        table_names = set()
+        for node in cls._iter_nodes(tree):
+            if node.get("class") == "STAR" or node.get("ref_type") == "NATURAL":
+                return None
+            if node.get("class") == "COLUMN_REF":
+                columns.update(name.lower() for name in node["column_names"])
+                if len(node["column_names"]) == 1:
+                    row_references.add(node["column_names"][0].lower())
+            columns.update(name.lower() for name in node.get("using_columns", []))
+            if node.get("type") == "BASE_TABLE":
+                table_names.add(node["table_name"].lower())
+            if node.get("type") in ("BASE_TABLE", "SUBQUERY", "TABLE_FUNCTION") and node.get("alias"):
+                table_names.add(node["alias"].lower())
+        if row_references & table_names:
+            return None
+        return columns
+
+    @classmethod
+    def scans_once(cls, query_expression: str, table_name: str) -> bool:
+        """
+        Check whether a query reads a table at most once, so the table can be a one-shot stream.
+
+        Queries DuckDB can't serialize (DESCRIBE, SUMMARIZE, ...) are assumed to read it once.
+
+        :param query_expression: SQL query.
+        :type query_expression: str
+        :param table_name: Name of the table.
+        :type table_name: str
+        :rtype: bool
+        """
+        tree = cls.parse_query(query_expression)
+        if tree is None:
+            return True
+        scans = 0
+        for node in cls._iter_nodes(tree):
+            if node.get("type") == "BASE_TABLE" and node.get("table_name", "").lower() == table_name.lower():
+                scans += 1
+            elif node.get("cte_map", {}).get("map"):
+                # Common table expressions may be inlined once per reference
+                return False
+        return scans <= 1
+
     @classmethod
-    def query(cls, file_path: Path, query_expression: str, *, chunk_size: int = 1000000) -> T.Union[polars.DataFrame, polars.Series]:
+    def normalize_query(cls, query_expression: str, table_names: T.List[str]) -> T.Optional[str]:
+        """
+        Serialize a query into a canonical form to cache its result under.
+
+        Queries differing only in whitespace or keyword case get the same form. Queries whose result may
+        change while the queried files don't get none: queries calling volatile functions such as random(),
+        reading through table functions, or scanning tables other than `table_names` and their CTEs.
+
+        :param query_expression: SQL query.
+        :type query_expression: str
+        :param table_names: Names of the tables registered for the query.
+        :type table_names: List[str]
+        :return: Canonical form of the query, or None if its result can't be cached.
+        :rtype: str, optional
         """
-        Query and filter data in an Avro or Parquet file using SQL-like expressions.
+        tree = cls.parse_query(query_expression)
+        if tree is None:
+            return None
+        known_tables = {table_name.lower() for table_name in table_names}
+        scanned_tables = set()
+        for node in cls._iter_nodes(tree):
+            if node.get("class") == "FUNCTION" and node["function_name"].lower() in VOLATILE_FUNCTIONS:
+                return None
+            if node.get("type") == "TABLE_FUNCTION":
+                return None
+            if node.get("type") == "BASE_TABLE":
+                scanned_tables.add(node["table_name"].lower())
+            known_tables.update(cte["key"].lower() for cte in node.get("cte_map", {}).get("map", []))
+        if not scanned_tables <= known_tables:
+            return None
+        return json.dumps(tree, sort_keys=True)
 
-        :param file_path: Path to the Avro or Parquet file to query.
+    @classmethod
+    def register_reader(cls, con: duckdb.DuckDBPyConnection, table_name: str, reader: pa.RecordBatchReader,
+                        query_expression: str) -> None:
+        """
+        Register a record batch reader in DuckDB, which pulls batches from it on demand.
+
+        A reader can only be consumed once, so it is loaded into a temporary table instead when the query
+        reads the table several times (self-joins, subqueries, ...).
+
+        :param con: DuckDB connection to register the reader in.
+        :type con: duckdb.DuckDBPyConnection
+        :param table_name: Name of the table in queries.
+        :type table_name: str
+        :param reader: Record batch reader over the file.
+        :type reader: pa.RecordBatchReader
+        :param query_expression: Query that will be run on the table.
+        :type query_expression: str
+        """
+        if cls.scans_once(query_expression, table_name):
+            batches = ClosableBatches(reader)
+            con.register(table_name, pa.RecordBatchReader.from_batches(reader.schema, batches))
+            _registered_readers.setdefault(con, []).append((table_name, batches))
+            return
+        con.register("__data_toolset_source", reader)
+        quoted_name = table_name.replace('"', '""')
+        con.execute(f'CREATE TEMP TABLE "{quoted_name}" AS SELECT * FROM __data_toolset_source')
+        con.unregister("__data_toolset_source")
+
+    @staticmethod
+    @contextlib.contextmanager
+    def connect(config: T.Dict[str, T.Any]) -> T.Iterator[duckdb.DuckDBPyConnection]:
+        """
+        Open a DuckDB connection, closing the readers registered in it by `register_reader` on exit,
+        whether they were read to the end or not.
+
+        :param config: DuckDB configuration, see `duckdb_config`.
+        :type config: Dict[str, Any]
+        :return: Context manager yielding the connection.
+        :rtype: Iterator[duckdb.DuckDBPyConnection]
+        """
+        con = duckdb.connect(config=config)
+        try:
+            yield con
+        finally:
+            released = []
+            for table_name, batches in _registered_readers.pop(con, []):
+                con.unregister(table_name)
+                batches.close()
+                released.append(batches.released)
+                # Only Arrow's threads may hold the reader from now on
+                batches = None
+            # The scans end once the connection is closed, then Arrow's threads release the readers
+            con.close()
+            for event in released:
+                event.wait(RELEASE_TIMEOUT)
+
+    @classmethod
+    def register_source(cls, con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                        query_expression: str, workers: int = 1, filename: bool = False) -> None:
+        """
+        Expose files to DuckDB as a single table, merging their schemas by field name.
+
+        Subclasses push the projection of the query down to the file reader where the format allows it.
+
+        :param con: DuckDB connection to register the files in.
+        :type con: duckdb.DuckDBPyConnection
+        :param table_name: Name of the table in queries.
+        :type table_name: str
+        :param file_paths: Paths to the files.
+        :type file_paths: List[Path]
+        :param query_expression: Query that will be run on the files.
+        :type query_expression: str
+        :param workers: Number of processes used to decode the files (default is 1).
+        :type workers: int
+        :param filename: Whether to add a `filename` column with the path of each row's file.
+        :type filename: bool
+        """
+        if len(file_paths) == 1 and not filename:
+            reader = cls.to_record_batch_reader(file_paths[0], batch_size=QUERY_BATCH_SIZE, workers=workers)
+            cls.register_reader(con, table_name, reader, query_expression)
+            return
+
+        schema = cls.unify_schemas([cls.to_record_batch_reader(file_path, batch_size=1).schema
+                                    for file_path in file_paths])
+        if filename:
+            schema = schema.append(pa.field("filename", pa.string()))
+
+        def batches() -> T.Iterator[pa.RecordBatch]:
+            for file_path in file_paths:
+                for batch in cls.to_record_batch_reader(file_path, batch_size=QUERY_BATCH_SIZE, workers=workers):
+                    yield cls.conform_batch(batch, schema, file_path if filename else None)
+
+        cls.register_reader(con, table_name, pa.RecordBatchReader.from_batches(schema, batches()), query_expression)
+
+    @classmethod
+    def register_table(cls, con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                       workers: int = 1, filename: bool = False) -> None:
+        """
+        Load files into a DuckDB table, to run many queries on them while decoding them only once.
+
+        :param con: DuckDB connection to create the table in.
+        :type con: duckdb.DuckDBPyConnection
+        :param table_name: Name of the table in queries.
+        :type table_name: str
+        :param file_paths: Paths to the files.
+        :type file_paths: List[Path]
+        :param workers: Number of processes used to decode the files (default is 1).
+        :type workers: int
+        :param filename: Whether to add a `filename` column with the path of each row's file.
+        :type filename: bool
+        """
+        cls.register_source(con, "__data_toolset_source", file_paths, "SELECT * FROM __data_toolset_source",
+                            workers, filename)
+        quoted_name = table_name.replace('"', '""')
+        con.execute(f'CREATE TABLE "{quoted_name}" AS SELECT * FROM __data_toolset_source')
+        con.unregister("__data_toolset_source")
+
+    @staticmethod
+    def format_classes() -> T.List[T.Type["BaseUtils"]]:
+        """
+        List the utils class of each supported file format.
+
+        :rtype: List[Type[BaseUtils]]
+        """
+        # The format modules import this one, so they register their subclass once imported here
+        from data_toolset.utils import avro, parquet  # noqa: F401
+        return BaseUtils.__subclasses__()
+
+    @staticmethod
+    def utils_for(file_path: Path) -> T.Type["BaseUtils"]:
+        """
+        Find the utils class handling a file, based on its extension.
+
+        :param file_path: Path to the file.
         :type file_path: Path
+        :return: Utils class of the file format.
+        :rtype: Type[BaseUtils]
+        :raises ValueError: If the file format is not supported.
+        """
+        for utils_cls in BaseUtils.format_classes():
+            if file_path.suffix.lower() in utils_cls.EXTENSIONS:
+                return utils_cls
+        raise ValueError("Unsupported file format.")
+
+    @classmethod
+    def utils_for_table(cls, table_name: str, file_paths: T.List[Path]) -> T.Type["BaseUtils"]:
+        """
+        Find the utils class reading the files of a table.
+
+        :raises ValueError: If the files don't all have the same format.
+        """
+        utils_cls = cls.utils_for(file_paths[0])
+        if any(cls.utils_for(file_path) is not utils_cls for file_path in file_paths):
+            raise ValueError(f"Files of table {table_name} must all have the same format.")
+        return utils_cls
+
+    @staticmethod
+    def expand_path(file_path: Path) -> T.List[Path]:
+        """
+        Expand a glob pattern or a directory into the data files it holds.
+
+        Directories are searched recursively for files of a supported format, so partitioned layouts
+        such as `date=2023-01-01/part-0.parquet` are included.
+
+        :param file_path: Path to a file, a directory or a glob pattern.
+        :type file_path: Path
+        :return: Sorted list of files.
+        :rtype: List[Path]
+        :raises ValueError: If a glob pattern or directory matches no file.
+        """
+        if glob.has_magic(str(file_path)):
+            file_paths = [Path(path) for path in glob.glob(str(file_path), recursive=True)]
+        elif file_path.is_dir():
+            extensions = {extension for utils_cls in BaseUtils.format_classes() for extension in utils_cls.EXTENSIONS}
+            file_paths = [path for path in file_path.rglob("*") if path.suffix.lower() in extensions]
+        else:
+            return [file_path]
+        if not file_paths:
+            raise ValueError(f"No files found for {file_path}.")
+        return sorted(file_paths)
+
+    @staticmethod
+    def split_alias(file_path: Path, cwd: T.Optional[Path] = None) -> T.Tuple[T.Optional[str], Path]:
+        """
+        Split an `alias=path` argument into its alias and path.
+
+        An argument naming an existing path or matching a glob pattern is a path, not an alias, so that
+        relative partitioned paths such as `date=2023-01-01/part-0.parquet` are read as they are.
+
+        :param file_path: Path argument, optionally prefixed by `alias=`.
+        :type file_path: Path
+        :param cwd: Directory relative paths are relative to (default is the current directory).
+        :type cwd: Path, optional
+        :return: The alias, or None if there is none, and the path.
+        :rtype: Tuple[Optional[str], Path]
+        """
+        alias, separator, path = str(file_path).partition("=")
+        if not separator or not alias.isidentifier():
+            return None, file_path
+        full_path = file_path if cwd is None else cwd / file_path
+        if full_path.exists() or (glob.has_magic(str(full_path)) and glob.glob(str(full_path), recursive=True)):
+            return None, file_path
+        return alias, Path(path)
+
+    @classmethod
+    def resolve_inputs(cls, file_paths: T.List[Path]) -> T.List[T.Tuple[str, T.List[Path]]]:
+        """
+        Resolve the path arguments of a query into named tables.
+
+        Each argument becomes one table. A file keeps its file name as table name, a glob pattern or
+        directory is named after its last path component, and `alias=path` names the table `alias`, see
+        `split_alias`.
+
+        :param file_paths: Paths to files, directories or glob patterns, optionally prefixed by `alias=`.
+        :type file_paths: List[Path]
+        :return: List of (table name, files) tuples.
+        :rtype: List[Tuple[str, List[Path]]]
+        """
+        inputs = []
+        for file_path in file_paths:
+            alias, file_path = cls.split_alias(file_path)
+            if alias is None:
+                alias = file_path.name
+            inputs.append((alias, cls.expand_path(file_path)))
+        return inputs
+
+    @staticmethod
+    def unify_schemas(schemas: T.List[pa.Schema]) -> pa.Schema:
+        """
+        Merge schemas by field name, promoting types that differ between files (e.g. int32 and int64).
+
+        :param schemas: Schemas to merge.
+        :type schemas: List[pa.Schema]
+        :return: Schema with every field of every schema, in order of appearance.
+        :rtype: pa.Schema
+        """
+        return pa.unify_schemas(schemas, promote_options="permissive")
+
+    @staticmethod
+    def conform_batch(batch: pa.RecordBatch, schema: pa.Schema, file_path: T.Optional[Path] = None) -> pa.RecordBatch:
+        """
+        Cast a record batch to a unified schema, filling the fields it lacks with nulls.
+
+        :param batch: Record batch of one file.
+        :type batch: pa.RecordBatch
+        :param schema: Unified schema, ending with a `filename` field if `file_path` is given.
+        :type schema: pa.Schema
+        :param file_path: Path of the file the batch comes from.
+        :type file_path: Path, optional
+        :return: Record batch with the unified schema.
+        :rtype: pa.RecordBatch
+        """
+        columns = []
+        for field in schema:
+            if file_path is not None and field.name == "filename":
+                columns.append(pa.array([str(file_path)] * batch.num_rows, type=field.type))
+            elif field.name in batch.schema.names:
+                columns.append(batch.column(field.name).cast(field.type))
+            else:
+                columns.append(pa.nulls(batch.num_rows, type=field.type))
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    @staticmethod
+    def duckdb_config(threads: T.Optional[int] = None, memory_limit: T.Optional[str] = None,
+                      temp_directory: T.Optional[Path] = None, preserve_insertion_order: bool = True) -> T.Dict:
+        """
+        Build the configuration of a DuckDB connection, see `query` for the options.
+        """
+        config = {"preserve_insertion_order": preserve_insertion_order}
+        if threads is not None:
+            config["threads"] = threads
+        if memory_limit is not None:
+            config["memory_limit"] = memory_limit
+        if temp_directory is not None:
+            config["temp_directory"] = str(temp_directory)
+        return config
+
+    @classmethod
+    def query(cls, file_path: T.Union[Path, T.List[Path]], query_expression: str, workers: int = 1,
+              output_path: T.Optional[Path] = None, filename: bool = False, threads: T.Optional[int] = None,
+              memory_limit: T.Optional[str] = None, temp_directory: T.Optional[Path] = None,
+              preserve_insertion_order: bool = True, profile: bool = False, *, chunk_size: int = 1000000,
+              preview_rows: int = PREVIEW_ROWS) -> T.Union[polars.DataFrame, polars.Series]:
+        """
+        Query and filter data in Avro or Parquet files using SQL-like expressions.
+
+        :param file_path: Path, or list of paths, to Avro or Parquet files, directories or glob patterns.
+            See `resolve_inputs` for the table each of them is registered as.
+        :type file_path: Union[Path, List[Path]]
         :param query_expression: SQL-like query expression to filter and select data.
         :type query_expression: str
+        :param workers: Number of processes used to decode the file (default is 1).
+        :type workers: int
+        :param output_path: Path to a .parquet, .csv, .json, .jsonl or .avro file to write the result to.
+        :type output_path: Path, optional
+        :param filename: Whether to add a `filename` column with the path of each row's file.
+        :type filename: bool
+        :param threads: Number of DuckDB worker threads (default is the number of CPU cores).
+        :type threads: int, optional
+        :param memory_limit: Maximum memory used by DuckDB, e.g. '4GB' (default is 80% of the RAM).
+        :type memory_limit: str, optional
+        :param temp_directory: Directory where DuckDB spills data that does not fit in `memory_limit`.
+        :type temp_directory: Path, optional
+        :param preserve_insertion_order: Whether results without ORDER BY keep the order of the files
+            (default is True). Disabling it lets DuckDB use less memory for large results.
+        :type preserve_insertion_order: bool
+        :param profile: Whether to print the query plan with the time and row count of each operator,
+            and the time spent loading, registering, executing and fetching.
+        :type profile: bool
         :param chunk_size: Size of data chunks to retrieve per query iteration (default is 1,000,000 rows).
         :type chunk_size: int
-        :return: Polars DataFrame containing the result of the query.
+        :param preview_rows: Number of rows printed when the result is written to a file (default is 20).
+        :type preview_rows: int
+        :return: Polars DataFrame containing the result of the query, or its preview with `output_path`.
         :rtype: T.Union[polars.DataFrame, polars.Series]
 
         This class method allows you to run SQL-like queries on an Avro or Parquet file,
@@ -178,34 +970,136 @@ class BaseUtils(ABC):
 
         Example query expressions:
         - "SELECT * FROM 'weather.avro'" (selects all rows)
-        - "SELECT temperature, humidity FROM 'weather.avro' WHERE temperature > 25" (selects specific columns and applies a filter)
+        - "SELECT temperature, humidity FROM 'weather.avro' WHERE temperature > 25"
+          (selects specific columns and applies a filter)
+        - "SELECT * FROM 'weather.avro' w JOIN stations s USING (station_id)"
+          (joins with the table given as `stations=stations/*.parquet`)
 
-        The method retrieves data in chunks to optimize memory usage, and the result is returned as an Arrow Table.
+        Each table is registered in DuckDB with `register_source` and the result is retrieved in chunks
+        to optimize memory usage. With `output_path` the chunks are streamed to the output file one at
+        a time and only the first `preview_rows` rows are kept to be printed. Otherwise the result is
+        cached when a cache directory is configured, see `data_toolset.utils.cache`, until a queried
+        file changes.
         """
-        my_arrow_table = cls.to_arrow_table(file_path)
+        config = cls.duckdb_config(threads, memory_limit, temp_directory, preserve_insertion_order)
+        timings = {}
+        start = time.perf_counter()
+        file_paths = file_path if isinstance(file_path, list) else [file_path]
+        inputs = cls.resolve_inputs(file_paths)
+        timings["load"] = time.perf_counter() - start
 
-        con = duckdb.connect()
-        con.register(file_path.name, my_arrow_table)
+        key = None
+        if output_path is None and not profile:
+            normalized_query = cls.normalize_query(query_expression, [table_name for table_name, _ in inputs])
+            if normalized_query is not None:
+                key = cache.make_key("query", [path for _, table_paths in inputs for path in table_paths],
+                                     [[table_name, len(table_paths)] for table_name, table_paths in inputs],
+                                     normalized_query, filename, preserve_insertion_order)
+        cached = cache.get(key)
+        if cached is not None:
+            df = polars.from_arrow(cached)
+            print(df)
+            return df
 
-        # Run query that selects part of the data
-        query = con.execute(query_expression)
-        record_batch_reader = query.fetch_record_batch(rows_per_batch=chunk_size)
+        # Closing the connection closes the readers the query did not read to the end, see `ClosableBatches`
+        with cls.connect(config) as con, tempfile.TemporaryDirectory() as profile_directory:
+            start = time.perf_counter()
+            for table_name, table_paths in inputs:
+                utils_cls = cls.utils_for_table(table_name, table_paths)
+                utils_cls.register_source(con, table_name, table_paths, query_expression, workers, filename)
+            timings["register"] = time.perf_counter() - start
 
-        # Retrieve all batch chunks
-        all_chunks = []
-        while True:
-            try:
-                chunk = record_batch_reader.read_next_batch()
-                all_chunks.append(chunk)
-            except StopIteration:
-                break
-        table = pa.Table.from_batches(batches=all_chunks)
+            profile_path = Path(profile_directory) / "profile.txt"
+            if profile:
+                con.execute("PRAGMA enable_profiling='query_tree'")
+                con.execute(f"PRAGMA profiling_output='{profile_path}'")
+
+            # Run query that selects part of the data
+            start = time.perf_counter()
+            query = con.execute(query_expression)
+            record_batch_reader = query.fetch_record_batch(rows_per_batch=chunk_size)
+            timings["execute"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if output_path is not None:
+                preview = []
+                num_rows = 0
+
+                def batches() -> T.Iterator[pa.RecordBatch]:
+                    nonlocal num_rows
+                    for batch in record_batch_reader:
+                        if num_rows < preview_rows:
+                            preview.append(batch.slice(0, preview_rows - num_rows))
+                        num_rows += batch.num_rows
+                        yield batch
+
+                writers.write_batches(batches(), record_batch_reader.schema, output_path)
+                table = pa.Table.from_batches(preview, schema=record_batch_reader.schema)
+            else:
+                # Retrieve all batch chunks
+                all_chunks = []
+                while True:
+                    try:
+                        chunk = record_batch_reader.read_next_batch()
+                        all_chunks.append(chunk)
+                    except StopIteration:
+                        break
+                table = pa.Table.from_batches(batches=all_chunks, schema=record_batch_reader.schema)
+            timings["fetch"] = time.perf_counter() - start
+
+            if profile:
+                # The profile of the query is written once the next statement runs
+                con.execute("PRAGMA disable_profiling")
+                query_profile = profile_path.read_text(encoding="utf-8")
+
+        cache.put(key, table)
         df = polars.from_arrow(table)
         print(df)
+        if output_path is not None:
+            print(f"{num_rows} rows written to {output_path}")
+        if profile:
+            print(query_profile)
+            for stage, seconds in timings.items():
+                print(f"{stage}: {seconds:.3f}s")
         return df
 
+    @classmethod
+    def shell(cls, file_path: T.List[Path], workers: int = 1, filename: bool = False,
+              threads: T.Optional[int] = None, memory_limit: T.Optional[str] = None,
+              temp_directory: T.Optional[Path] = None) -> None:
+        """
+        Open an interactive SQL shell on Avro or Parquet files.
+
+        The files are registered once, Avro files being decoded into DuckDB tables and Parquet files
+        scanned in place, so every statement of the session runs without reading them again.
+
+        :param file_path: Paths to files, directories or glob patterns, see `resolve_inputs`.
+        :type file_path: List[Path]
+        :param workers: Number of processes used to decode Avro files (default is 1).
+        :type workers: int
+        :param filename: Whether to add a `filename` column with the path of each row's file.
+        :type filename: bool
+        :param threads: Number of DuckDB worker threads (default is the number of CPU cores).
+        :type threads: int, optional
+        :param memory_limit: Maximum memory used by DuckDB, e.g. '4GB' (default is 80% of the RAM).
+        :type memory_limit: str, optional
+        :param temp_directory: Directory where DuckDB spills the tables that do not fit in `memory_limit`.
+        :type temp_directory: Path, optional
+        """
+        file_paths = file_path if isinstance(file_path, list) else [file_path]
+        with duckdb.connect(config=cls.duckdb_config(threads, memory_limit, temp_directory)) as con:
+            table_names = []
+            for table_name, table_paths in cls.resolve_inputs(file_paths):
+                start = time.perf_counter()
+                cls.utils_for_table(table_name, table_paths).register_table(con, table_name, table_paths, workers,
+                                                                            filename)
+                print(f"Loaded {table_name} in {time.perf_counter() - start:.3f}s")
+                table_names.append(table_name)
+            QueryShell(con, table_names, cls).cmdloop()
+
     @classmethod
     @abstractmethod
-    def random_sample(cls, file_path: Path, output_path: Path, *, n: T.Optional[int] = None,
-                      fraction: T.Optional[float] = None) -> None:
+    def random_sample(cls, file_path: Path, output_path: Path, n: T.Optional[int] = None,
+                      fraction: T.Optional[float] = None, seed: T.Optional[int] = None, block: bool = False,
+                      with_replacement: bool = False, shuffle: bool = False) -> None:
         ...
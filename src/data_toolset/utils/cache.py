@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import typing as T
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from data_toolset.utils.lazy import lazy_import
+
+pa = lazy_import("pyarrow")
+
+
+# Results are cached only once a cache directory is set, with `configure` or this environment variable
+CACHE_DIR_ENV = "DATA_TOOLSET_CACHE_DIR"
+DEFAULT_MAX_SIZE = 1024 ** 3
+SUFFIX = ".arrow"
+
+_directory: T.Optional[Path] = Path(os.environ[CACHE_DIR_ENV]) if os.environ.get(CACHE_DIR_ENV) else None
+_max_size = DEFAULT_MAX_SIZE
+# Settings of the calling thread only, such as those of a request handled by `serve`, see `configured`
+_local = threading.local()
+
+# Parsed file metadata kept in memory, which pays off in long-running processes such as `serve`
+MEMO_SIZE = 1024
+_memo: "OrderedDict[T.Tuple, T.Any]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def configure(directory: T.Optional[Path], max_size: int = DEFAULT_MAX_SIZE) -> None:
+    """
+    Set where results are cached and how large the cache may grow.
+
+    :param directory: Directory holding the cached results, or None to disable the cache.
+    :type directory: Path, optional
+    :param max_size: Maximum total size of the cached results in bytes (default is 1 GiB).
+    :type max_size: int
+    """
+    global _directory, _max_size
+    _directory = directory
+    _max_size = max_size
+
+
+@contextlib.contextmanager
+def configured(directory: T.Optional[Path] = None, max_size: T.Optional[int] = None) -> T.Iterator[None]:
+    """
+    Cache results in another directory or up to another size in the calling thread only.
+
+    The server handles requests of clients with different cache options concurrently, each in its own thread.
+
+    :param directory: Directory holding the cached results (default is the one set with `configure`).
+    :type directory: Path, optional
+    :param max_size: Maximum total size of the cached results in bytes (default is the one set with `configure`).
+    :type max_size: int, optional
+    """
+    previous = getattr(_local, "settings", None)
+    _local.settings = (directory or _directory, max_size or _max_size)
+    try:
+        yield
+    finally:
+        _local.settings = previous
+
+
+def _settings() -> T.Tuple[T.Optional[Path], int]:
+    return getattr(_local, "settings", None) or (_directory, _max_size)
+
+
+def fingerprint(file_path: T.Union[Path, str]) -> T.Tuple[str, int, int]:
+    """
+    Identify a version of a file by its absolute path, size and modification time.
+
+    :param file_path: Path to the file.
+    :type file_path: Union[Path, str]
+    :return: A tuple of the absolute path, the size in bytes and the modification time in nanoseconds.
+    :rtype: Tuple[str, int, int]
+    """
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    return str(file_path.resolve()), stat.st_size, stat.st_mtime_ns
+
+
+def make_key(command: str, file_paths: T.List[Path], *params: T.Any) -> T.Optional[str]:
+    """
+    Build the cache key of a command run on some files.
+
+    A file that is rewritten gets a new size or modification time and thus a new key, so stale results
+    are never returned. They are evicted once they are the least recently used.
+
+    :param command: Name of the command.
+    :type command: str
+    :param file_paths: Files the command reads.
+    :type file_paths: List[Path]
+    :param params: Other arguments the result depends on, serializable to JSON.
+    :type params: Any
+    :return: Hex digest identifying the result, or None if the cache is disabled.
+    :rtype: str, optional
+    """
+    if _settings()[0] is None:
+        return None
+    payload = json.dumps([command, [fingerprint(file_path) for file_path in file_paths], params], default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: T.Optional[str]) -> T.Optional[pa.Table]:
+    """
+    Read a cached result.
+
+    :param key: Cache key as returned by `make_key`.
+    :type key: str, optional
+    :return: The cached table, or None on a cache miss.
+    :rtype: pa.Table, optional
+    """
+    if key is None:
+        return None
+    path = _settings()[0] / f"{key}{SUFFIX}"
+    try:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        # The modification time orders the entries for eviction
+        os.utime(path)
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    return table
+
+
+def put(key: T.Optional[str], table: pa.Table) -> None:
+    """
+    Cache a result as an Arrow IPC file, then evict the least recently used results over the size limit.
+
+    :param key: Cache key as returned by `make_key`.
+    :type key: str, optional
+    :param table: Result to cache.
+    :type table: pa.Table
+    """
+    if key is None:
+        return
+    directory = _settings()[0]
+    directory.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first, so concurrent readers never see a partial entry
+    temp_path = directory / f"{key}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(str(temp_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(temp_path, directory / f"{key}{SUFFIX}")
+    evict()
+
+
+def evict() -> None:
+    """
+    Delete the least recently used results until the cache fits in its maximum size.
+    """
+    directory, max_size = _settings()
+    entries = []
+    for path in directory.glob(f"*{SUFFIX}"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        total_size -= size
+
+
+def memoize(kind: str, file_path: Path, load: T.Callable[[], T.Any]) -> T.Any:
+    """
+    Keep a value derived from a file in memory until the file changes, such as its parsed footer.
+
+    Unlike the results, these values are kept whether a cache directory is set or not. Only the last
+    `MEMO_SIZE` values used are kept.
+
+    :param kind: Name of the kind of value.
+    :type kind: str
+    :param file_path: File the value is derived from.
+    :type file_path: Path
+    :param load: Function computing the value, called on a miss.
+    :type load: Callable[[], Any]
+    :return: The value, which callers must not modify.
+    :rtype: Any
+    """
+    key = (kind, fingerprint(file_path))
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            return _memo[key]
+    value = load()
+    with _memo_lock:
+        _memo[key] = value
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return value
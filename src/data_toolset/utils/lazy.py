@@ -0,0 +1,27 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module, importing it on the first access to one of its attributes.
+
+    polars, DuckDB, pyarrow and numpy take hundreds of milliseconds to import, so they are only
+    imported by the commands that use them. Attributes are looked up on the imported module every
+    time, so patching the module is seen through the stand-in.
+    """
+
+    def __getattr__(self, name: str):
+        return getattr(importlib.import_module(self.__name__), name)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Import a module when it is first used.
+
+    :param name: Absolute name of the module, e.g. 'pyarrow.parquet'.
+    :type name: str
+    :return: Stand-in for the module.
+    :rtype: types.ModuleType
+    """
+    return LazyModule(name)
@@ -1,17 +1,25 @@
+from __future__ import annotations
+
 import json
 import logging
 import typing as T
 from pathlib import Path
 
-import pyarrow as pa
-import pyarrow.parquet as pq
-import polars
+from data_toolset.utils import cache
+from data_toolset.utils.avro import AvroUtils
+from data_toolset.utils.base import BaseUtils, DEFAULT_BATCH_SIZE
+from data_toolset.utils.lazy import lazy_import
 
-from data_toolset.utils.base import BaseUtils
-from data_toolset.utils.utils import NpEncoder
+duckdb = lazy_import("duckdb")
+np = lazy_import("numpy")
+polars = lazy_import("polars")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
 
 
 class ParquetUtils(BaseUtils):
+    EXTENSIONS = (".parquet",)
+
     @classmethod
     def to_arrow_table(cls, file_path: Path) -> pa.Table:
         """
@@ -22,9 +30,185 @@ class ParquetUtils(BaseUtils):
         :return: Arrow Table containing the data from the Parquet file.
         :rtype: pa.Table
         """
-        table = pa.parquet.read_table(file_path)
+        table = pq.read_table(file_path)
         return table
 
+    @staticmethod
+    def parquet_file(file_path: Path) -> pq.ParquetFile:
+        """
+        Open a Parquet file, parsing its footer only once per version of the file in this process.
+
+        :param file_path: Path to the Parquet file.
+        :type file_path: Path
+        :rtype: pq.ParquetFile
+        """
+        metadata = cache.memoize("parquet_footer", file_path, lambda: pq.read_metadata(file_path))
+        return pq.ParquetFile(file_path, metadata=metadata)
+
+    @classmethod
+    def to_record_batch_reader(cls, file_path: Path, batch_size: int = DEFAULT_BATCH_SIZE,
+                               workers: int = 1, columns: T.Optional[T.List[str]] = None) -> pa.RecordBatchReader:
+        """
+        Stream a Parquet file as Arrow record batches.
+
+        :param file_path: Path to the Parquet file to read.
+        :type file_path: Path
+        :param batch_size: Maximum number of rows per batch.
+        :type batch_size: int
+        :param workers: Unused, pyarrow already decodes Parquet columns on its own thread pool.
+        :type workers: int
+        :param columns: Names of the columns to read, or None to read all of them.
+        :type columns: List[str], optional
+        :return: Record batch reader over the file.
+        :rtype: pa.RecordBatchReader
+        """
+        parquet_file = cls.parquet_file(file_path)
+        schema = parquet_file.schema_arrow
+        if columns is not None:
+            schema = pa.schema([schema.field(name) for name in columns])
+        return pa.RecordBatchReader.from_batches(schema,
+                                                 parquet_file.iter_batches(batch_size=batch_size, columns=columns))
+
+    @classmethod
+    def register_source(cls, con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                        query_expression: str, workers: int = 1, filename: bool = False) -> None:
+        """
+        Expose Parquet files to DuckDB as a single table through its native Parquet scan.
+
+        DuckDB then reads only the columns the query needs, skips the row groups whose min/max
+        statistics rule out its filters and scans the files in parallel. Schemas are merged by name.
+
+        :param con: DuckDB connection to register the files in.
+        :type con: duckdb.DuckDBPyConnection
+        :param table_name: Name of the table in queries.
+        :type table_name: str
+        :param file_paths: Paths to the Parquet files.
+        :type file_paths: List[Path]
+        :param query_expression: Query that will be run on the files.
+        :type query_expression: str
+        :param workers: Unused, DuckDB scans row groups on its own thread pool.
+        :type workers: int
+        :param filename: Whether to add a `filename` column with the path of each row's file.
+        :type filename: bool
+        """
+        relation = con.read_parquet([str(file_path) for file_path in file_paths], union_by_name=len(file_paths) > 1,
+                                    filename=filename)
+        relation.create_view(table_name)
+
+    @classmethod
+    def register_table(cls, con: duckdb.DuckDBPyConnection, table_name: str, file_paths: T.List[Path],
+                       workers: int = 1, filename: bool = False) -> None:
+        """
+        Expose Parquet files to DuckDB as a view, scanned in place by every query.
+
+        Parquet files are columnar with min/max statistics, so scanning them again for each query only
+        reads the columns and row groups it needs, which beats copying them into memory.
+
+        :param con: DuckDB connection to register the files in.
+        :type con: duckdb.DuckDBPyConnection
+        :param table_name: Name of the table in queries.
+        :type table_name: str
+        :param file_paths: Paths to the Parquet files.
+        :type file_paths: List[Path]
+        :param workers: Unused, DuckDB scans row groups on its own thread pool.
+        :type workers: int
+        :param filename: Whether to add a `filename` column with the path of each row's file.
+        :type filename: bool
+        """
+        cls.register_source(con, table_name, file_paths, "", workers, filename)
+
+    @staticmethod
+    def row_groups_for(metadata: pq.FileMetaData, offset: int, limit: int) -> T.Tuple[T.List[int], int]:
+        """
+        Find the row groups that hold the rows in [offset, offset + limit), using the footer row counts.
+
+        :param metadata: Footer metadata of the Parquet file.
+        :type metadata: pq.FileMetaData
+        :param offset: Index of the first row.
+        :type offset: int
+        :param limit: Number of rows.
+        :type limit: int
+        :return: A tuple of the row group indices and the index of the first row of the first of them.
+        :rtype: Tuple[List[int], int]
+        """
+        row_groups = []
+        first_row = 0
+        position = 0
+        for i in range(metadata.num_row_groups):
+            num_rows = metadata.row_group(i).num_rows
+            if position < offset + limit and position + num_rows > offset:
+                if not row_groups:
+                    first_row = position
+                row_groups.append(i)
+            position += num_rows
+        return row_groups, first_row
+
+    @classmethod
+    def _read_rows(cls, parquet_file: pq.ParquetFile, offset: int, limit: int) -> pa.Table:
+        row_groups, first_row = cls.row_groups_for(parquet_file.metadata, offset, limit)
+        if not row_groups:
+            return parquet_file.schema_arrow.empty_table()
+        table = parquet_file.read_row_groups(row_groups)
+        return table.slice(offset - first_row, limit)
+
+    @classmethod
+    def read_slice(cls, file_path: Path, offset: int, limit: int) -> pa.Table:
+        """
+        Read a range of rows from a Parquet file, reading only the row groups that contain them.
+
+        :param file_path: Path to the Parquet file to read.
+        :type file_path: Path
+        :param offset: Index of the first row to read.
+        :type offset: int
+        :param limit: Maximum number of rows to read.
+        :type limit: int
+        :return: Arrow Table containing the requested rows.
+        :rtype: pa.Table
+        """
+        return cls._read_rows(cls.parquet_file(file_path), max(offset, 0), limit)
+
+    @classmethod
+    def tail(cls, file_path: Path, n: int = 20) -> polars.DataFrame:
+        """
+        Print the last N records of a Parquet file.
+
+        The footer row counts are used to read only the trailing row groups that hold the last N rows.
+
+        :param file_path: Path to the Parquet file to read.
+        :type file_path: Path
+        :param n: Number of records to print from the end of the file.
+        :type n: int
+        :return: Polars Dataframe containing the last N records.
+        :rtype: polars.DataFrame
+        """
+        parquet_file = cls.parquet_file(file_path)
+        num_rows = parquet_file.metadata.num_rows
+        df = polars.from_arrow(cls._read_rows(parquet_file, max(num_rows - n, 0), n))
+        print(df)
+        return df
+
+    @classmethod
+    def head(cls, file_path: Path, n: int = 20) -> polars.DataFrame:
+        """
+        Print the first N records of a Parquet file.
+
+        Only the row groups holding the first N rows are read, and decoding stops after N rows.
+
+        :param file_path: Path to the Parquet file to read.
+        :type file_path: Path
+        :param n: Number of records to print from the beginning of the file.
+        :type n: int
+        :return: Polars Dataframe containing the first N records.
+        :rtype: polars.DataFrame
+        """
+        parquet_file = cls.parquet_file(file_path)
+        row_groups, _ = cls.row_groups_for(parquet_file.metadata, 0, n)
+        batches = parquet_file.iter_batches(batch_size=cls.head_batch_size(n), row_groups=row_groups)
+        reader = pa.RecordBatchReader.from_batches(parquet_file.schema_arrow, batches)
+        df = polars.from_arrow(cls.take(reader, n))
+        print(df)
+        return df
+
     @classmethod
     def validate_format(cls, file_path: Path) -> None:
         """
@@ -52,7 +236,7 @@ class ParquetUtils(BaseUtils):
         :return: A tuple containing schema, metadata, codec, and metadata.
         :rtype: Tuple[pyarrow.Schema, pyarrow.parquet.FileMetadata, str, pyarrow.parquet.FileMetadata]
         """
-        parquet_file = pq.ParquetFile(file_path)
+        parquet_file = cls.parquet_file(file_path)
         codec = parquet_file.metadata.row_group(0).column(0).compression
         cls.print_metadata(parquet_file.schema, parquet_file.metadata, codec, parquet_file.metadata)
         return parquet_file.schema, parquet_file.metadata, codec, parquet_file.metadata
@@ -65,96 +249,295 @@ class ParquetUtils(BaseUtils):
         :param file_path: Path to the Parquet file to print the schema of.
         :type file_path: Path
         """
-        parquet_file = pq.ParquetFile(file_path)
+        parquet_file = cls.parquet_file(file_path)
         print(parquet_file.schema)
 
     @classmethod
-    def stats(cls, file_path: Path) -> T.Tuple[int, dict]:
+    def count(cls, file_path: Path, workers: int = 1) -> int:
+        """
+        Count the number of rows in a Parquet file from its footer.
+
+        :param file_path: Path to the Parquet file to count rows in.
+        :type file_path: Path
+        :param workers: Unused, no data is read.
+        :type workers: int
+        :return: The total number of rows in the file.
+        :rtype: int
+        """
+        num_rows = cls.parquet_file(file_path).metadata.num_rows
+        print(num_rows)
+        return num_rows
+
+    @staticmethod
+    def _footer_stats(metadata: pq.FileMetaData, column_index: int) -> T.Optional[T.Dict]:
+        """
+        Aggregate the footer statistics of a leaf column over all row groups.
+
+        :return: Column statistics, or None if a column chunk lacks the statistics to answer from.
+        """
+        column_stat = {
+            "count": 0,
+            "null_count": 0,
+            "min": None,
+            "max": None
+        }
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            statistics = row_group.column(column_index).statistics
+            if statistics is None or not statistics.has_null_count:
+                return None
+            column_stat["count"] += row_group.num_rows
+            column_stat["null_count"] += statistics.null_count
+            if statistics.has_min_max:
+                if column_stat["min"] is None or statistics.min < column_stat["min"]:
+                    column_stat["min"] = statistics.min
+                if column_stat["max"] is None or statistics.max > column_stat["max"]:
+                    column_stat["max"] = statistics.max
+            elif statistics.null_count < row_group.num_rows:
+                return None
+        return column_stat
+
+    @classmethod
+    def stats(cls, file_path: Path, workers: int = 1, metadata_only: T.Optional[bool] = None,
+              profile: bool = False, profile_path: T.Optional[Path] = None) -> T.Tuple[int, dict]:
         """
         Calculate statistics for a Parquet file.
 
+        By default the statistics of a column are aggregated from the footer when every column chunk
+        has them, and computed from the data otherwise, reading only those columns.
+
         :param file_path: Path to the Parquet file to calculate statistics for.
         :type file_path: Path
+        :param workers: Unused, kept for interface compatibility with Avro.
+        :type workers: int
+        :param metadata_only: Answer from the footer only and never read data pages, leaving unknown
+            statistics empty (True), or always compute statistics from the data (False).
+        :type metadata_only: Optional[bool]
+        :param profile: Add approximate distinct counts, quantiles and most frequent values, which
+            requires reading every column (default is False).
+        :type profile: bool
+        :param profile_path: Path to save the mergeable column profiles to, implies `profile`.
+        :type profile_path: Optional[Path]
         :return: A tuple containing the number of rows and column statistics.
         :rtype: Tuple[int, dict]
         """
-        parquet_file = pq.ParquetFile(file_path)
-        num_rows = parquet_file.metadata.num_rows
+        profiles = {} if profile or profile_path else None
+        if profiles is not None:
+            metadata_only = False
+        key = cache.make_key("stats", [file_path], metadata_only) if profiles is None else None
+        cached = cache.get(key)
+        if cached is not None:
+            num_rows, column_stats = cls.table_to_stats(cached)
+            cls.print_stats(column_stats)
+            return num_rows, column_stats
+
+        parquet_file = cls.parquet_file(file_path)
+        metadata = parquet_file.metadata
+        num_rows = metadata.num_rows
+        leaf_columns = {metadata.schema.column(j).path: j for j in range(metadata.num_columns)}
+
         column_stats = {}
-        for i in range(parquet_file.num_row_groups):
-            table = parquet_file.read_row_group(i)
-            for j, column_name in enumerate(table.schema.names):
-                column = table.column(j)
-                column_stat = column_stats.get(column_name, {
-                    "count": 0,
-                    "null_count": 0,
+        for column_name in parquet_file.schema_arrow.names:
+            column_stat = None
+            # Footer statistics of nested columns are per leaf and can't give top-level null counts
+            if metadata_only is not False and column_name in leaf_columns:
+                column_stat = cls._footer_stats(metadata, leaf_columns[column_name])
+            if column_stat is None and metadata_only:
+                column_stat = {
+                    "count": num_rows,
+                    "null_count": None,
                     "min": None,
                     "max": None
-                })
-                column_stat["count"] += len(column)
-                column_stat["null_count"] += column.null_count
-                # Process each chunk in the ChunkedArray
-                for chunk in column.iterchunks():
-                    if chunk.null_count == len(chunk):  # Skip if all values are null
-                        continue
-                    non_null_values = polars.from_arrow(chunk).drop_nans()
-
-                    if len(non_null_values) > 0:
-                        chunk_min = non_null_values[0]
-                        chunk_max = non_null_values[-1]
-
-                        if column_stat["min"] is None or chunk_min < column_stat["min"]:
-                            column_stat["min"] = chunk_min
+                }
+            column_stats[column_name] = column_stat
 
-                        if column_stat["max"] is None or chunk_max > column_stat["max"]:
-                            column_stat["max"] = chunk_max
+        missing = [column_name for column_name, column_stat in column_stats.items() if column_stat is None]
+        if missing:
+            batches = parquet_file.iter_batches(batch_size=DEFAULT_BATCH_SIZE, columns=missing)
+            schema = pa.schema([parquet_file.schema_arrow.field(column_name) for column_name in missing])
+            _, data_stats = cls.compute_stats(pa.RecordBatchReader.from_batches(schema, batches), profiles)
+            column_stats.update(data_stats)
 
-                column_stats[column_name] = column_stat
-
-        print(json.dumps(column_stats, indent=4, cls=NpEncoder, default=str))
+        if key is not None:
+            cls.cache_stats(key, num_rows, column_stats, parquet_file.schema_arrow)
+        cls.print_stats(column_stats, profiles, profile_path)
         return num_rows, column_stats
 
     @classmethod
-    def merge(cls, file_paths: T.List[Path], output_path: Path) -> None:
+    def merge(cls, file_paths: T.List[Path], output_path: Path,
+              target_row_group_size: T.Optional[int] = None) -> None:
         """
         Merge multiple Parquet files into a single file.
 
+        Row groups are read and written one at a time, so only about one row group is held in memory.
+        Without a target size every input row group becomes one output row group, otherwise consecutive
+        row groups are coalesced or split into row groups of `target_row_group_size` rows.
+
         :param file_paths: List of file paths to merge.
         :type file_paths: List[Path]
         :param output_path: Path to the output merged file.
         :type output_path: Path
+        :param target_row_group_size: Number of rows per output row group.
+        :type target_row_group_size: int, optional
+        :raises ValueError: If the files don't share the same schema.
         """
-        tables = []
-        for file_path in file_paths:
-            table = pq.read_table(file_path)
-            tables.append(table)
+        if target_row_group_size is not None and target_row_group_size <= 0:
+            raise ValueError("Target row group size must be positive.")
+        schema = pq.read_schema(file_paths[0])
+        with pq.ParquetWriter(output_path, schema) as writer:
+            pending = []
+            pending_rows = 0
+            for table in cls._iter_row_groups(file_paths, schema):
+                if table.num_rows == 0:
+                    continue
+                if target_row_group_size is None:
+                    writer.write_table(table, row_group_size=table.num_rows)
+                    continue
+                pending.append(table)
+                pending_rows += table.num_rows
+                if pending_rows >= target_row_group_size:
+                    table = pa.concat_tables(pending)
+                    full_rows = pending_rows - pending_rows % target_row_group_size
+                    writer.write_table(table.slice(0, full_rows), row_group_size=target_row_group_size)
+                    pending = [table.slice(full_rows)]
+                    pending_rows -= full_rows
+            if pending_rows:
+                writer.write_table(pa.concat_tables(pending), row_group_size=pending_rows)
 
-        table = pa.concat_tables(tables)
-        pq.write_table(table, output_path)
+    @staticmethod
+    def _iter_row_groups(file_paths: T.List[Path], schema: pa.Schema) -> T.Iterator[pa.Table]:
+        for file_path in file_paths:
+            parquet_file = ParquetUtils.parquet_file(file_path)
+            if not parquet_file.schema_arrow.equals(schema):
+                raise ValueError(f"Schema of {file_path} doesn't match the schema of {file_paths[0]}.")
+            for i in range(parquet_file.metadata.num_row_groups):
+                yield parquet_file.read_row_group(i)
 
     @classmethod
-    def validate(cls, file_path: Path, schema_path: T.Optional[Path] = None) -> None:
+    def validate(cls, file_path: Path, schema_path: T.Optional[Path] = None, workers: int = 1,
+                 max_errors: int = 100) -> None:
         """
         Validate a Parquet file against a given schema.
 
+        Only the file footer is read. The reference schema is either an Avro JSON schema or another Parquet
+        file, whose footer schema is used. Column types, nested fields and missing or extra columns are
+        compared; a column that may hold nulls fails a non-nullable reference column only if its footer
+        statistics count any nulls.
+
         :param file_path: Path to the Parquet file to validate.
         :type file_path: Path
-        :param schema_path: Path to the JSON schema file for validation.
+        :param schema_path: Path to the Avro JSON schema or Parquet file to validate against.
         :type schema_path: Path
-
-        This class method validates the specified Parquet file against a given JSON schema.
-        It checks if the file adheres to the schema and prints the validation result.
+        :param workers: Unused, accepted for compatibility with Avro validation.
+        :type workers: int
+        :param max_errors: Maximum number of mismatches to report (default is 100).
+        :type max_errors: int
+        :raises ValueError: If the file schema doesn't match the reference schema.
         """
         cls.validate_format(file_path)
+        metadata = pq.read_metadata(file_path)
 
         if schema_path:
-            df = polars.read_parquet(source=file_path)
-            print(df.schema)
-            # @TODO: implement that
+            expected = cls.reference_schema(schema_path)
+            null_counts = cls._footer_null_counts(metadata)
+            errors = []
+            for field, expected_field in cls._match_fields(metadata.schema.to_arrow_schema(), expected):
+                errors.extend(cls._compare_fields(field, expected_field, field.name if field else expected_field.name,
+                                                  null_counts))
+            if errors:
+                for error in errors[:max_errors]:
+                    print(error)
+                logging.error(f"File validation failed: {len(errors)} schema mismatches found.")
+                raise ValueError(f"File validation failed: {len(errors)} schema mismatches found.")
+            print("File validation successful.")
+            logging.info("File validation successful.")
         else:
             print("File is a valid Parquet file.")
             logging.info("File is a valid Parquet file.")
 
+    @staticmethod
+    def reference_schema(schema_path: Path) -> pa.Schema:
+        """
+        Load a reference schema from an Avro JSON schema file or from the footer of a Parquet file.
+
+        :param schema_path: Path to the Avro JSON schema or Parquet file.
+        :type schema_path: Path
+        :return: Reference schema as an Arrow schema.
+        :rtype: pa.Schema
+        """
+        with open(schema_path, "rb") as f:
+            is_parquet = f.read(4) == b"PAR1"
+        if is_parquet:
+            return pq.read_schema(schema_path)
+        with open(schema_path, "r") as f:
+            return AvroUtils.to_arrow_schema(json.load(f))
+
+    @staticmethod
+    def _footer_null_counts(metadata: pq.FileMetaData) -> T.Dict[str, T.Optional[int]]:
+        """
+        Sum the null counts of each leaf column over all row groups, None where statistics are missing.
+        """
+        null_counts = {}
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                column = row_group.column(j)
+                statistics = column.statistics
+                null_count = statistics.null_count if statistics is not None and statistics.has_null_count else None
+                previous = null_counts.get(column.path_in_schema, 0)
+                null_counts[column.path_in_schema] = (None if previous is None or null_count is None
+                                                      else previous + null_count)
+        return null_counts
+
+    @staticmethod
+    def _match_fields(actual: T.Iterable[pa.Field],
+                      expected: T.Iterable[pa.Field]) -> T.List[T.Tuple[T.Optional[pa.Field], T.Optional[pa.Field]]]:
+        """
+        Pair fields by name, in reference order followed by the unexpected fields.
+        """
+        actual = {field.name: field for field in actual}
+        expected = {field.name: field for field in expected}
+        return ([(actual.get(name), field) for name, field in expected.items()] +
+                [(field, None) for name, field in actual.items() if name not in expected])
+
+    @classmethod
+    def _compare_fields(cls, field: T.Optional[pa.Field], expected: T.Optional[pa.Field], path: str,
+                        null_counts: T.Optional[T.Dict[str, T.Optional[int]]]) -> T.List[str]:
+        """
+        Compare a file field with a reference field, recursing into nested types.
+
+        :param null_counts: Footer null counts by column path, None below a nullable parent where leaf
+            null counts also count the parent's nulls.
+        :return: Descriptions of the mismatches found.
+        """
+        if field is None:
+            return [f"{path}: missing column of type {expected.type}"]
+        if expected is None:
+            return [f"{path}: unexpected column of type {field.type}"]
+
+        errors = []
+        if field.nullable and not expected.nullable:
+            null_count = null_counts.get(path) if null_counts is not None else None
+            if null_count:
+                errors.append(f"{path}: expected non-nullable, found {null_count} nulls")
+        if field.nullable:
+            null_counts = None
+
+        actual_type, expected_type = field.type, expected.type
+        if pa.types.is_struct(actual_type) and pa.types.is_struct(expected_type):
+            for child, expected_child in cls._match_fields(actual_type, expected_type):
+                name = child.name if child is not None else expected_child.name
+                errors.extend(cls._compare_fields(child, expected_child, f"{path}.{name}", null_counts))
+        elif pa.types.is_map(actual_type) and pa.types.is_map(expected_type):
+            errors.extend(cls._compare_fields(actual_type.key_field, expected_type.key_field, f"{path}.key", None))
+            errors.extend(cls._compare_fields(actual_type.item_field, expected_type.item_field, f"{path}.value", None))
+        elif (pa.types.is_list(actual_type) or pa.types.is_large_list(actual_type)) and \
+                (pa.types.is_list(expected_type) or pa.types.is_large_list(expected_type)):
+            errors.extend(cls._compare_fields(actual_type.value_field, expected_type.value_field, f"{path}[]", None))
+        elif not actual_type.equals(expected_type):
+            errors.append(f"{path}: expected type {expected_type}, found {actual_type}")
+        return errors
+
     @classmethod
     def to_avro(cls, file_path: Path, output_path: Path,
                 compression: T.Literal["uncompressed", "snappy", "deflate"] = "uncompressed") -> None:
@@ -173,11 +556,17 @@ class ParquetUtils(BaseUtils):
         df.write_avro(file=output_path, compression=compression)
 
     @classmethod
-    def random_sample(cls, file_path: Path, output_path: Path, n: T.Optional[int] = None, fraction: T.Optional[float] = None,
+    def random_sample(cls, file_path: Path, output_path: Path, n: T.Optional[int] = None,
+                      fraction: T.Optional[float] = None, seed: T.Optional[int] = None, block: bool = False,
                       with_replacement: bool = False, shuffle: bool = False) -> None:
         """
         Create a random sample from an Parquet file and save it as an Parquet file.
 
+        The number of rows to keep from each row group is drawn upfront from the row counts in the footer,
+        then only the row groups keeping rows are read, one at a time, and the rows are picked inside them.
+        With `block` the sample is approximate: row groups are picked at random in proportion to their row
+        counts until they hold enough rows, and the sample is drawn from those row groups only.
+
         :param file_path: Path to the Parquet file to sample from.
         :type file_path: Path
         :param output_path: Path to the output Avro file for the random sample.
@@ -186,11 +575,69 @@ class ParquetUtils(BaseUtils):
         :type n: int
         :param fraction: The fraction of records to include in the random sample (alternative to 'n').
         :type fraction: float
+        :param seed: Seed of the random number generator, for reproducible samples.
+        :type seed: int
+        :param block: Whether to sample from randomly picked row groups only (default is False).
+        :type block: bool
         :param with_replacement: Whether to sample with replacement (default is False).
         :type with_replacement: bool
         :param shuffle: Whether to shuffle the input data before sampling (default is False).
         :type shuffle: bool
+        :raises ValueError: If neither `n` nor `fraction` is given.
         """
-        df = polars.read_parquet(source=file_path)
-        sample_df = df.sample(n=n, fraction=fraction, with_replacement=with_replacement, shuffle=shuffle)
-        sample_df.write_parquet(output_path)
+        if n is None and fraction is None:
+            raise ValueError("Either n or fraction must be given.")
+        rng = np.random.default_rng(seed)
+        parquet_file = cls.parquet_file(file_path)
+        metadata = parquet_file.metadata
+        row_counts = np.array([metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)],
+                              dtype=np.int64)
+        total_rows = int(row_counts.sum())
+        size = n if n is not None else int(fraction * total_rows)
+        if not with_replacement:
+            size = min(size, total_rows)
+
+        row_groups = np.arange(metadata.num_row_groups)
+        if block:
+            row_groups = cls._pick_row_groups(row_counts, size, rng)
+        row_counts = row_counts[row_groups]
+        # Only the number of rows to keep from each row group is drawn upfront, so that no array of the
+        # size of the file is ever allocated
+        if row_counts.sum() == 0:
+            sample_counts = np.zeros_like(row_counts)
+        elif with_replacement:
+            sample_counts = rng.multinomial(size, row_counts / row_counts.sum())
+        else:
+            sample_counts = rng.multivariate_hypergeometric(row_counts, size)
+
+        samples = []
+        with pq.ParquetWriter(output_path, parquet_file.schema_arrow) as writer:
+            for row_group, row_count, sample_count in zip(row_groups, row_counts, sample_counts):
+                if sample_count == 0:
+                    continue
+                row_group_indices = np.sort(rng.choice(int(row_count), size=int(sample_count),
+                                                       replace=with_replacement))
+                sample = parquet_file.read_row_group(int(row_group)).take(pa.array(row_group_indices))
+                if shuffle:
+                    samples.append(sample)
+                else:
+                    writer.write_table(sample)
+            if samples:
+                sample = pa.concat_tables(samples)
+                writer.write_table(sample.take(pa.array(rng.permutation(sample.num_rows))))
+
+    @staticmethod
+    def _pick_row_groups(row_counts: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Pick random row groups, weighted by their row counts, until they hold at least `size` rows.
+
+        Row groups are ordered by Efraimidis-Spirakis keys u ** (1 / weight), which is a weighted random
+        order without replacement.
+
+        :return: Indices of the picked row groups, in file order.
+        """
+        with np.errstate(divide="ignore"):
+            keys = np.log(rng.random(len(row_counts))) / row_counts
+        order = np.argsort(-keys, kind="stable")
+        needed = np.searchsorted(np.cumsum(row_counts[order]), max(size, 1)) + 1
+        return np.sort(order[:needed])
@@ -0,0 +1,192 @@
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import traceback
+import typing as T
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Commands are forwarded to the server listening on this socket, when one is
+SOCKET_ENV = "DATA_TOOLSET_SOCKET"
+DEFAULT_WORKERS = 4
+
+RunCommand = T.Callable[[T.List[str], Path], None]
+
+
+def default_socket_path() -> Path:
+    return Path(tempfile.gettempdir()) / f"data-toolset-{os.getuid()}.sock"
+
+
+class ThreadOutput(io.TextIOBase):
+    """
+    Standard output sending what each thread prints to its own buffer while it captures it.
+    """
+
+    def __init__(self, stream: T.TextIO) -> None:
+        self.stream = stream
+        self._local = threading.local()
+
+    def start_capture(self) -> None:
+        self._local.buffer = io.StringIO()
+
+    def stop_capture(self) -> str:
+        output = self._local.buffer.getvalue()
+        self._local.buffer = None
+        return output
+
+    def write(self, s: str) -> int:
+        buffer = getattr(self._local, "buffer", None)
+        return (buffer or self.stream).write(s)
+
+    def flush(self) -> None:
+        if getattr(self._local, "buffer", None) is None:
+            self.stream.flush()
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Run the command line of a request and send back what it printed and its exit code.
+
+    A request is a JSON line with the arguments of the command line and the working directory of the
+    client, the response a JSON document with `stdout`, `error` and `exit_code` keys.
+    """
+    server: "CommandServer"
+
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline())
+        error = None
+        exit_code = 0
+        self.server.output.start_capture()
+        try:
+            self.server.run_command(request["argv"], Path(request["cwd"]))
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            error = traceback.format_exc()
+            exit_code = 1
+        finally:
+            stdout = self.server.output.stop_capture()
+        response = {"stdout": stdout, "error": error, "exit_code": exit_code}
+        self.wfile.write(json.dumps(response).encode("utf-8"))
+
+
+class CommandServer(socketserver.UnixStreamServer):
+    """
+    Unix domain socket server running commands on a pool of worker threads.
+
+    The process keeps its modules imported and the footers and block indexes it parsed in memory,
+    see `cache.memoize`, so repeated commands skip the interpreter startup and file parsing.
+    """
+
+    def __init__(self, socket_path: Path, run_command: RunCommand, workers: int = DEFAULT_WORKERS,
+                 output: T.Optional[ThreadOutput] = None) -> None:
+        """
+        :param socket_path: Path of the socket to listen on.
+        :type socket_path: Path
+        :param run_command: Function running a command line from a working directory.
+        :type run_command: Callable[[List[str], Path], None]
+        :param workers: Number of requests handled concurrently (default is 4).
+        :type workers: int
+        :param output: Standard output replacement capturing what requests print (default is sys.stdout,
+            which must then be a ThreadOutput).
+        :type output: ThreadOutput, optional
+        """
+        super().__init__(str(socket_path), CommandHandler)
+        os.chmod(socket_path, 0o600)
+        self.run_command = run_command
+        self.output = output if output is not None else sys.stdout
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request: socket.socket, client_address: T.Any) -> None:
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request: socket.socket, client_address: T.Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def is_listening(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def serve(socket_path: Path, workers: int, run_command: RunCommand) -> None:
+    """
+    Run commands sent to a Unix domain socket until interrupted.
+
+    :param socket_path: Path of the socket to listen on.
+    :type socket_path: Path
+    :param workers: Number of requests handled concurrently.
+    :type workers: int
+    :param run_command: Function running a command line from a working directory.
+    :type run_command: Callable[[List[str], Path], None]
+    :raises ValueError: If another server listens on the socket.
+    """
+    if socket_path.exists():
+        if is_listening(socket_path):
+            raise ValueError(f"A server is already listening on {socket_path}.")
+        # Left over by a server that was killed
+        socket_path.unlink()
+
+    def stop(signum: int, frame: T.Any) -> None:
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, stop)
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with CommandServer(socket_path, run_command, workers, output) as server:
+            print(f"Listening on {socket_path}, export {SOCKET_ENV}={socket_path} to send commands to it",
+                  file=output.stream, flush=True)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        sys.stdout = output.stream
+        socket_path.unlink(missing_ok=True)
+
+
+def forward(socket_path: Path, argv: T.List[str], cwd: Path) -> T.Optional[int]:
+    """
+    Run a command line on the server listening on a socket, printing its output.
+
+    :param socket_path: Path of the server's socket.
+    :type socket_path: Path
+    :param argv: Arguments of the command line.
+    :type argv: List[str]
+    :param cwd: Directory relative paths of the command line are relative to.
+    :type cwd: Path
+    :return: Exit code of the command, or None if no server listens on the socket.
+    :rtype: int, optional
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        client.sendall(json.dumps({"argv": argv, "cwd": str(cwd)}).encode("utf-8") + b"\n")
+        with client.makefile("rb") as response_file:
+            response = json.loads(response_file.read())
+    sys.stdout.write(response["stdout"])
+    if response["error"]:
+        sys.stderr.write(response["error"])
+    return response["exit_code"]
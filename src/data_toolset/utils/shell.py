@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import cmd
+import time
+import typing as T
+
+from data_toolset.utils.lazy import lazy_import
+
+duckdb = lazy_import("duckdb")
+polars = lazy_import("polars")
+
+DEFAULT_HEAD_ROWS = 10
+
+
+class QueryShell(cmd.Cmd):
+    """
+    Read-eval-print loop running SQL statements on tables registered once in a DuckDB connection.
+
+    SQL statements end with a semicolon and may span several lines. Lines starting with a dot are
+    shell commands, see `.help`.
+    """
+    intro = "Enter SQL statements terminated with a \";\", or \".help\" for the shell commands."
+    prompt = "data-toolset> "
+    continuation_prompt = "         ...> "
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, table_names: T.List[str], utils_cls: T.Any) -> None:
+        """
+        :param con: DuckDB connection the tables are registered in.
+        :type con: duckdb.DuckDBPyConnection
+        :param table_names: Names of the registered tables.
+        :type table_names: List[str]
+        :param utils_cls: Utils class whose `compute_stats` and `print_stats` implement `.stats`.
+        :type utils_cls: Type[BaseUtils]
+        """
+        super().__init__()
+        self.con = con
+        self.table_names = table_names
+        self.utils_cls = utils_cls
+        self.timer = True
+        self.statement = []
+
+    def onecmd(self, line: str) -> bool:
+        if line == "EOF":
+            return self.do_EOF("")
+        # Shell commands are only recognized at the start of a statement
+        if not self.statement and line.startswith("."):
+            return super().onecmd(line[1:])
+        self.add_sql(line)
+        return False
+
+    def emptyline(self) -> bool:
+        return False
+
+    def default(self, line: str) -> None:
+        print(f"Unknown command: .{line.split()[0]}, see .help")
+
+    def add_sql(self, line: str) -> None:
+        """
+        Buffer a line of SQL, running the statement once it ends with a semicolon.
+        """
+        self.statement.append(line)
+        if line.rstrip().endswith(";"):
+            query_expression = "\n".join(self.statement)
+            self.statement = []
+            self.run(query_expression)
+        self.prompt = self.continuation_prompt if self.statement else QueryShell.prompt
+
+    def run(self, query_expression: str) -> None:
+        """
+        Run a SQL statement and print its result, and how long it took when the timer is on.
+
+        :param query_expression: SQL statement.
+        :type query_expression: str
+        """
+        start = time.perf_counter()
+        try:
+            self.con.execute(query_expression)
+            if self.con.description is not None:
+                print(polars.from_arrow(self.con.arrow()))
+        except duckdb.Error as e:
+            print(f"Error: {e}")
+            return
+        if self.timer:
+            print(f"Run Time: {time.perf_counter() - start:.3f}s")
+
+    def table_name(self, arg: str) -> T.Optional[str]:
+        """
+        Resolve the table argument of a shell command, which may be omitted when there is a single table.
+        """
+        if arg:
+            return arg
+        if len(self.table_names) == 1:
+            return self.table_names[0]
+        print(f"Specify a table: {', '.join(self.table_names)}")
+        return None
+
+    @staticmethod
+    def quote(table_name: str) -> str:
+        return '"' + table_name.replace('"', '""') + '"'
+
+    def do_tables(self, arg: str) -> None:
+        """.tables: list the registered tables"""
+        for table_name in self.table_names:
+            print(table_name)
+
+    def do_schema(self, arg: str) -> None:
+        """.schema [TABLE]: print the columns of a table and their types"""
+        table_name = self.table_name(arg.strip())
+        if table_name is not None:
+            self.run(f"DESCRIBE {self.quote(table_name)}")
+
+    def do_head(self, arg: str) -> None:
+        """.head [TABLE] [N]: print the first N rows of a table (default is 10)"""
+        args = arg.split()
+        n = DEFAULT_HEAD_ROWS
+        if args and args[-1].isdigit():
+            n = int(args.pop())
+        table_name = self.table_name(" ".join(args))
+        if table_name is not None:
+            self.run(f"SELECT * FROM {self.quote(table_name)} LIMIT {n}")
+
+    def do_stats(self, arg: str) -> None:
+        """.stats [TABLE]: print the count, null count, min and max of every column of a table"""
+        table_name = self.table_name(arg.strip())
+        if table_name is None:
+            return
+        start = time.perf_counter()
+        try:
+            reader = self.con.execute(f"SELECT * FROM {self.quote(table_name)}").fetch_record_batch()
+        except duckdb.Error as e:
+            print(f"Error: {e}")
+            return
+        _, column_stats = self.utils_cls.compute_stats(reader)
+        self.utils_cls.print_stats(column_stats)
+        if self.timer:
+            print(f"Run Time: {time.perf_counter() - start:.3f}s")
+
+    def do_timer(self, arg: str) -> None:
+        """.timer on|off: print how long each statement takes (default is on)"""
+        self.timer = arg.strip().lower() != "off"
+
+    def do_quit(self, arg: str) -> bool:
+        """.quit: exit the shell"""
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self, arg: str) -> bool:
+        print()
+        return True
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import base64
+import json
+import math
+import typing as T
+from pathlib import Path
+
+from data_toolset.utils.lazy import lazy_import
+from data_toolset.utils.utils import DataEncoder
+
+np = lazy_import("numpy")
+polars = lazy_import("polars")
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch estimating the number of distinct values in a column.
+
+    Values are hashed with polars' 64-bit hash, which may change between polars versions, so the sketch
+    records the polars version and refuses to merge with sketches built by another one.
+    """
+
+    def __init__(self, precision: int = 14, registers: T.Optional[np.ndarray] = None,
+                 hash_function: T.Optional[str] = None) -> None:
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+        self.hash_function = f"polars-{polars.__version__}" if hash_function is None else hash_function
+
+    @staticmethod
+    def _bit_length(values: np.ndarray) -> np.ndarray:
+        length = np.zeros(len(values), dtype=np.int64)
+        for shift in (32, 16, 8, 4, 2, 1):
+            mask = values >= (np.uint64(1) << np.uint64(shift))
+            length[mask] += shift
+            values = np.where(mask, values >> np.uint64(shift), values)
+        return length + (values > 0)
+
+    def update(self, column: pa.Array) -> None:
+        column = column.drop_null()
+        if len(column) == 0:
+            return
+        hashes = polars.from_arrow(column).hash(seed=0).to_numpy()
+        suffix_bits = 64 - self.precision
+        indices = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+        suffixes = hashes & np.uint64((1 << suffix_bits) - 1)
+        ranks = (suffix_bits - self._bit_length(suffixes) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, indices, ranks)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLog sketches of different precision.")
+        if other.hash_function != self.hash_function:
+            raise ValueError(f"Can't merge HyperLogLog sketches built with different hash functions: "
+                             f"{self.hash_function} and {other.hash_function}.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> T.Dict:
+        return {"precision": self.precision, "hash_function": self.hash_function,
+                "registers": base64.b64encode(self.registers.tobytes()).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: T.Dict) -> "HyperLogLog":
+        registers = np.frombuffer(base64.b64decode(data["registers"]), dtype=np.uint8).copy()
+        return cls(data["precision"], registers, data["hash_function"])
+
+
+class TDigest:
+    """
+    Merging t-digest estimating quantiles of a numeric column.
+
+    Centroids are formed with the k1 scale function, so each centroid spans at most one unit
+    of k = delta / (2 * pi) * asin(2q - 1) and the tails keep small, accurate centroids.
+    """
+
+    def __init__(self, delta: int = 200, means: T.Optional[np.ndarray] = None,
+                 weights: T.Optional[np.ndarray] = None, min_value: float = math.inf,
+                 max_value: float = -math.inf) -> None:
+        self.delta = delta
+        self.means = np.empty(0) if means is None else means
+        self.weights = np.empty(0) if weights is None else weights
+        self.min = min_value
+        self.max = max_value
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray) -> None:
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        quantiles = (np.cumsum(weights) - weights / 2) / total
+        clusters = np.floor(self.delta / (2 * np.pi) * np.arcsin(2 * quantiles - 1))
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(clusters)) + 1])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def update(self, column: pa.Array) -> None:
+        values = column.drop_null().to_numpy(zero_copy_only=False).astype(np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other: "TDigest") -> None:
+        if len(other.weights) == 0:
+            return
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+
+    def quantile(self, q: float) -> T.Optional[float]:
+        if len(self.weights) == 0:
+            return None
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0], centers, [total]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * total, positions, values))
+
+    def to_dict(self) -> T.Dict:
+        return {"delta": self.delta, "means": self.means.tolist(), "weights": self.weights.tolist(),
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: T.Dict) -> "TDigest":
+        return cls(data["delta"], np.array(data["means"], dtype=np.float64),
+                   np.array(data["weights"], dtype=np.float64), data["min"], data["max"])
+
+
+class MisraGries:
+    """
+    Misra-Gries summary of the most frequent values of a column.
+
+    Counts are lower bounds, off by at most N / (capacity + 1) for N values seen. The values are
+    serialized as an Arrow IPC stream, so they keep their type (dates, bytes, decimals, ...) through JSON.
+    """
+
+    def __init__(self, capacity: int = 64, counters: T.Optional[T.Dict[T.Any, int]] = None,
+                 value_type: T.Optional[pa.DataType] = None) -> None:
+        self.capacity = capacity
+        self.counters = {} if counters is None else counters
+        self.value_type = value_type
+
+    def _reduce(self) -> None:
+        if len(self.counters) <= self.capacity:
+            return
+        threshold = sorted(self.counters.values(), reverse=True)[self.capacity]
+        self.counters = {value: count - threshold for value, count in self.counters.items() if count > threshold}
+
+    def update(self, column: pa.Array) -> None:
+        value_counts = pc.value_counts(column.drop_null())
+        if len(value_counts) == 0:
+            return
+        values = value_counts.field("values")
+        counts = value_counts.field("counts").to_numpy()
+        self.value_type = values.type
+        if len(counts) > self.capacity:
+            # Summarize the batch on its own first, so only `capacity` values become Python objects
+            threshold = np.partition(counts, len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1]
+            keep = np.flatnonzero(counts > threshold)
+            values = values.take(pa.array(keep))
+            counts = counts[keep] - threshold
+        for value, count in zip(values.to_pylist(), counts.tolist()):
+            self.counters[value] = self.counters.get(value, 0) + count
+        self._reduce()
+
+    def merge(self, other: "MisraGries") -> None:
+        if self.value_type is None:
+            self.value_type = other.value_type
+        for value, count in other.counters.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        self._reduce()
+
+    def top(self, k: int) -> T.List[T.Tuple[T.Any, int]]:
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def to_dict(self) -> T.Dict:
+        values = pa.record_batch([pa.array(list(self.counters), type=self.value_type)], names=["values"])
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, values.schema) as writer:
+            writer.write_batch(values)
+        return {"capacity": self.capacity, "values": base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii"),
+                "counts": list(self.counters.values())}
+
+    @classmethod
+    def from_dict(cls, data: T.Dict) -> "MisraGries":
+        values = pa.ipc.open_stream(base64.b64decode(data["values"])).read_all()["values"]
+        value_type = None if pa.types.is_null(values.type) else values.type
+        return cls(data["capacity"], dict(zip(values.to_pylist(), data["counts"])), value_type)
+
+
+class ColumnProfile:
+    """
+    Approximate profile of a column: distinct count, quantiles and most frequent values.
+
+    All sketches have a fixed size, can be serialized with `to_dict` and merged with `merge`, so
+    profiles of several files or row groups can be combined without reading the data again.
+    """
+    QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.99)
+    TOP_K = 10
+
+    def __init__(self, distinct: T.Optional[HyperLogLog] = None, quantiles: T.Optional[TDigest] = None,
+                 frequent: T.Optional[MisraGries] = None) -> None:
+        self.distinct = distinct
+        self.quantiles = quantiles
+        self.frequent = frequent
+
+    @classmethod
+    def for_type(cls, data_type: pa.DataType) -> "ColumnProfile":
+        """
+        Create an empty profile with the sketches that apply to a column type.
+        """
+        if pa.types.is_nested(data_type):
+            return cls()
+        numeric = pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+        return cls(HyperLogLog(), TDigest() if numeric else None, MisraGries())
+
+    def update(self, column: pa.Array) -> None:
+        for sketch in (self.distinct, self.quantiles, self.frequent):
+            if sketch is not None:
+                sketch.update(column)
+
+    def merge(self, other: "ColumnProfile") -> None:
+        for name in ("distinct", "quantiles", "frequent"):
+            sketch, other_sketch = getattr(self, name), getattr(other, name)
+            if sketch is None:
+                setattr(self, name, other_sketch)
+            elif other_sketch is not None:
+                sketch.merge(other_sketch)
+
+    def summary(self) -> T.Dict:
+        """
+        Human-readable estimates of the profile.
+        """
+        summary = {}
+        if self.distinct is not None:
+            summary["distinct_count"] = self.distinct.estimate()
+        if self.quantiles is not None:
+            summary["quantiles"] = {str(q): self.quantiles.quantile(q) for q in self.QUANTILES}
+        if self.frequent is not None:
+            summary["top_k"] = self.frequent.top(self.TOP_K)
+        return summary
+
+    def to_dict(self) -> T.Dict:
+        return {name: sketch.to_dict() if sketch is not None else None
+                for name, sketch in (("distinct", self.distinct), ("quantiles", self.quantiles),
+                                     ("frequent", self.frequent))}
+
+    @classmethod
+    def from_dict(cls, data: T.Dict) -> "ColumnProfile":
+        return cls(HyperLogLog.from_dict(data["distinct"]) if data["distinct"] else None,
+                   TDigest.from_dict(data["quantiles"]) if data["quantiles"] else None,
+                   MisraGries.from_dict(data["frequent"]) if data["frequent"] else None)
+
+
+def save_profiles(profiles: T.Dict[str, ColumnProfile], output_path: Path) -> None:
+    """
+    Serialize column profiles to a JSON file.
+
+    :param profiles: Column profiles by column name.
+    :type profiles: Dict[str, ColumnProfile]
+    :param output_path: Path to the output JSON file.
+    :type output_path: Path
+    """
+    with open(output_path, mode="w", encoding="utf-8") as out:
+        json.dump({name: profile.to_dict() for name, profile in profiles.items()}, out, cls=DataEncoder)
+
+
+def load_profiles(file_path: Path) -> T.Dict[str, ColumnProfile]:
+    """
+    Load column profiles saved with `save_profiles`.
+
+    :param file_path: Path to the JSON file.
+    :type file_path: Path
+    :return: Column profiles by column name.
+    :rtype: Dict[str, ColumnProfile]
+    """
+    with open(file_path, mode="r", encoding="utf-8") as f:
+        return {name: ColumnProfile.from_dict(data) for name, data in json.load(f).items()}
+
+
+def merge_profiles(profiles: T.Iterable[T.Dict[str, ColumnProfile]]) -> T.Dict[str, ColumnProfile]:
+    """
+    Combine the column profiles of several files or row groups.
+
+    :param profiles: Column profiles by column name, one mapping per file.
+    :type profiles: Iterable[Dict[str, ColumnProfile]]
+    :return: Merged column profiles by column name.
+    :rtype: Dict[str, ColumnProfile]
+    """
+    merged = {}
+    for file_profiles in profiles:
+        for name, profile in file_profiles.items():
+            if name in merged:
+                merged[name].merge(profile)
+            else:
+                merged[name] = profile
+    return merged
@@ -1,6 +1,16 @@
+from __future__ import annotations
+
+import base64
+import datetime
+import decimal
 import json
+import typing as T
+import uuid
+
+from data_toolset.utils.lazy import lazy_import
 
-import numpy as np
+np = lazy_import("numpy")
+pa = lazy_import("pyarrow")
 
 
 class NpEncoder(json.JSONEncoder):
@@ -14,3 +24,64 @@ class NpEncoder(json.JSONEncoder):
         if isinstance(obj, np.bool_):
             return bool(obj)
         return super().default(obj)
+
+
+class DataEncoder(NpEncoder):
+    """
+    JSON encoder for the Python values produced by Arrow and fastavro (dates, decimals, bytes, ...).
+    """
+    def default(self, obj):
+        if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+            return obj.isoformat()
+        if isinstance(obj, datetime.timedelta):
+            return obj.total_seconds()
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        if isinstance(obj, bytes):
+            return base64.b64encode(obj).decode("ascii")
+        return super().default(obj)
+
+
+def _to_python(value: T.Any, data_type: pa.DataType) -> T.Any:
+    # Arrow returns maps as lists of (key, value) tuples, turn them back into dicts
+    if value is None:
+        return None
+    if pa.types.is_map(data_type):
+        return {k: _to_python(v, data_type.item_type) for k, v in value}
+    if pa.types.is_struct(data_type):
+        return {field.name: _to_python(value[field.name], field.type) for field in data_type}
+    if pa.types.is_list(data_type) or pa.types.is_large_list(data_type) or pa.types.is_fixed_size_list(data_type):
+        return [_to_python(v, data_type.value_type) for v in value]
+    return value
+
+
+def _has_map(data_type: pa.DataType) -> bool:
+    if pa.types.is_map(data_type):
+        return True
+    if pa.types.is_struct(data_type):
+        return any(_has_map(field.type) for field in data_type)
+    if pa.types.is_list(data_type) or pa.types.is_large_list(data_type) or pa.types.is_fixed_size_list(data_type):
+        return _has_map(data_type.value_type)
+    return False
+
+
+def batch_to_records(batch: pa.RecordBatch) -> T.List[T.Dict]:
+    """
+    Convert an Arrow record batch into a list of plain Python dicts.
+
+    Map columns are returned as dicts instead of Arrow's list of (key, value) tuples.
+
+    :param batch: Record batch to convert.
+    :type batch: pa.RecordBatch
+    :return: List of records.
+    :rtype: List[Dict]
+    """
+    records = batch.to_pylist()
+    map_fields = [field for field in batch.schema if _has_map(field.type)]
+    if map_fields:
+        for record in records:
+            for field in map_fields:
+                record[field.name] = _to_python(record[field.name], field.type)
+    return records
@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import io
+import typing as T
+from pathlib import Path
+
+from data_toolset.utils.lazy import lazy_import
+from data_toolset.utils.utils import DataEncoder, batch_to_records
+
+fastavro = lazy_import("fastavro")
+polars = lazy_import("polars")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+
+JSON_COMPRESSIONS = ("gzip", "zstd")
+
+
+def open_output(output_path: Path, compression: T.Optional[str] = None) -> T.BinaryIO:
+    """
+    Open a file for writing bytes, compressing them on the fly.
+
+    :param output_path: Path to the output file.
+    :type output_path: Path
+    :param compression: Compression codec, one of `JSON_COMPRESSIONS`, or None to write the bytes as is.
+    :type compression: str, optional
+    :return: Binary file object, to be closed by the caller.
+    :rtype: BinaryIO
+    :raises ValueError: If the compression codec is not supported.
+    """
+    if compression is None:
+        return open(output_path, mode="wb")
+    if compression not in JSON_COMPRESSIONS:
+        raise ValueError(f"Unsupported compression, expected one of: {', '.join(JSON_COMPRESSIONS)}.")
+    return pa.CompressedOutputStream(str(output_path), compression)
+
+
+def _is_json_native(array: pa.Array) -> bool:
+    # Whether polars writes the values as DataEncoder would: it formats dates, decimals, bytes and maps
+    # differently, and writes null structs as structs of nulls
+    data_type = array.type
+    if pa.types.is_struct(data_type):
+        return data_type.num_fields > 0 and array.null_count == 0 and all(map(_is_json_native, array.flatten()))
+    if pa.types.is_list(data_type) or pa.types.is_large_list(data_type):
+        return _is_json_native(array.flatten())
+    return (pa.types.is_null(data_type) or pa.types.is_boolean(data_type) or pa.types.is_integer(data_type)
+            or pa.types.is_float32(data_type) or pa.types.is_float64(data_type)
+            or pa.types.is_string(data_type) or pa.types.is_large_string(data_type))
+
+
+def _encode_batch(batch: pa.RecordBatch, encoder: DataEncoder, separator: bytes) -> bytes:
+    """
+    Encode the records of a batch to JSON, separated by `separator`.
+
+    Batches of JSON values only are encoded by polars, nested columns included, which is much faster
+    than converting them to Python objects first.
+    """
+    if encoder.indent is None and all(map(_is_json_native, batch.columns)):
+        buffer = io.BytesIO()
+        polars.from_arrow(pa.Table.from_batches([batch])).write_ndjson(buffer)
+        # Newlines in values are escaped, so the only ones left end the records
+        return buffer.getvalue()[:-1].replace(b"\n", separator)
+    return separator.decode("utf-8").join(encoder.encode(record) for record in batch_to_records(batch)).encode("utf-8")
+
+
+def write_json(batches: T.Iterable[pa.RecordBatch], output_path: Path, pretty: bool = False,
+               compression: T.Optional[str] = None) -> None:
+    """
+    Write record batches to a JSON array, one batch at a time.
+
+    Each batch is encoded at once, so only one batch is held in memory and the file gets a few large
+    writes instead of one per token.
+
+    :param batches: Record batches to write.
+    :type batches: Iterable[pa.RecordBatch]
+    :param output_path: Path to the output JSON file.
+    :type output_path: Path
+    :param pretty: Whether to format the JSON file with indentation (default is False).
+    :type pretty: bool
+    :param compression: Compression codec, one of `JSON_COMPRESSIONS` (default is None, uncompressed).
+    :type compression: str, optional
+    """
+    encoder = DataEncoder(indent=4 if pretty else None)
+    with open_output(output_path, compression) as out:
+        out.write(b"[")
+        first = True
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            if not first:
+                out.write(b",")
+            first = False
+            out.write(_encode_batch(batch, encoder, b","))
+        out.write(b"]")
+
+
+def write_ndjson(batches: T.Iterable[pa.RecordBatch], output_path: Path, compression: T.Optional[str] = None) -> None:
+    """
+    Write record batches as newline-delimited JSON, one record per line.
+
+    :param batches: Record batches to write.
+    :type batches: Iterable[pa.RecordBatch]
+    :param output_path: Path to the output JSON Lines file.
+    :type output_path: Path
+    :param compression: Compression codec, one of `JSON_COMPRESSIONS` (default is None, uncompressed).
+    :type compression: str, optional
+    """
+    encoder = DataEncoder()
+    with open_output(output_path, compression) as out:
+        for batch in batches:
+            if batch.num_rows > 0:
+                out.write(_encode_batch(batch, encoder, b"\n") + b"\n")
+
+
+def write_csv(batches: T.Iterable[pa.RecordBatch], schema: pa.Schema, output_path: Path, has_header: bool = True,
+              delimiter: str = ",", line_terminator: str = "\n", quote: str = '\"') -> None:
+    """
+    Write record batches to a CSV file, one batch at a time.
+
+    :param batches: Record batches to write.
+    :type batches: Iterable[pa.RecordBatch]
+    :param schema: Schema of the batches, used for the header of an empty output.
+    :type schema: pa.Schema
+    :param output_path: Path to the output CSV file.
+    :type output_path: Path
+    :param has_header: Whether the CSV file should include a header row (default is True).
+    :type has_header: bool
+    :param delimiter: The character used to separate fields in the CSV (default is ',').
+    :type delimiter: str
+    :param line_terminator: The character(s) used to terminate lines in the CSV (default is '\n').
+    :type line_terminator: str
+    :param quote: The character used to enclose fields in quotes (default is '\"').
+    :type quote: str
+    :raises ValueError: If the schema has nested (struct, list or map) columns, which CSV can't hold.
+    """
+    nested = [field.name for field in schema if pa.types.is_nested(field.type)]
+    if nested:
+        raise ValueError(f"CSV does not support nested columns, select or flatten them first: {', '.join(nested)}.")
+    with open(output_path, mode="wb") as out:
+        header = has_header
+        for batch in batches:
+            df = polars.from_arrow(pa.Table.from_batches([batch]))
+            df.write_csv(file=out, include_header=header, separator=delimiter, line_terminator=line_terminator,
+                         quote_char=quote)
+            header = False
+        if header:
+            # Empty input, still emit the header row
+            df = polars.from_arrow(schema.empty_table())
+            df.write_csv(file=out, include_header=header, separator=delimiter, line_terminator=line_terminator,
+                         quote_char=quote)
+
+
+def write_parquet(batches: T.Iterable[pa.RecordBatch], schema: pa.Schema, output_path: Path,
+                  compression: str = "snappy") -> None:
+    """
+    Write record batches to a Parquet file, one row group per batch.
+
+    :param batches: Record batches to write.
+    :type batches: Iterable[pa.RecordBatch]
+    :param schema: Schema of the batches.
+    :type schema: pa.Schema
+    :param output_path: Path to the output Parquet file.
+    :type output_path: Path
+    :param compression: Parquet compression codec (default is 'snappy').
+    :type compression: str
+    """
+    with pq.ParquetWriter(output_path, schema, compression=compression) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def _to_avro_type(data_type: pa.DataType, name: str, names: T.Set[str]) -> T.Union[str, T.Dict]:
+    if pa.types.is_dictionary(data_type):
+        return _to_avro_type(data_type.value_type, name, names)
+    if pa.types.is_null(data_type):
+        return "null"
+    if pa.types.is_boolean(data_type):
+        return "boolean"
+    if pa.types.is_integer(data_type):
+        return "long" if data_type.bit_width == 64 or data_type == pa.uint32() else "int"
+    if pa.types.is_float16(data_type) or pa.types.is_float32(data_type):
+        return "float"
+    if pa.types.is_float64(data_type):
+        return "double"
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        return "string"
+    if pa.types.is_fixed_size_binary(data_type):
+        return {"type": "fixed", "name": _unique_name(name, names), "size": data_type.byte_width}
+    if pa.types.is_binary(data_type) or pa.types.is_large_binary(data_type):
+        return "bytes"
+    if pa.types.is_decimal(data_type):
+        return {"type": "bytes", "logicalType": "decimal", "precision": data_type.precision,
+                "scale": data_type.scale}
+    if pa.types.is_date(data_type):
+        return {"type": "int", "logicalType": "date"}
+    if pa.types.is_time(data_type):
+        if data_type.unit in ("s", "ms"):
+            return {"type": "int", "logicalType": "time-millis"}
+        return {"type": "long", "logicalType": "time-micros"}
+    if pa.types.is_timestamp(data_type):
+        logical_type = "timestamp-millis" if data_type.unit in ("s", "ms") else "timestamp-micros"
+        if data_type.tz is None:
+            logical_type = f"local-{logical_type}"
+        return {"type": "long", "logicalType": logical_type}
+    if pa.types.is_map(data_type):
+        return {"type": "map", "values": _to_avro_field_type(data_type.item_field, name, names)}
+    if pa.types.is_list(data_type) or pa.types.is_large_list(data_type) or pa.types.is_fixed_size_list(data_type):
+        return {"type": "array", "items": _to_avro_field_type(data_type.value_field, name, names)}
+    if pa.types.is_struct(data_type):
+        return {"type": "record", "name": _unique_name(name, names),
+                "fields": [{"name": field.name, "type": _to_avro_field_type(field, f"{name}_{field.name}", names)}
+                           for field in data_type]}
+    raise ValueError(f"Arrow type {data_type} has no Avro equivalent.")
+
+
+def _to_avro_field_type(field: pa.Field, name: str, names: T.Set[str]) -> T.Union[str, T.Dict, T.List]:
+    avro_type = _to_avro_type(field.type, name, names)
+    if field.nullable and avro_type != "null":
+        return ["null", avro_type]
+    return avro_type
+
+
+def _unique_name(name: str, names: T.Set[str]) -> str:
+    unique_name = name
+    i = 1
+    while unique_name in names:
+        unique_name = f"{name}_{i}"
+        i += 1
+    names.add(unique_name)
+    return unique_name
+
+
+def to_avro_schema(schema: pa.Schema, name: str = "Record") -> T.Dict:
+    """
+    Convert an Arrow schema into an Avro record schema.
+
+    Nullable fields become unions with null, structs become records and maps become Avro maps, which
+    only support string keys.
+
+    :param schema: Arrow schema to convert.
+    :type schema: pa.Schema
+    :param name: Name of the top-level record (default is 'Record').
+    :type name: str
+    :return: Avro record schema.
+    :rtype: Dict
+    :raises ValueError: If the schema contains types without an Avro equivalent.
+    """
+    return _to_avro_type(pa.struct(list(schema)), name, set())
+
+
+def write_avro(batches: T.Iterable[pa.RecordBatch], schema: pa.Schema, output_path: Path,
+               codec: str = "null") -> None:
+    """
+    Write record batches to an Avro file, one batch at a time.
+
+    :param batches: Record batches to write.
+    :type batches: Iterable[pa.RecordBatch]
+    :param schema: Schema of the batches.
+    :type schema: pa.Schema
+    :param output_path: Path to the output Avro file.
+    :type output_path: Path
+    :param codec: Avro compression codec (default is 'null').
+    :type codec: str
+    """
+    avro_schema = fastavro.parse_schema(to_avro_schema(schema))
+
+    def records() -> T.Iterator[T.Dict]:
+        for batch in batches:
+            yield from batch_to_records(batch)
+
+    with open(output_path, mode="wb") as out:
+        fastavro.writer(out, avro_schema, records(), codec=codec)
+
+
+OUTPUT_FORMATS = ("parquet", "csv", "json", "jsonl", "ndjson", "avro")
+
+
+def write_batches(batches: T.Iterable[pa.RecordBatch], schema: pa.Schema, output_path: Path) -> None:
+    """
+    Stream record batches to a file, in the format given by its extension.
+
+    :param batches: Record batches to write.
+    :type batches: Iterable[pa.RecordBatch]
+    :param schema: Schema of the batches.
+    :type schema: pa.Schema
+    :param output_path: Path to the output file, ending in one of `OUTPUT_FORMATS`.
+    :type output_path: Path
+    :raises ValueError: If the file extension is not a supported output format.
+    """
+    output_format = output_path.suffix.lstrip(".").lower()
+    if output_format == "parquet":
+        write_parquet(batches, schema, output_path)
+    elif output_format == "csv":
+        write_csv(batches, schema, output_path)
+    elif output_format == "json":
+        write_json(batches, output_path)
+    elif output_format in ("jsonl", "ndjson"):
+        write_ndjson(batches, output_path)
+    elif output_format == "avro":
+        write_avro(batches, schema, output_path)
+    else:
+        raise ValueError(f"Unsupported output format, expected one of: {', '.join(OUTPUT_FORMATS)}.")
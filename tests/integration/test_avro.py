@@ -114,6 +114,25 @@ def test_query_command(file_path):
     # @TODO: check the result
 
 
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_query_command__limit(workers):
+    # The query stops long before the last block, the batches DuckDB read ahead must not crash the exit
+    file_path = Path("limit.avro")
+    schema = {"type": "record", "name": "Record",
+              "fields": [{"name": "id", "type": "long"}, {"name": "name", "type": "string"}]}
+    try:
+        with open(file_path, "wb") as f:
+            fastavro.writer(f, schema, ({"id": i, "name": f"name{i}"} for i in range(600000)), sync_interval=16000)
+
+        result = subprocess.run(["data-toolset", "query", file_path, "SELECT * FROM 'limit.avro' LIMIT 3",
+                                 "--workers", workers], capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0
+        assert result.stderr == ""
+        assert "shape: (3, 2)" in result.stdout
+    finally:
+        file_path.unlink()
+
+
 def test_merge_command():
     file_paths = [
         TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro",
@@ -0,0 +1,50 @@
+import json
+import re
+import subprocess
+import sys
+
+import pytest
+from utils import TEST_DATA_DIR
+
+HEAVY_MODULES = ("duckdb", "fastavro", "numpy", "pandas", "polars", "pyarrow", "pyarrow.parquet")
+# Importing the CLI used to take ~450ms with its dependencies, it takes ~70ms without them
+IMPORT_TIME_BUDGET_US = 250_000
+
+RUN_COMMAND = """
+import contextlib, io, json, sys
+from data_toolset.main import main
+sys.argv = ["data-toolset"] + sys.argv[1:]
+with contextlib.redirect_stdout(io.StringIO()):
+    main()
+print(json.dumps([name for name in {modules!r} if name in sys.modules]))
+"""
+
+
+def imported_modules(*argv):
+    result = subprocess.run([sys.executable, "-c", RUN_COMMAND.format(modules=HEAVY_MODULES), *argv],
+                            capture_output=True, text=True, cwd=TEST_DATA_DIR, check=True)
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize(("command", "file_path", "expected"), [
+    ("schema", "data/avro/test.avro", ["fastavro"]),
+    ("meta", "data/avro/test.avro", ["fastavro"]),
+    # Block headers are read without fastavro
+    ("count", "data/avro/test.avro", []),
+    # pyarrow.parquet imports pyarrow, which imports numpy
+    ("schema", "data/parquet/test.parquet", ["numpy", "pyarrow", "pyarrow.parquet"]),
+    ("meta", "data/parquet/test.parquet", ["numpy", "pyarrow", "pyarrow.parquet"]),
+    ("count", "data/parquet/test.parquet", ["numpy", "pyarrow", "pyarrow.parquet"]),
+])
+def test_command_imports(command, file_path, expected):
+    assert imported_modules(command, file_path) == expected
+
+
+def test_import_time():
+    script = f"import sys, data_toolset.main; print([name for name in {HEAVY_MODULES!r} if name in sys.modules])"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True,
+                            check=True)
+
+    assert result.stdout == "[]\n"
+    cumulative_us = int(re.search(r"\|\s*(\d+) \| data_toolset\.main$", result.stderr, re.MULTILINE).group(1))
+    assert cumulative_us < IMPORT_TIME_BUDGET_US
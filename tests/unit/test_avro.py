@@ -6,9 +6,11 @@ from unittest.mock import patch
 
 import fastavro
 import polars
+import pyarrow as pa
 import pytest
 from utils import TEST_DATA_DIR, DATA_JSON_EXPECTED, DATA_CSV_EXPECTED
 
+from data_toolset.utils import avro_blocks
 from data_toolset.utils.avro import AvroUtils
 
 
@@ -143,6 +145,16 @@ def test_stats():
         assert "max" in stats
 
 
+def test_stats__profile():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    num_rows, columns_stats = AvroUtils.stats(file_path, profile=True)
+
+    assert num_rows == 1000
+    assert columns_stats["gender"]["distinct_count"] == 3
+    assert [value for value, _ in columns_stats["gender"]["top_k"]] == ["Female", "Male", ""]
+    assert columns_stats["id"]["quantiles"]["0.5"] == pytest.approx(500, rel=0.01)
+
+
 def test_head():
     n = 3
     file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
@@ -159,6 +171,18 @@ def test_head__cropped_output():
     assert len(result) == min(n, len(result))
 
 
+def test_head__stops_decoding():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    temp_file = Path("truncated.avro")
+    # The last block is cut in half, which only matters if the whole file is decoded
+    temp_file.write_bytes(file_path.read_bytes()[:-2000])
+    try:
+        result = AvroUtils.head(temp_file, 5)
+        assert result["id"].to_list() == [1, 2, 3, 4, 5]
+    finally:
+        temp_file.unlink()
+
+
 def test_tail():
     n = 3
     file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
@@ -167,12 +191,121 @@ def test_tail():
     assert len(result) == min(n, len(result))
 
 
+def test_tail__multiple_blocks():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    result = AvroUtils.tail(file_path, 60)
+    assert result["id"].to_list() == list(range(941, 1001))
+
+
+@pytest.mark.parametrize(
+    ("offset", "limit", "expected_ids"),
+    [
+        (0, 3, [1, 2, 3]),
+        (466, 4, [467, 468, 469, 470]),
+        (998, 10, [999, 1000]),
+        (1000, 10, []),
+        (5, 0, []),
+    ],
+)
+def test_slice(offset, limit, expected_ids):
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    result = AvroUtils.slice(file_path, offset, limit)
+    assert isinstance(result, polars.DataFrame)
+    assert result["id"].to_list() == expected_ids
+
+
 def test_count():
     file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
     result = AvroUtils.count(file_path)
     assert result == 3
 
 
+@pytest.mark.parametrize(
+    ("file_path", "expected"),
+    [
+        (TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro", 3),
+        (TEST_DATA_DIR / "data" / "avro" / "test-deflate.avro", 3),
+        (TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro", 1000),
+    ],
+)
+def test_count__without_decoding(file_path, expected):
+    with patch("fastavro.reader", side_effect=AssertionError("records must not be decoded")):
+        result = AvroUtils.count(file_path)
+    assert result == expected
+
+
+def write_invalid_records(file_path, num_blocks=3):
+    schema = {"type": "record", "name": "Row", "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "point", "type": {"type": "record", "name": "Point", "fields": [{"name": "x", "type": "long"}]}},
+    ]}
+    # Same shape, but point.x must be an int: records with x >= 2 ** 31 are invalid
+    reference_schema = json.loads(json.dumps(schema).replace('"x", "type": "long"', '"x", "type": "int"'))
+    records = [{"id": i, "point": {"x": i if i % 10 else 2 ** 40}} for i in range(30)]
+    with open(file_path, "wb") as out:
+        writer = fastavro.write.Writer(out, schema)
+        for i in range(0, 30, 30 // num_blocks):
+            for record in records[i:i + 30 // num_blocks]:
+                writer.write(record)
+            writer.flush()
+    return reference_schema
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_validate__reports_invalid_records(workers):
+    file_path = Path("invalid_records.avro")
+    schema_path = Path("invalid_records.avsc")
+    try:
+        schema_path.write_text(json.dumps(write_invalid_records(file_path)))
+        captured_output = StringIO()
+        with patch("sys.stdout", captured_output), pytest.raises(ValueError, match="3 errors"):
+            AvroUtils.validate(file_path, schema_path, workers)
+
+        lines = captured_output.getvalue().splitlines()
+        assert [line.split(":")[0] for line in lines] == [
+            "Block 0, record 0, field Row.point.Point.x",
+            "Block 1, record 10, field Row.point.Point.x",
+            "Block 2, record 20, field Row.point.Point.x",
+        ]
+    finally:
+        file_path.unlink()
+        schema_path.unlink()
+
+
+def test_validate__max_errors():
+    file_path = Path("invalid_records.avro")
+    schema_path = Path("invalid_records.avsc")
+    try:
+        schema_path.write_text(json.dumps(write_invalid_records(file_path)))
+        captured_output = StringIO()
+        with patch("sys.stdout", captured_output), pytest.raises(ValueError, match="2 errors"):
+            AvroUtils.validate(file_path, schema_path, max_errors=2)
+
+        assert len(captured_output.getvalue().splitlines()) == 2
+    finally:
+        file_path.unlink()
+        schema_path.unlink()
+
+
+def test_validate__union_field():
+    file_path = Path("invalid_union.avro")
+    schema_path = Path("invalid_union.avsc")
+    schema = {"type": "record", "name": "Row", "fields": [{"name": "x", "type": ["null", "long"]}]}
+    try:
+        with open(file_path, "wb") as out:
+            fastavro.writer(out, schema, [{"x": None}, {"x": 2 ** 40}, {"x": 1}])
+        schema_path.write_text(json.dumps(schema).replace('"long"', '"int"'))
+        captured_output = StringIO()
+        with patch("sys.stdout", captured_output), pytest.raises(ValueError, match="1 errors"):
+            AvroUtils.validate(file_path, schema_path)
+
+        assert captured_output.getvalue() == \
+            f'Block 0, record 1, field Row.x: expected ["null", "int"], got {2 ** 40}\n'
+    finally:
+        file_path.unlink()
+        schema_path.unlink()
+
+
 def test_merge():
     file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
     temp_file = Path("empty_file.avro")
@@ -189,12 +322,228 @@ def test_merge():
         temp_file.unlink()
 
 
+def test_merge_copies_blocks_without_decoding():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test-deflate.avro"
+    temp_file = Path("merged_raw.avro")
+    try:
+        with patch("fastavro.reader") as reader:
+            AvroUtils.merge([file_path, file_path], temp_file)
+            reader.assert_not_called()
+
+        with open(temp_file, "rb") as f:
+            header, blocks = avro_blocks.build_index(f)
+            f.seek(0)
+            merged_data = list(fastavro.reader(f))
+        with open(file_path, "rb") as f:
+            expected = list(fastavro.reader(f))
+
+        assert header.codec == "deflate"
+        assert sum(block.num_records for block in blocks) == 6
+        assert merged_data == expected + expected
+    finally:
+        temp_file.unlink()
+
+
+def test_merge_different_codecs():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    snappy_file_path = TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro"
+    temp_file = Path("merged_codecs.avro")
+    try:
+        AvroUtils.merge([file_path, snappy_file_path], temp_file)
+        with open(temp_file, "rb") as f:
+            avro_reader = fastavro.reader(f)
+            merged_data = list(avro_reader)
+
+        assert avro_reader.codec == "null"
+        assert len(merged_data) == 6
+    finally:
+        temp_file.unlink()
+
+
+def test_merge_incompatible_schemas():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    other_file_path = Path("incompatible.avro")
+    temp_file = Path("merged_incompatible.avro")
+    try:
+        with open(other_file_path, "wb") as out:
+            fastavro.writer(out, {"type": "record", "name": "Other", "fields": [{"name": "id", "type": "long"}]},
+                            [{"id": 1}])
+        with pytest.raises(fastavro.read.SchemaResolutionError):
+            AvroUtils.merge([file_path, other_file_path], temp_file)
+
+        assert not temp_file.exists()
+        assert not list(Path.cwd().glob(f".{temp_file.name}.*"))
+    finally:
+        other_file_path.unlink()
+
+
 def test_schema():
     pass
 
 
+def test_to_record_batch_reader():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    reader = AvroUtils.to_record_batch_reader(file_path, batch_size=2)
+    batches = list(reader)
+
+    assert [batch.num_rows for batch in batches] == [2, 1]
+    assert reader.schema.names == ["character", "age", "is_human", "height", "quote", "friends", "appearance"]
+    assert pa.types.is_map(reader.schema.field("appearance").type)
+
+
+def test_to_record_batch_reader__workers():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    expected = AvroUtils.to_record_batch_reader(file_path).read_all()
+    result = AvroUtils.to_record_batch_reader(file_path, batch_size=100, workers=2).read_all()
+
+    assert result.equals(expected)
+
+
+def test_to_arrow_schema():
+    avro_schema = {"type": "record", "name": "Event", "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "ts", "type": {"type": "long", "logicalType": "timestamp-millis"}},
+        {"name": "tag", "type": ["null", "string"]},
+        {"name": "child", "type": {"type": "record", "name": "Child", "fields": [{"name": "x", "type": "int"}]}},
+        {"name": "sibling", "type": ["null", "Child"]},
+    ]}
+    schema = AvroUtils.to_arrow_schema(avro_schema)
+
+    assert schema.field("id").type == pa.int64()
+    assert not schema.field("id").nullable
+    assert schema.field("ts").type == pa.timestamp("ms", tz="UTC")
+    assert schema.field("tag").type == pa.string()
+    assert schema.field("tag").nullable
+    assert schema.field("sibling").type == schema.field("child").type
+
+
+def test_to_arrow_schema__unsupported_union():
+    avro_schema = {"type": "record", "name": "Event", "fields": [{"name": "v", "type": ["int", "string"]}]}
+    with pytest.raises(ValueError):
+        AvroUtils.to_arrow_schema(avro_schema)
+
+
 def test_query():
-    pass
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    with patch("sys.stdout", StringIO()):
+        df = AvroUtils.query(file_path, "SELECT character, age FROM 'test.avro' WHERE height > 160 ORDER BY age")
+
+    assert df.to_dicts() == [{"character": "Mad Hatter", "age": 35}, {"character": "Queen of Hearts", "age": 50}]
+
+
+@pytest.mark.parametrize("query, columns", [
+    ("SELECT Character FROM 'test.avro' WHERE age > 1", ["character", "age"]),
+    ("SELECT count(*) FROM 'test.avro'", ["character"]),
+    ("SELECT * FROM 'test.avro'", None),
+    ("SELECT t FROM 'test.avro' t", None),
+])
+def test_query__decodes_referenced_fields(query, columns):
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    with patch.object(AvroUtils, "to_record_batch_reader", wraps=AvroUtils.to_record_batch_reader) as reader, \
+            patch("sys.stdout", StringIO()):
+        df = AvroUtils.query(file_path, query)
+
+    assert reader.call_args.kwargs["columns"] == columns
+    assert df.height > 0
+
+
+def test_query__limit_stops_decoding():
+    file_path = Path("numbered.avro")
+    decoded = []
+    original_iter_batches = AvroUtils._iter_batches
+
+    def iter_batches(records, schema, batch_size):
+        for batch in original_iter_batches(records, schema, batch_size):
+            decoded.append(batch.num_rows)
+            yield batch
+
+    try:
+        write_numbered_records(file_path, num_records=100000, block_size=1000)
+        with patch.object(AvroUtils, "_iter_batches", staticmethod(iter_batches)), patch("sys.stdout", StringIO()):
+            df = AvroUtils.query(file_path, "SELECT id FROM 'numbered.avro' LIMIT 5")
+
+        assert df["id"].to_list() == [0, 1, 2, 3, 4]
+        assert sum(decoded) < 100000
+    finally:
+        file_path.unlink()
+
+
+def test_query__self_join():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    query = "SELECT character FROM 'test.avro' WHERE age > (SELECT avg(age) FROM 'test.avro') ORDER BY character"
+    with patch("sys.stdout", StringIO()):
+        df = AvroUtils.query(file_path, query)
+
+    assert df["character"].to_list() == ["Mad Hatter", "Queen of Hearts"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_query__directory(workers):
+    directory = Path("query_directory")
+    try:
+        directory.mkdir()
+        write_numbered_records(directory / "a.avro", num_records=100)
+        schema = {"type": "record", "name": "Row", "fields": [
+            {"name": "id", "type": "long"},
+            {"name": "name", "type": ["null", "string"]},
+        ]}
+        with open(directory / "b.avro", "wb") as out:
+            fastavro.writer(out, schema, [{"id": i, "name": str(i)} for i in range(100, 150)])
+        query = "SELECT count(*) AS n, max(id) AS max_id, count(name) AS names FROM query_directory"
+        with patch("sys.stdout", StringIO()):
+            df = AvroUtils.query([directory], query, workers=workers)
+
+        assert df.to_dicts() == [{"n": 150, "max_id": 149, "names": 50}]
+    finally:
+        for file_path in directory.glob("*"):
+            file_path.unlink()
+        directory.rmdir()
+
+
+def test_query__join_aliases():
+    avro_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    parquet_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"
+    query = "SELECT count(*) AS n FROM a JOIN p ON a.id = p.id AND a.email = p.email"
+    with patch("sys.stdout", StringIO()):
+        df = AvroUtils.query([Path(f"a={avro_path}"), Path(f"p={parquet_path}")], query)
+
+    assert df["n"].to_list() == [1000]
+
+
+def test_query__natural_join():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    inputs = [Path(f"a={file_path}"), Path(f"b={file_path}")]
+    with open(file_path, "rb") as f:
+        names = [field["name"] for field in fastavro.reader(f).writer_schema["fields"]]
+    with patch("sys.stdout", StringIO()):
+        # Rows are joined on every common column, all of them must be decoded
+        df = AvroUtils.query(inputs, "SELECT count(*) AS n FROM a NATURAL JOIN b")
+        expected = AvroUtils.query(inputs, f"SELECT count(*) AS n FROM a JOIN b USING ({', '.join(names)})")
+
+    assert df["n"].to_list() == expected["n"].to_list()
+
+
+def test_shell__decodes_once():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    captured_output = StringIO()
+    statements = "SELECT count(*) AS n FROM 'test.avro';\nSELECT max(age) FROM 'test.avro';\n"
+    with patch.object(AvroUtils, "to_record_batch_reader", wraps=AvroUtils.to_record_batch_reader) as reader, \
+            patch("sys.stdin", StringIO(statements)), \
+            patch("sys.stdout", captured_output):
+        AvroUtils.shell([file_path])
+
+    assert reader.call_count == 1
+    assert "Loaded test.avro in " in captured_output.getvalue()
+    assert "│ 50       │" in captured_output.getvalue()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_to_record_batch_reader__columns(workers):
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    table = AvroUtils.to_record_batch_reader(file_path, workers=workers, columns=["height", "age"]).read_all()
+
+    assert table.schema.names == ["age", "height"]
+    assert table["age"].to_pylist() == [10, 35, 50]
 
 
 def test_to_json():
@@ -254,3 +603,103 @@ def test_random_sample__with_fraction():
         assert temp_file.stat().st_size > 0
     finally:
         temp_file.unlink()
+
+
+def write_numbered_records(file_path, num_records=1000, block_size=10):
+    schema = {"type": "record", "name": "Row", "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "tags", "type": {"type": "map", "values": "string"}},
+    ]}
+    with open(file_path, "wb") as out:
+        writer = fastavro.write.Writer(out, schema, codec="deflate")
+        for i in range(num_records):
+            writer.write({"id": i, "tags": {"id": str(i)}})
+            if (i + 1) % block_size == 0:
+                writer.flush()
+        writer.flush()
+
+
+def read_ids(file_path):
+    with open(file_path, "rb") as f:
+        avro_reader = fastavro.reader(f)
+        return avro_reader, [record["id"] for record in avro_reader]
+
+
+@pytest.mark.parametrize("n, expected", [(0, 0), (10, 10), (2000, 1000)])
+def test_random_sample__reservoir(n, expected):
+    file_path = Path("numbered.avro")
+    temp_file = Path("sample.avro")
+    try:
+        write_numbered_records(file_path)
+        AvroUtils.random_sample(file_path, temp_file, n=n, seed=42)
+        avro_reader, ids = read_ids(temp_file)
+
+        assert len(ids) == len(set(ids)) == expected
+        assert avro_reader.codec == "deflate"
+        assert avro_reader.writer_schema["fields"][1]["type"]["type"] == "map"
+
+        other_file = Path("sample_again.avro")
+        try:
+            AvroUtils.random_sample(file_path, other_file, n=n, seed=42)
+            assert read_ids(other_file)[1] == ids
+        finally:
+            other_file.unlink()
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+def test_random_sample__reservoir_is_uniform():
+    file_path = Path("numbered.avro")
+    temp_file = Path("sample.avro")
+    try:
+        write_numbered_records(file_path, num_records=100)
+        counts = [0] * 100
+        for seed in range(200):
+            AvroUtils.random_sample(file_path, temp_file, n=10, seed=seed)
+            for i in read_ids(temp_file)[1]:
+                counts[i] += 1
+
+        # Every record is expected 20 times, the first records must not be favoured
+        assert sum(counts[:50]) == pytest.approx(sum(counts[50:]), rel=0.2)
+        assert min(counts) > 0
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+def test_random_sample__skips_blocks():
+    file_path = Path("numbered.avro")
+    temp_file = Path("sample.avro")
+    try:
+        write_numbered_records(file_path, num_records=10000)
+        with patch("data_toolset.utils.avro_blocks.read_block_range",
+                   side_effect=avro_blocks.read_block_range) as read_block_range:
+            AvroUtils.random_sample(file_path, temp_file, fraction=0.001, seed=1)
+        _, ids = read_ids(temp_file)
+
+        assert ids == sorted(ids)
+        assert read_block_range.call_count <= len(ids)
+        assert read_block_range.call_count < 1000
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+@pytest.mark.parametrize("fraction, expected", [(0.0, 0), (1.0, 1000)])
+def test_random_sample__fraction_bounds(fraction, expected):
+    file_path = Path("numbered.avro")
+    temp_file = Path("sample.avro")
+    try:
+        write_numbered_records(file_path)
+        AvroUtils.random_sample(file_path, temp_file, fraction=fraction)
+        assert read_ids(temp_file)[1] == list(range(expected))
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+def test_random_sample__without_n_or_fraction():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    with pytest.raises(ValueError):
+        AvroUtils.random_sample(file_path, Path("sample.avro"))
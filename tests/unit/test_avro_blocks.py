@@ -0,0 +1,83 @@
+import io
+
+import fastavro
+import pytest
+from utils import TEST_DATA_DIR
+
+from data_toolset.utils import avro_blocks
+
+
+@pytest.mark.parametrize(
+    ("data", "expected"),
+    [
+        (b"\x00", 0),
+        (b"\x01", -1),
+        (b"\x02", 1),
+        (b"\xac\x02", 150),
+        (b"\xff\xff\xff\xff\x0f", -2147483648),
+    ],
+)
+def test_read_long(data, expected):
+    assert avro_blocks.read_long(io.BytesIO(data)) == expected
+
+
+def test_read_header():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test-snappy.avro"
+    with open(file_path, "rb") as f:
+        header = avro_blocks.read_header(f)
+    with open(file_path, "rb") as f:
+        writer_schema = fastavro.reader(f).writer_schema
+
+    assert header.codec == "snappy"
+    assert header.schema == writer_schema
+    assert len(header.sync_marker) == avro_blocks.SYNC_SIZE
+
+
+def test_read_header__bad_format():
+    with pytest.raises(ValueError):
+        avro_blocks.read_header(io.BytesIO(b"PAR1"))
+
+
+def test_build_index():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    with open(file_path, "rb") as f:
+        header, blocks = avro_blocks.build_index(f)
+    with open(file_path, "rb") as f:
+        expected = [block.num_records for block in fastavro.block_reader(f)]
+
+    assert [block.num_records for block in blocks] == expected
+    assert [block.start_record for block in blocks] == [0, 468, 948]
+    assert blocks[0].offset == header.size
+    assert all(block.end == next_block.offset for block, next_block in zip(blocks, blocks[1:]))
+
+
+def test_build_index__corrupted_sync_marker():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    data = bytearray(file_path.read_bytes())
+    data[-1] ^= 0xFF
+    with pytest.raises(ValueError, match="Invalid sync marker"):
+        avro_blocks.build_index(io.BytesIO(bytes(data)))
+
+
+def test_read_block_range():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    with open(file_path, "rb") as f:
+        all_records = list(fastavro.reader(f))
+        header, blocks = avro_blocks.build_index(f)
+        records = list(avro_blocks.read_block_range(f, header, blocks[1].offset, blocks[2].end))
+
+    assert records == all_records[blocks[1].start_record:]
+
+
+@pytest.mark.parametrize("num_ranges", [1, 2, 3, 10])
+def test_split_blocks(num_ranges):
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    with open(file_path, "rb") as f:
+        _, blocks = avro_blocks.build_index(f)
+    ranges = avro_blocks.split_blocks(blocks, num_ranges)
+
+    assert ranges[0][0] == blocks[0].offset
+    assert ranges[-1][1] == blocks[-1].end
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    assert len(ranges) <= min(num_ranges, len(blocks))
+    assert {end for _, end in ranges} <= {block.end for block in blocks}
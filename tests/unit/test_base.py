@@ -0,0 +1,137 @@
+import datetime
+import shutil
+from pathlib import Path
+
+import pyarrow as pa
+import pytest
+from utils import TEST_DATA_DIR
+
+from data_toolset.utils.base import BaseUtils
+
+
+@pytest.mark.parametrize(
+    ("values", "data_type", "expected"),
+    [
+        ([3, None, 1, 2], pa.int64(), {"count": 4, "null_count": 1, "min": 1, "max": 3}),
+        ([2.5, float("nan"), -1.0], pa.float64(), {"count": 3, "null_count": 0, "min": -1.0, "max": 2.5}),
+        (["b", "c", "a"], pa.string(), {"count": 3, "null_count": 0, "min": "a", "max": "c"}),
+        ([None, None], pa.int32(), {"count": 2, "null_count": 2, "min": None, "max": None}),
+        ([[1], None], pa.list_(pa.int64()), {"count": 2, "null_count": 1, "min": None, "max": None}),
+        ([datetime.date(2023, 1, 2), datetime.date(2022, 5, 1)], pa.date32(),
+         {"count": 2, "null_count": 0, "min": datetime.date(2022, 5, 1), "max": datetime.date(2023, 1, 2)}),
+    ],
+)
+def test_column_stats(values, data_type, expected):
+    assert BaseUtils.column_stats(pa.array(values, type=data_type)) == expected
+
+
+def test_merge_column_stats():
+    left = {"count": 2, "null_count": 0, "min": 5, "max": 9}
+    right = {"count": 3, "null_count": 3, "min": None, "max": None}
+    assert BaseUtils.merge_column_stats(left, right) == {"count": 5, "null_count": 3, "min": 5, "max": 9}
+
+
+def test_compute_stats():
+    schema = pa.schema([("id", pa.int64()), ("name", pa.string())])
+    batches = [
+        pa.record_batch([pa.array([7, 3]), pa.array(["x", None])], schema=schema),
+        pa.record_batch([pa.array([None, 10, 1]), pa.array(["a", "z", "m"])], schema=schema),
+    ]
+    num_rows, column_stats = BaseUtils.compute_stats(pa.RecordBatchReader.from_batches(schema, batches))
+
+    assert num_rows == 5
+    assert column_stats == {
+        "id": {"count": 5, "null_count": 1, "min": 1, "max": 10},
+        "name": {"count": 5, "null_count": 1, "min": "a", "max": "z"},
+    }
+
+
+def test_compute_stats__empty():
+    schema = pa.schema([("id", pa.int64())])
+    num_rows, column_stats = BaseUtils.compute_stats(pa.RecordBatchReader.from_batches(schema, []))
+
+    assert num_rows == 0
+    assert column_stats == {"id": {"count": 0, "null_count": 0, "min": None, "max": None}}
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        ("SELECT a.b, count(*) FROM 't.avro' WHERE C > 1 GROUP BY d", {"a", "b", "c", "d"}),
+        ("SELECT x FROM a JOIN b USING (k)", {"x", "k"}),
+        ("SELECT count(*) FROM 't.avro'", set()),
+        ("SELECT * FROM 't.avro'", None),
+        ("SELECT t.* EXCLUDE (a) FROM 't.avro' t", None),
+        ("SELECT count(*) FROM 'a.avro' NATURAL JOIN 'b.avro'", None),
+        ("SELECT t FROM 't.avro' t", None),
+        ("SELECT \"T.avro\" FROM 't.avro'", None),
+        ("SELECT t.x FROM 't.avro' t", {"t", "x"}),
+        ("not a query", None),
+    ],
+)
+def test_referenced_columns(query, expected):
+    assert BaseUtils.referenced_columns(query) == expected
+
+
+@pytest.mark.parametrize(
+    ("query", "expected"),
+    [
+        ("SELECT count(*) FROM 't.avro'", True),
+        ("SELECT a FROM 'T.avro' WHERE a > (SELECT avg(a) FROM 't.avro')", False),
+        ("SELECT * FROM 't.avro' x JOIN 'other.avro' y ON x.a = y.a", True),
+        ("WITH s AS (SELECT * FROM 't.avro') SELECT * FROM s x JOIN s y ON x.a = y.a", False),
+        ("DESCRIBE SELECT * FROM 't.avro'", True),
+    ],
+)
+def test_scans_once(query, expected):
+    assert BaseUtils.scans_once(query, "t.avro") == expected
+
+
+def test_resolve_inputs():
+    directory = TEST_DATA_DIR / "data" / "sample-data"
+    inputs = BaseUtils.resolve_inputs([directory / "avro" / "userdata1.avro", Path(f"p={directory}/parquet/*.parquet"),
+                                       directory / "parquet"])
+
+    assert [name for name, _ in inputs] == ["userdata1.avro", "p", "parquet"]
+    assert inputs[0][1] == [directory / "avro" / "userdata1.avro"]
+    assert inputs[1][1] == inputs[2][1] == [directory / "parquet" / f"userdata{i}.parquet" for i in range(1, 6)]
+
+
+def test_resolve_inputs__partition_path():
+    file_path = Path("date=2023-01-01") / "part-0.parquet"
+    try:
+        file_path.parent.mkdir()
+        shutil.copy(TEST_DATA_DIR / "data" / "parquet" / "test.parquet", file_path)
+        inputs = BaseUtils.resolve_inputs([file_path, Path("date=2023-*/*.parquet"), Path("d=date=2023-01-01")])
+    finally:
+        shutil.rmtree(file_path.parent)
+
+    assert inputs == [("part-0.parquet", [file_path]), ("*.parquet", [file_path]), ("d", [file_path])]
+
+
+def test_resolve_inputs__no_match():
+    with pytest.raises(ValueError, match="No files found"):
+        BaseUtils.resolve_inputs([TEST_DATA_DIR / "data" / "*.missing"])
+
+
+@pytest.mark.parametrize(
+    ("query", "cacheable"),
+    [
+        ("SELECT a FROM t WHERE b > 1", True),
+        ("WITH s AS (SELECT * FROM t) SELECT * FROM s", True),
+        ("SELECT random() FROM t", False),
+        ("SELECT * FROM t WHERE d < now()", False),
+        ("SELECT * FROM t JOIN 'other.parquet' USING (a)", False),
+        ("SELECT * FROM read_csv('other.csv')", False),
+        ("DESCRIBE t", False),
+    ],
+)
+def test_normalize_query(query, cacheable):
+    assert (BaseUtils.normalize_query(query, ["T"]) is not None) == cacheable
+
+
+def test_normalize_query__whitespace_and_case():
+    normalized = BaseUtils.normalize_query("SELECT a FROM t WHERE b = 'x  y'", ["t"])
+
+    assert BaseUtils.normalize_query("select  a\nfrom t where b = 'x  y'", ["t"]) == normalized
+    assert BaseUtils.normalize_query("SELECT a FROM t WHERE b = 'x y'", ["t"]) != normalized
@@ -0,0 +1,179 @@
+import decimal
+import os
+import shutil
+import threading
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from utils import TEST_DATA_DIR
+
+from data_toolset.utils import cache
+from data_toolset.utils.avro import AvroUtils
+from data_toolset.utils.parquet import ParquetUtils
+
+
+@pytest.fixture
+def cache_dir():
+    directory = Path("test_cache")
+    cache.configure(directory, max_size=cache.DEFAULT_MAX_SIZE)
+    try:
+        yield directory
+    finally:
+        cache.configure(None)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_get__disabled():
+    assert cache.make_key("count", [TEST_DATA_DIR / "data" / "avro" / "test.avro"]) is None
+    assert cache.get(None) is None
+
+
+def test_configured():
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    keys = []
+    with cache.configured(Path("test_cache")):
+        assert cache.make_key("count", [file_path]) is not None
+        # Other threads keep the cache set with `configure`
+        thread = threading.Thread(target=lambda: keys.append(cache.make_key("count", [file_path])))
+        thread.start()
+        thread.join()
+    assert keys == [None]
+    assert cache.make_key("count", [file_path]) is None
+
+
+def test_put(cache_dir):
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    key = cache.make_key("count", [file_path])
+    assert cache.get(key) is None
+
+    cache.put(key, pa.table({"count": [3]}))
+
+    assert cache.get(key).to_pydict() == {"count": [3]}
+    assert cache.make_key("count", [file_path], 1) != key
+    assert [path.suffix for path in cache_dir.iterdir()] == [".arrow"]
+
+
+def test_make_key__file_changed(cache_dir):
+    file_path = Path("cached.avro")
+    try:
+        shutil.copy(TEST_DATA_DIR / "data" / "avro" / "test.avro", file_path)
+        key = cache.make_key("count", [file_path])
+        os.utime(file_path, ns=(0, 0))
+
+        assert cache.make_key("count", [file_path]) != key
+    finally:
+        file_path.unlink()
+
+
+def test_evict(cache_dir):
+    file_path = TEST_DATA_DIR / "data" / "avro" / "test.avro"
+    table = pa.table({"value": list(range(1000))})
+    keys = [cache.make_key("test", [file_path], i) for i in range(3)]
+    cache.put(keys[0], table)
+    size = (cache_dir / f"{keys[0]}.arrow").stat().st_size
+    cache.configure(cache_dir, max_size=2 * size)
+    cache.put(keys[1], table)
+    os.utime(cache_dir / f"{keys[0]}.arrow", ns=(0, 0))
+    os.utime(cache_dir / f"{keys[1]}.arrow", ns=(1, 1))
+    # Reading an entry makes it the most recently used
+    cache.get(keys[0])
+
+    cache.put(keys[2], table)
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+
+
+@pytest.mark.parametrize("utils_cls, file_path", [
+    (AvroUtils, TEST_DATA_DIR / "data" / "avro" / "test.avro"),
+    (ParquetUtils, TEST_DATA_DIR / "data" / "parquet" / "test.parquet"),
+])
+def test_query(cache_dir, utils_cls, file_path):
+    query = f"SELECT character, age FROM '{file_path.name}' WHERE height > 160 ORDER BY age"
+    with patch("sys.stdout", StringIO()):
+        expected = utils_cls.query(file_path, query)
+        with patch.object(utils_cls, "register_source", side_effect=AssertionError("must be cached")):
+            df = utils_cls.query(file_path, query.lower().replace(" ", "  "))
+
+    assert df.to_dicts() == expected.to_dicts()
+
+
+def test_query__volatile(cache_dir):
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    with patch("sys.stdout", StringIO()):
+        ParquetUtils.query(file_path, "SELECT random() FROM 'test.parquet'")
+
+    assert not cache_dir.exists()
+
+
+@pytest.mark.parametrize("utils_cls, file_path", [
+    (AvroUtils, TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"),
+    (ParquetUtils, TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"),
+])
+def test_stats(cache_dir, utils_cls, file_path):
+    with patch("sys.stdout", StringIO()):
+        expected = utils_cls.stats(file_path, 1, False)
+        with patch.object(utils_cls, "to_record_batch_reader", side_effect=AssertionError("must be cached")):
+            stats = utils_cls.stats(file_path, 1, False)
+
+    assert stats == expected
+    assert list(stats[1]["id"]) == ["count", "null_count", "min", "max"]
+
+
+@pytest.mark.parametrize("metadata_only", [True, False])
+def test_stats__column_types(cache_dir, metadata_only):
+    file_path = Path("stats_types.parquet")
+    table = pa.table({"u": pa.array([1, 2 ** 64 - 1], pa.uint64()),
+                      "d": pa.array([decimal.Decimal("1.50"), decimal.Decimal("-2.25")], pa.decimal128(5, 2)),
+                      "l": pa.array([[1], None], pa.list_(pa.int64()))})
+    try:
+        pq.write_table(table, file_path)
+        with patch("sys.stdout", StringIO()):
+            expected = ParquetUtils.stats(file_path, 1, metadata_only)
+            with patch.object(ParquetUtils, "parquet_file", side_effect=AssertionError("must be cached")):
+                stats = ParquetUtils.stats(file_path, 1, metadata_only)
+    finally:
+        file_path.unlink()
+
+    assert stats == expected
+    assert stats[1]["u"]["max"] == 2 ** 64 - 1
+    assert stats[1]["d"]["min"] == decimal.Decimal("-2.25")
+
+
+def test_stats__cache_write_fails(cache_dir, capsys, caplog):
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    with patch.object(cache, "put", side_effect=OSError("disk full")):
+        num_rows, _ = ParquetUtils.stats(file_path, 1, False)
+
+    assert num_rows == 3
+    assert '"count": 3' in capsys.readouterr().out
+    assert "could not be cached: disk full" in caplog.text
+
+
+def test_count(cache_dir):
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "avro" / "userdata1.avro"
+    with patch("sys.stdout", StringIO()):
+        AvroUtils.count(file_path)
+        with patch.object(AvroUtils, "block_index", side_effect=AssertionError("must be cached")):
+            num_rows = AvroUtils.count(file_path)
+
+    assert num_rows == 1000
+
+
+def test_memoize():
+    file_path = Path("memoized.avro")
+    loads = []
+    try:
+        shutil.copy(TEST_DATA_DIR / "data" / "avro" / "test.avro", file_path)
+        assert cache.memoize("test", file_path, lambda: loads.append(1) or len(loads)) == 1
+        assert cache.memoize("test", file_path, lambda: loads.append(1) or len(loads)) == 1
+        os.utime(file_path, ns=(0, 0))
+
+        assert cache.memoize("test", file_path, lambda: loads.append(1) or len(loads)) == 2
+    finally:
+        file_path.unlink()
@@ -12,6 +12,7 @@ from data_toolset.main import main
     [
         ("head", TEST_DATA_DIR / "data" / "avro" / "test.avro"),
         ("tail", TEST_DATA_DIR / "data" / "avro" / "test.avro"),
+        ("slice", TEST_DATA_DIR / "data" / "avro" / "test.avro"),
         ("count", TEST_DATA_DIR / "data" / "avro" / "test.avro"),
         ("stats", TEST_DATA_DIR / "data" / "avro" / "test.avro"),
         ("schema", TEST_DATA_DIR / "data" / "avro" / "test.avro"),
@@ -32,6 +33,7 @@ def test_main__avro_with_valid_command(command, file_path):
     [
         ("head", TEST_DATA_DIR / "data" / "parquet" / "test.parquet"),
         ("tail", TEST_DATA_DIR / "data" / "parquet" / "test.parquet"),
+        ("slice", TEST_DATA_DIR / "data" / "parquet" / "test.parquet"),
         ("count", TEST_DATA_DIR / "data" / "parquet" / "test.parquet"),
         ("stats", TEST_DATA_DIR / "data" / "parquet" / "test.parquet"),
         ("schema", TEST_DATA_DIR / "data" / "parquet" / "test.parquet"),
@@ -1,8 +1,16 @@
 import csv
+import gzip
 import json
+import subprocess
+import sys
+from io import StringIO
 from pathlib import Path
+from unittest.mock import Mock, patch
 
+import fastavro
+import numpy as np
 import polars
+import pyarrow as pa
 import pyarrow.parquet as pq
 import pytest
 from utils import TEST_DATA_DIR, DATA_JSON_EXPECTED, DATA_CSV_EXPECTED
@@ -47,6 +55,62 @@ def test_validate__not_exist():
         pass
 
 
+def test_validate__with_parquet_schema():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    schema_path = TEST_DATA_DIR / "data" / "parquet" / "test-snappy.parquet"
+    captured_output = StringIO()
+    with patch("sys.stdout", captured_output), \
+            patch.object(pq.ParquetFile, "iter_batches", side_effect=AssertionError("data must not be read")):
+        ParquetUtils.validate(file_path, schema_path)
+
+    assert captured_output.getvalue() == "File validation successful.\n"
+
+
+def test_validate__with_invalid_schema():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    schema_path = TEST_DATA_DIR / "data" / "schema_invalid.avsc"
+    captured_output = StringIO()
+    with patch("sys.stdout", captured_output), pytest.raises(ValueError, match="7 schema mismatches"):
+        ParquetUtils.validate(file_path, schema_path)
+
+    lines = captured_output.getvalue().splitlines()
+    assert lines[0] == "tea_consumption: missing column of type double"
+    assert lines[1] == "age: unexpected column of type int64"
+
+
+def test_validate__nested_types_and_nulls():
+    file_path = Path("nested.parquet")
+    schema_path = Path("nested.avsc")
+    try:
+        pq.write_table(pa.table({
+            "id": [1, None],
+            "name": ["a", "b"],
+            "point": [{"x": 1, "y": 2.0}, {"x": 3, "y": 4.0}],
+            "tags": [["a"], []],
+        }), file_path)
+        schema_path.write_text(json.dumps({"type": "record", "name": "Row", "fields": [
+            {"name": "id", "type": "long"},
+            {"name": "name", "type": "string"},
+            {"name": "point", "type": {"type": "record", "name": "Point", "fields": [
+                {"name": "x", "type": "long"},
+                {"name": "y", "type": "float"},
+            ]}},
+            {"name": "tags", "type": {"type": "array", "items": "int"}},
+        ]}))
+        captured_output = StringIO()
+        with patch("sys.stdout", captured_output), pytest.raises(ValueError, match="3 schema mismatches"):
+            ParquetUtils.validate(file_path, schema_path)
+
+        assert captured_output.getvalue().splitlines() == [
+            "id: expected non-nullable, found 1 nulls",
+            "point.y: expected type float, found double",
+            "tags[]: expected type int32, found string",
+        ]
+    finally:
+        file_path.unlink()
+        schema_path.unlink()
+
+
 def test_snappy_meta():
     file_path = TEST_DATA_DIR / "data" / "parquet" / "test-snappy.parquet"
     result = ParquetUtils.meta(file_path)
@@ -89,6 +153,41 @@ def test_stats():
         assert "max" in stats
 
 
+def test_stats__footer():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    with patch.object(pq.ParquetFile, "iter_batches", autospec=True,
+                      side_effect=pq.ParquetFile.iter_batches) as iter_batches:
+        num_rows, columns_stats = ParquetUtils.stats(file_path)
+
+    # Only the nested columns, whose footer statistics are per leaf, are read
+    assert iter_batches.call_args.kwargs["columns"] == ["friends", "appearance"]
+    assert num_rows == 3
+    assert columns_stats["age"] == {"count": 3, "null_count": 0, "min": 10, "max": 50}
+    assert columns_stats["character"] == {"count": 3, "null_count": 0, "min": "Alice", "max": "Queen of Hearts"}
+
+
+def test_stats__fallback_for_columns_without_statistics():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"
+    num_rows, columns_stats = ParquetUtils.stats(file_path)
+
+    assert num_rows == 1000
+    assert columns_stats["id"] == {"count": 1000, "null_count": 0, "min": 1, "max": 1000}
+    assert columns_stats["first_name"]["count"] == 1000
+    assert columns_stats["first_name"]["null_count"] == 0
+    assert columns_stats["first_name"]["min"] == ""
+    assert columns_stats["first_name"]["max"] == "Willie"
+
+
+def test_stats__metadata_only():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"
+    with patch.object(pq.ParquetFile, "iter_batches", side_effect=AssertionError("data must not be read")):
+        num_rows, columns_stats = ParquetUtils.stats(file_path, metadata_only=True)
+
+    assert num_rows == 1000
+    assert columns_stats["salary"] == {"count": 1000, "null_count": 68, "min": 12380.49, "max": 286592.99}
+    assert columns_stats["first_name"] == {"count": 1000, "null_count": None, "min": None, "max": None}
+
+
 def test_head():
     n = 3
     file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
@@ -97,6 +196,35 @@ def test_head():
     assert len(result) == min(n, len(result))
 
 
+@pytest.mark.parametrize(
+    ("offset", "limit", "expected"),
+    [
+        (0, 20, ([0], 0)),
+        (250, 120, ([2, 3], 200)),
+        (950, 100, ([9], 900)),
+        (1000, 10, ([], 0)),
+    ],
+)
+def test_row_groups_for(offset, limit, expected):
+    temp_file = Path("row_groups.parquet")
+    pq.write_table(pa.table({"id": list(range(1000))}), temp_file, row_group_size=100)
+    try:
+        metadata = pq.ParquetFile(temp_file).metadata
+        assert ParquetUtils.row_groups_for(metadata, offset, limit) == expected
+    finally:
+        temp_file.unlink()
+
+
+def test_head__multiple_row_groups():
+    temp_file = Path("row_groups.parquet")
+    pq.write_table(pa.table({"id": list(range(1000))}), temp_file, row_group_size=100)
+    try:
+        result = ParquetUtils.head(temp_file, 150)
+        assert result["id"].to_list() == list(range(150))
+    finally:
+        temp_file.unlink()
+
+
 def test_tail_function():
     n = 3
     file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
@@ -105,9 +233,37 @@ def test_tail_function():
     assert len(result) == min(n, len(result))
 
 
+def test_slice():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"
+    result = ParquetUtils.slice(file_path, 998, 10)
+    assert isinstance(result, polars.DataFrame)
+    assert result["id"].to_list() == [999, 1000]
+
+
+@pytest.mark.parametrize(
+    ("n", "expected_ids"),
+    [
+        (0, []),
+        (3, [997, 998, 999]),
+        (150, list(range(850, 1000))),
+        (2000, list(range(1000))),
+    ],
+)
+def test_tail__multiple_row_groups(n, expected_ids):
+    temp_file = Path("row_groups.parquet")
+    pq.write_table(pa.table({"id": list(range(1000))}), temp_file, row_group_size=100)
+    try:
+        with patch.object(pq.ParquetFile, "read", side_effect=AssertionError("whole file must not be read")):
+            result = ParquetUtils.tail(temp_file, n)
+        assert result["id"].to_list() == expected_ids
+    finally:
+        temp_file.unlink()
+
+
 def test_count():
     file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
-    result = ParquetUtils.count(file_path)
+    with patch.object(pq.ParquetFile, "iter_batches", side_effect=AssertionError("data must not be read")):
+        result = ParquetUtils.count(file_path)
     assert result == 3
 
 
@@ -122,12 +278,160 @@ def test_merge():
         temp_file.unlink()
 
 
+def test_merge_keeps_row_groups():
+    file_path = Path("row_groups.parquet")
+    temp_file = Path("merged_row_groups.parquet")
+    try:
+        pq.write_table(pa.table({"id": list(range(10))}), file_path, row_group_size=4)
+        with patch("pyarrow.parquet.read_table", side_effect=AssertionError("files must be streamed")):
+            ParquetUtils.merge([file_path, file_path], temp_file)
+
+        parquet_file = pq.ParquetFile(temp_file)
+        row_groups = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+        assert row_groups == [4, 4, 2, 4, 4, 2]
+        assert parquet_file.read()["id"].to_pylist() == list(range(10)) * 2
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+@pytest.mark.parametrize("target_row_group_size, expected", [
+    (5, [5, 5, 5, 5]),
+    (8, [8, 8, 4]),
+    (100, [20]),
+])
+def test_merge_target_row_group_size(target_row_group_size, expected):
+    file_path = Path("row_groups.parquet")
+    temp_file = Path("merged_row_groups.parquet")
+    try:
+        pq.write_table(pa.table({"id": list(range(10))}), file_path, row_group_size=3)
+        ParquetUtils.merge([file_path, file_path], temp_file, target_row_group_size)
+
+        parquet_file = pq.ParquetFile(temp_file)
+        row_groups = [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)]
+        assert row_groups == expected
+        assert parquet_file.read()["id"].to_pylist() == list(range(10)) * 2
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+def test_merge_schema_mismatch():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    other_file_path = Path("other_schema.parquet")
+    temp_file = Path("merged_mismatch.parquet")
+    try:
+        pq.write_table(pa.table({"id": [1, 2]}), other_file_path)
+        with pytest.raises(ValueError, match="doesn't match"):
+            ParquetUtils.merge([file_path, other_file_path], temp_file)
+    finally:
+        other_file_path.unlink()
+        temp_file.unlink(missing_ok=True)
+
+
 def test_schema():
     pass
 
 
+def test_to_record_batch_reader():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"
+    reader = ParquetUtils.to_record_batch_reader(file_path, batch_size=300)
+    batches = list(reader)
+
+    assert [batch.num_rows for batch in batches] == [300, 300, 300, 100]
+    assert reader.schema == pq.ParquetFile(file_path).schema_arrow
+
+
 def test_query():
-    pass
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    with patch.object(ParquetUtils, "to_record_batch_reader", side_effect=AssertionError("must use read_parquet")), \
+            patch("sys.stdout", StringIO()):
+        df = ParquetUtils.query(file_path, "SELECT character, age FROM 'test.parquet' WHERE height > 160 ORDER BY age")
+
+    assert df.to_dicts() == [{"character": "Mad Hatter", "age": 35}, {"character": "Queen of Hearts", "age": 50}]
+
+
+@pytest.mark.parametrize("suffix, read", [
+    (".parquet", lambda path: pq.read_table(path)["id"].to_pylist()),
+    (".csv", lambda path: polars.read_csv(path)["id"].to_list()),
+    (".json", lambda path: [record["id"] for record in json.loads(path.read_text())]),
+    (".jsonl", lambda path: [json.loads(line)["id"] for line in path.read_text().splitlines()]),
+    (".avro", lambda path: [record["id"] for record in fastavro.reader(path.open("rb"))]),
+])
+def test_query__output(suffix, read):
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"
+    temp_file = Path(f"query_output{suffix}")
+    try:
+        captured_output = StringIO()
+        with patch("sys.stdout", captured_output):
+            df = ParquetUtils.query(file_path, "SELECT id, first_name, registration_dttm FROM 'userdata1.parquet'",
+                                    output_path=temp_file, chunk_size=300)
+
+        assert df.height == 20
+        assert captured_output.getvalue().endswith(f"1000 rows written to {temp_file}\n")
+        assert read(temp_file) == list(range(1, 1001))
+    finally:
+        temp_file.unlink()
+
+
+def test_query__output_nested_csv():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    temp_file = Path("query_output.csv")
+    query = "SELECT character, [age] AS ages, {'height': height} AS body FROM 'test.parquet'"
+    with patch("sys.stdout", StringIO()), pytest.raises(ValueError, match="nested columns.*: ages, body"):
+        ParquetUtils.query(file_path, query, output_path=temp_file)
+
+    assert not temp_file.exists()
+
+
+def test_query__glob():
+    file_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata*.parquet"
+    query = "SELECT filename, count(*) AS n FROM 'userdata*.parquet' GROUP BY filename ORDER BY filename"
+    with patch("sys.stdout", StringIO()):
+        df = ParquetUtils.query([file_path], query, filename=True)
+
+    assert [Path(name).name for name in df["filename"]] == [f"userdata{i}.parquet" for i in range(1, 6)]
+    assert df["n"].sum() == 5000
+
+
+def test_query__settings():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    query = ("SELECT current_setting('threads') AS threads, current_setting('memory_limit') AS memory_limit, "
+             "current_setting('preserve_insertion_order') AS ordered FROM 'test.parquet' LIMIT 1")
+    with patch("sys.stdout", StringIO()):
+        df = ParquetUtils.query(file_path, query, threads=1, memory_limit="500MB", preserve_insertion_order=False)
+
+    assert df.to_dicts() == [{"threads": 1, "memory_limit": "500.0MB", "ordered": False}]
+
+
+def test_query__profile():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    captured_output = StringIO()
+    with patch("sys.stdout", captured_output):
+        ParquetUtils.query(file_path, "SELECT count(*) FROM 'test.parquet' WHERE age > 20", profile=True)
+
+    output = captured_output.getvalue()
+    assert "PARQUET_SCAN" in output
+    for stage in ("load", "register", "execute", "fetch"):
+        assert f"\n{stage}: " in output
+
+
+def test_to_arrow_table__fresh_interpreter():
+    # Other tests import pyarrow.parquet, a fresh interpreter only imports what the module itself imports
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    script = ("import sys; from pathlib import Path; from data_toolset.utils.parquet import ParquetUtils; "
+              "print(ParquetUtils.to_arrow_table(Path(sys.argv[1])).num_rows)")
+    result = subprocess.run([sys.executable, "-c", script, str(file_path)], capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "3\n"
+
+
+def test_to_record_batch_reader__columns():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    table = ParquetUtils.to_record_batch_reader(file_path, columns=["height", "age"]).read_all()
+
+    assert table.schema.names == ["height", "age"]
 
 
 def test_to_json():
@@ -144,6 +448,20 @@ def test_to_json():
         temp_file.unlink()
 
 
+def test_to_json__ndjson():
+    file_path = TEST_DATA_DIR / "data" / "parquet" / "test.parquet"
+    temp_file = Path("data.jsonl.gz")
+    try:
+        ParquetUtils.to_json(file_path, temp_file, ndjson=True, compression="gzip")
+
+        with gzip.open(temp_file, "rt", encoding="utf-8") as output_file:
+            json_data = [json.loads(line) for line in output_file]
+
+        assert json_data == DATA_JSON_EXPECTED
+    finally:
+        temp_file.unlink()
+
+
 def test_to_csv():
     file_path = TEST_DATA_DIR / "data" / "sample-data" / "parquet" / "userdata1.parquet"
     temp_file = Path("data.csv")
@@ -169,3 +487,82 @@ def test_to_avro():
         assert temp_file.stat().st_size > 0
     finally:
         temp_file.unlink()
+
+
+def write_row_groups(file_path, num_rows=1000, row_group_size=100):
+    pq.write_table(pa.table({"id": list(range(num_rows))}), file_path, row_group_size=row_group_size)
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({"n": 10}, 10),
+    ({"n": 2000}, 1000),
+    ({"fraction": 0.25}, 250),
+    ({"n": 10, "block": True}, 10),
+    ({"fraction": 0.25, "block": True}, 250),
+])
+def test_random_sample(kwargs, expected):
+    file_path = Path("row_groups.parquet")
+    temp_file = Path("sample.parquet")
+    try:
+        write_row_groups(file_path)
+        ParquetUtils.random_sample(file_path, temp_file, seed=7, **kwargs)
+        ids = pq.read_table(temp_file)["id"].to_pylist()
+
+        assert len(ids) == len(set(ids)) == expected
+        assert ids == sorted(ids)
+        ParquetUtils.random_sample(file_path, temp_file, seed=7, **kwargs)
+        assert pq.read_table(temp_file)["id"].to_pylist() == ids
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+def test_random_sample__block_reads_few_row_groups():
+    file_path = Path("row_groups.parquet")
+    temp_file = Path("sample.parquet")
+    try:
+        write_row_groups(file_path)
+        with patch.object(pq.ParquetFile, "read_row_group", autospec=True,
+                          side_effect=pq.ParquetFile.read_row_group) as read_row_group:
+            ParquetUtils.random_sample(file_path, temp_file, n=150, block=True, seed=3)
+        ids = pq.read_table(temp_file)["id"].to_pylist()
+
+        assert read_row_group.call_count == 2
+        assert len({i // 100 for i in ids}) == 2
+        assert len(ids) == 150
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+def test_random_sample__draws_rows_per_row_group():
+    file_path = Path("row_groups.parquet")
+    temp_file = Path("sample.parquet")
+    rng = Mock(wraps=np.random.default_rng(5))
+    try:
+        write_row_groups(file_path)
+        with patch("numpy.random.default_rng", return_value=rng):
+            ParquetUtils.random_sample(file_path, temp_file, n=300, seed=5)
+        ids = pq.read_table(temp_file)["id"].to_pylist()
+
+        assert len(ids) == len(set(ids)) == 300
+        assert all(call.args[0] <= 100 for call in rng.choice.call_args_list)
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
+
+
+def test_random_sample__with_replacement_and_shuffle():
+    file_path = Path("row_groups.parquet")
+    temp_file = Path("sample.parquet")
+    try:
+        write_row_groups(file_path, num_rows=10, row_group_size=3)
+        ParquetUtils.random_sample(file_path, temp_file, n=50, seed=1, with_replacement=True, shuffle=True)
+        ids = pq.read_table(temp_file)["id"].to_pylist()
+
+        assert len(ids) == 50
+        assert set(ids) <= set(range(10))
+        assert ids != sorted(ids)
+    finally:
+        file_path.unlink()
+        temp_file.unlink()
@@ -0,0 +1,98 @@
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from utils import TEST_DATA_DIR
+
+from data_toolset.main import absolute_path, run_request
+from data_toolset.utils import server
+
+
+@pytest.fixture
+def command_server():
+    socket_path = Path("test_server.sock")
+    command_server = server.CommandServer(socket_path, run_request, workers=4, output=server.ThreadOutput(sys.stdout))
+    thread = threading.Thread(target=command_server.serve_forever)
+    thread.start()
+    try:
+        yield command_server
+    finally:
+        command_server.shutdown()
+        thread.join()
+        command_server.server_close()
+        socket_path.unlink()
+
+
+def forward(command_server, argv):
+    # The client and the server threads share the same standard output, capturing per thread
+    output = command_server.output
+    output.start_capture()
+    exit_code = server.forward(Path(command_server.server_address), argv, TEST_DATA_DIR)
+    return exit_code, output.stop_capture()
+
+
+def test_forward(command_server):
+    with patch("sys.stdout", command_server.output):
+        assert forward(command_server, ["count", "data/avro/test.avro"]) == (0, "3\n")
+        assert forward(command_server, ["query", "t=data/parquet/test.parquet", "SELECT max(age) AS a FROM t"])[1] \
+            .endswith("│ 50  │\n└─────┘\n")
+
+
+def test_forward__concurrent(command_server):
+    file_paths = [f"data/sample-data/avro/userdata{i}.avro" for i in range(1, 6)] * 4
+    with patch("sys.stdout", command_server.output), ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda file_path: forward(command_server, ["head", file_path, "-n", "1"]),
+                                    file_paths))
+
+    for exit_code, output in results:
+        assert exit_code == 0
+        assert output.count("shape: (1, 13)") == 1
+    assert results[0] == results[5]
+
+
+def test_forward__error(command_server):
+    with patch("sys.stdout", command_server.output), patch("sys.stderr", StringIO()) as stderr:
+        exit_code, output = forward(command_server, ["count", "data/avro/missing.avro"])
+
+    assert exit_code == 1
+    assert output == ""
+    assert "FileNotFoundError" in stderr.getvalue()
+
+
+def test_forward__cache_dir(command_server):
+    cache_dir = Path("test_server_cache").absolute()
+    try:
+        with patch("sys.stdout", command_server.output):
+            assert forward(command_server, ["--cache_dir", str(cache_dir), "count", "data/avro/test.avro"]) == \
+                (0, "3\n")
+            assert forward(command_server, ["count", "data/parquet/test.parquet"])[0] == 0
+
+        assert [path.suffix for path in cache_dir.iterdir()] == [".arrow"]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_absolute_path():
+    cwd = Path("test_server_cwd").absolute()
+    try:
+        (cwd / "date=2023-01-01").mkdir(parents=True)
+        (cwd / "date=2023-01-01" / "part-0.parquet").touch()
+
+        assert absolute_path(Path("date=2023-01-01/part-0.parquet"), cwd) == cwd / "date=2023-01-01/part-0.parquet"
+        assert absolute_path(Path("t=data/test.parquet"), cwd) == Path(f"t={cwd}/data/test.parquet")
+    finally:
+        shutil.rmtree(cwd)
+
+
+def test_forward__no_server():
+    assert server.forward(Path("missing.sock"), ["count", "test.avro"], Path.cwd()) is None
+
+
+def test_serve__already_listening(command_server):
+    with pytest.raises(ValueError, match="already listening"):
+        server.serve(Path(command_server.server_address), 1, run_request)
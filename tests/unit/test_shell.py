@@ -0,0 +1,46 @@
+from io import StringIO
+from unittest.mock import patch
+
+import duckdb
+import pyarrow as pa
+
+from data_toolset.utils.base import BaseUtils
+from data_toolset.utils.shell import QueryShell
+
+
+def run_shell(con, table_names, commands):
+    captured_output = StringIO()
+    with patch("sys.stdin", StringIO(commands)), patch("sys.stdout", captured_output):
+        QueryShell(con, table_names, BaseUtils).cmdloop()
+    return captured_output.getvalue()
+
+
+def test_query_shell():
+    with duckdb.connect() as con:
+        con.execute("CREATE TABLE t AS SELECT range AS id FROM range(5)")
+        output = run_shell(con, ["t"], "SELECT max(id) AS max_id\nFROM t;\n.timer off\nSELECT 42 AS answer;\n")
+
+    assert "max_id" in output and "│ 4      │" in output
+    assert "answer" in output and "42" in output
+    assert output.count("Run Time: ") == 1
+
+
+def test_query_shell__commands():
+    with duckdb.connect() as con:
+        con.register("t", pa.table({"id": [1, 2, 3], "name": ["a", None, "c"]}))
+        output = run_shell(con, ["t"], ".tables\n.schema\n.head t 1\n.stats\n.unknown\n.quit\nSELECT 1;\n")
+
+    assert "column_type" in output and "BIGINT" in output
+    assert "shape: (1, 2)" in output
+    assert '"null_count": 1' in output
+    assert "Unknown command: .unknown" in output
+    # Nothing runs after .quit
+    assert output.count("Run Time: ") == 3
+
+
+def test_query_shell__error():
+    with duckdb.connect() as con:
+        output = run_shell(con, [], "SELECT * FROM missing;\n.schema\n")
+
+    assert "Error: Catalog Error" in output
+    assert "Specify a table" in output
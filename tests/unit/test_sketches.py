@@ -0,0 +1,143 @@
+import datetime
+import decimal
+import json
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from data_toolset.utils.sketches import (ColumnProfile, HyperLogLog, MisraGries, TDigest, load_profiles,
+                                         merge_profiles, save_profiles)
+
+
+def test_hyperloglog():
+    sketch = HyperLogLog()
+    for start in range(0, 100000, 10000):
+        sketch.update(pa.array(range(start, start + 10000)))
+    # Duplicates and nulls don't count
+    sketch.update(pa.array([1, 2, 3, None]))
+    assert sketch.estimate() == pytest.approx(100000, rel=0.03)
+
+
+def test_hyperloglog__small_cardinality():
+    sketch = HyperLogLog()
+    sketch.update(pa.array(["a", "b", "c", "a", None]))
+    assert sketch.estimate() == 3
+
+
+def test_hyperloglog__merge():
+    left, right = HyperLogLog(), HyperLogLog()
+    left.update(pa.array(range(0, 30000)))
+    right.update(pa.array(range(20000, 50000)))
+    left.merge(right)
+    assert left.estimate() == pytest.approx(50000, rel=0.03)
+
+
+def test_hyperloglog__merge_different_hash_function():
+    left = HyperLogLog()
+    right = HyperLogLog.from_dict({**HyperLogLog().to_dict(), "hash_function": "polars-0.0.0"})
+    with pytest.raises(ValueError, match="different hash functions"):
+        left.merge(right)
+
+
+def test_tdigest():
+    values = np.random.default_rng(42).normal(size=200000)
+    sketch = TDigest()
+    for chunk in np.array_split(values, 20):
+        sketch.update(pa.array(chunk))
+
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        assert sketch.quantile(q) == pytest.approx(np.quantile(values, q), abs=0.02)
+    assert sketch.quantile(0) == values.min()
+    assert sketch.quantile(1) == values.max()
+    assert len(sketch.means) < 200
+
+
+def test_tdigest__merge():
+    values = np.arange(100000, dtype=np.float64)
+    left, right = TDigest(), TDigest()
+    left.update(pa.array(values[::2]))
+    right.update(pa.array(values[1::2]))
+    left.merge(right)
+    assert left.quantile(0.5) == pytest.approx(50000, rel=0.01)
+
+
+def test_tdigest__empty():
+    sketch = TDigest()
+    sketch.update(pa.array([None, float("nan")], type=pa.float64()))
+    assert sketch.quantile(0.5) is None
+
+
+def test_misra_gries():
+    values = ["a"] * 500 + ["b"] * 300 + [str(i) for i in range(1000)]
+    sketch = MisraGries(capacity=10)
+    for start in range(0, len(values), 250):
+        sketch.update(pa.array(values[start:start + 250]))
+
+    top = sketch.top(2)
+    assert [value for value, _ in top] == ["a", "b"]
+    # Counts are lower bounds, off by at most N / (capacity + 1)
+    assert 500 - len(values) / 11 <= top[0][1] <= 500
+    assert 300 - len(values) / 11 <= top[1][1] <= 300
+
+
+def test_misra_gries__merge():
+    left, right = MisraGries(capacity=4), MisraGries(capacity=4)
+    left.update(pa.array([1, 1, 1, 2]))
+    right.update(pa.array([1, 3, 3]))
+    left.merge(right)
+    assert left.top(2) == [(1, 4), (3, 2)]
+
+
+@pytest.mark.parametrize("values", [
+    [1, 1, 2],
+    ["1", "1", "2"],
+    [b"a", b"a", b"b"],
+    [datetime.date(2024, 1, 1), datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)],
+    [decimal.Decimal("1.50"), decimal.Decimal("1.50"), decimal.Decimal("2.00")],
+])
+def test_misra_gries__json_round_trip(values):
+    sketch = MisraGries()
+    sketch.update(pa.array(values))
+    loaded = MisraGries.from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+    assert loaded.top(2) == sketch.top(2) == [(values[0], 2), (values[2], 1)]
+    assert loaded.value_type == sketch.value_type
+
+
+@pytest.mark.parametrize(
+    ("data_type", "expected_keys"),
+    [
+        (pa.int64(), {"distinct_count", "quantiles", "top_k"}),
+        (pa.string(), {"distinct_count", "top_k"}),
+        (pa.list_(pa.int64()), set()),
+    ],
+)
+def test_column_profile__for_type(data_type, expected_keys):
+    assert set(ColumnProfile.for_type(data_type).summary()) == expected_keys
+
+
+def test_save_and_load_profiles():
+    profile = ColumnProfile.for_type(pa.int64())
+    profile.update(pa.array([1, 2, 2, 3]))
+    temp_file = Path("profiles.json")
+    try:
+        save_profiles({"x": profile}, temp_file)
+        with temp_file.open() as f:
+            assert set(json.load(f)["x"]) == {"distinct", "quantiles", "frequent"}
+        loaded = load_profiles(temp_file)
+    finally:
+        temp_file.unlink()
+
+    assert loaded["x"].summary() == profile.summary()
+
+
+def test_merge_profiles():
+    first, second = ColumnProfile.for_type(pa.int64()), ColumnProfile.for_type(pa.int64())
+    first.update(pa.array([1, 2, 3]))
+    second.update(pa.array([3, 4, 5, 5]))
+    merged = merge_profiles([{"x": first}, {"x": second}])
+
+    assert merged["x"].summary()["distinct_count"] == 5
+    assert sorted(merged["x"].summary()["top_k"][:2]) == [(3, 2), (5, 2)]
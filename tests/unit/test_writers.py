@@ -0,0 +1,132 @@
+import datetime
+import decimal
+import gzip
+import json
+from pathlib import Path
+
+import fastavro
+import pyarrow as pa
+import pytest
+
+from data_toolset.utils import writers
+
+TABLE = pa.table({
+    "id": pa.array([1, 2], type=pa.int32()),
+    "name": ["a", None],
+    "price": pa.array([decimal.Decimal("1.50"), decimal.Decimal("2.25")], type=pa.decimal128(5, 2)),
+    "created": pa.array([datetime.datetime(2023, 1, 2, 3, 4, 5), None], type=pa.timestamp("us")),
+    "tags": [["x"], []],
+    "attributes": pa.array([[("k", 1)], []], type=pa.map_(pa.string(), pa.int64())),
+    "point": [{"x": 1.0, "y": 2.0}, {"x": 3.0, "y": 4.0}],
+})
+
+
+def test_to_avro_schema():
+    schema = writers.to_avro_schema(pa.schema([
+        pa.field("id", pa.int64(), nullable=False),
+        pa.field("point", pa.struct([pa.field("x", pa.float32(), nullable=False)]), nullable=False),
+        pa.field("other", pa.struct([pa.field("x", pa.date32())])),
+    ]))
+
+    assert schema == {"type": "record", "name": "Record", "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "point", "type": {"type": "record", "name": "Record_point",
+                                   "fields": [{"name": "x", "type": "float"}]}},
+        {"name": "other", "type": ["null", {"type": "record", "name": "Record_other", "fields": [
+            {"name": "x", "type": ["null", {"type": "int", "logicalType": "date"}]},
+        ]}]},
+    ]}
+
+
+def test_to_avro_schema__unsupported():
+    with pytest.raises(ValueError):
+        writers.to_avro_schema(pa.schema([("duration", pa.duration("s"))]))
+
+
+def test_write_avro():
+    temp_file = Path("writers.avro")
+    try:
+        writers.write_avro(TABLE.to_batches(max_chunksize=1), TABLE.schema, temp_file)
+        with open(temp_file, "rb") as f:
+            records = list(fastavro.reader(f))
+
+        assert records == [
+            {"id": 1, "name": "a", "price": decimal.Decimal("1.50"), "created": datetime.datetime(2023, 1, 2, 3, 4, 5),
+             "tags": ["x"], "attributes": {"k": 1}, "point": {"x": 1.0, "y": 2.0}},
+            {"id": 2, "name": None, "price": decimal.Decimal("2.25"), "created": None,
+             "tags": [], "attributes": {}, "point": {"x": 3.0, "y": 4.0}},
+        ]
+    finally:
+        temp_file.unlink()
+
+
+def test_write_ndjson():
+    temp_file = Path("writers.jsonl")
+    try:
+        writers.write_ndjson(TABLE.to_batches(max_chunksize=1), temp_file)
+        lines = temp_file.read_text(encoding="utf-8").splitlines()
+
+        assert [json.loads(line) for line in lines] == [
+            {"id": 1, "name": "a", "price": "1.50", "created": "2023-01-02T03:04:05", "tags": ["x"],
+             "attributes": {"k": 1}, "point": {"x": 1.0, "y": 2.0}},
+            {"id": 2, "name": None, "price": "2.25", "created": None, "tags": [], "attributes": {},
+             "point": {"x": 3.0, "y": 4.0}},
+        ]
+    finally:
+        temp_file.unlink()
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+def test_write_json__nested(pretty):
+    # Written by polars unless pretty, both must give the same records
+    table = pa.table({
+        "id": [1, 2],
+        "text": ["é \"quoted\"\nline", None],
+        "point": [{"x": 1.5, "tags": ["a", None]}, None],
+    })
+    temp_file = Path("writers.json")
+    try:
+        writers.write_json(table.to_batches(max_chunksize=1), temp_file, pretty)
+        records = json.loads(temp_file.read_text(encoding="utf-8"))
+
+        assert records == [
+            {"id": 1, "text": "é \"quoted\"\nline", "point": {"x": 1.5, "tags": ["a", None]}},
+            {"id": 2, "text": None, "point": None},
+        ]
+    finally:
+        temp_file.unlink()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_write_ndjson__compression(compression):
+    temp_file = Path(f"writers.jsonl.{compression}")
+    try:
+        writers.write_ndjson(TABLE.to_batches(max_chunksize=1), temp_file, compression)
+        with pa.CompressedInputStream(str(temp_file), compression) as f:
+            lines = f.read().decode("utf-8").splitlines()
+
+        assert [json.loads(line)["id"] for line in lines] == [1, 2]
+    finally:
+        temp_file.unlink()
+
+
+def test_write_json__compression():
+    temp_file = Path("writers.json.gz")
+    try:
+        writers.write_json(TABLE.to_batches(max_chunksize=1), temp_file, compression="gzip")
+        with gzip.open(temp_file, "rt", encoding="utf-8") as f:
+            records = json.load(f)
+
+        assert [record["point"] for record in records] == [{"x": 1.0, "y": 2.0}, {"x": 3.0, "y": 4.0}]
+    finally:
+        temp_file.unlink()
+
+
+def test_write_json__unsupported_compression():
+    with pytest.raises(ValueError, match="Unsupported compression"):
+        writers.write_json(TABLE.to_batches(), Path("writers.json"), compression="bz2")
+
+
+def test_write_batches__unsupported_format():
+    with pytest.raises(ValueError, match="Unsupported output format"):
+        writers.write_batches(TABLE.to_batches(), TABLE.schema, Path("output.txt"))